@@ -0,0 +1,18 @@
+from django.contrib.auth.forms import PasswordResetForm
+from django.utils import timezone
+
+from book.jobs import enqueue
+
+
+# This form sends the password reset emails through the job queue. Only the user and how to render the email are
+# enqueued: the token and the email are made by the worker (see send_password_reset in book/tasks.py), so no live
+# token is stored in the queue. The key makes the requests of a user in the same hour send a single email.
+class QueuedPasswordResetForm(PasswordResetForm):
+    def send_mail(self, subject_template_name, email_template_name, context, from_email, to_email,
+                  html_email_template_name=None):
+        user = context['user']
+        enqueue('send_password_reset', key='password-reset:%d:%s' % (user.pk, timezone.now().strftime('%Y%m%d%H')),
+                user_id=user.pk, domain=context['domain'], site_name=context['site_name'],
+                protocol=context['protocol'], subject_template_name=subject_template_name,
+                email_template_name=email_template_name, html_email_template_name=html_email_template_name,
+                from_email=from_email)
@@ -1,3 +1,62 @@
+import re
+import unittest.mock
+
 from django.test import TestCase
+from django.urls import reverse
+from django.core import mail
+from django.core.cache import cache
+from django.utils import timezone
+
+from django.contrib.auth.models import User
+
+from book.jobs import run_due_jobs
+from book.models import Job
+from book.wallets import get_wallet
+
+
+# This class contains a set of tests that will verify the registration of a new user
+class TestSignUp(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    # The wallet is created with the user, the new user has a wallet as soon as the signup returns
+    def test_signup_creates_wallet(self):
+        response = self.client.post(reverse('accounts:signup'), {'username': 'Reader', 'password1': 'Pa55word!x',
+                                                                  'password2': 'Pa55word!x'})
+        self.assertRedirects(response, reverse('accounts:login'))
+        user = User.objects.get(username='Reader')
+        self.assertEqual(get_wallet(user.id).balance, 50.0)
+        self.assertFalse(Job.objects.exists())
+
+
+# This class contains a set of tests that will verify the password reset emails, sent by the job queue
+class TestPasswordReset(TestCase):
+    def test_reset_email_is_queued(self):
+        user = User.objects.create_user(username='Reader', email='reader@example.com', password='Pa55word!x')
+        # The time is frozen, so the two requests are made in the same hour
+        now = timezone.now()
+        with unittest.mock.patch('accounts.forms.timezone.now', return_value=now):
+            for _ in range(2):
+                response = self.client.post(reverse('accounts:password_reset'), {'email': 'reader@example.com'})
+                self.assertRedirects(response, reverse('accounts:password_reset_done'))
+        self.assertEqual(len(mail.outbox), 0)
+        # The second request is in the same hour, the email is only queued once. The queue holds no token.
+        job = Job.objects.get()
+        self.assertEqual(job.key, 'password-reset:%d:%s' % (user.pk, now.strftime('%Y%m%d%H')))
+        self.assertEqual(job.kwargs['user_id'], user.pk)
+        self.assertNotIn('token', job.kwargs)
+        self.assertEqual(run_due_jobs(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['reader@example.com'])
+        # The link of the email resets the password
+        link = re.search(r'http://testserver(/accounts/password_reset/\S+/)', mail.outbox[0].body).group(1)
+        response = self.client.get(link, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['validlink'])
 
-# Create your tests here.
+    def test_inactive_user_gets_no_email(self):
+        user = User.objects.create_user(username='Reader', email='reader@example.com', password='Pa55word!x')
+        self.client.post(reverse('accounts:password_reset'), {'email': 'reader@example.com'})
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        self.assertEqual(run_due_jobs(), 1)
+        self.assertEqual(len(mail.outbox), 0)
@@ -1,6 +1,7 @@
 from django.contrib.auth.forms import UserCreationForm
 from django.urls import reverse_lazy
 from django.views import generic
+from django.db import transaction
 from django.shortcuts import HttpResponseRedirect
 from book.models import Wallet
 
@@ -11,8 +12,10 @@ class SignUpView(generic.CreateView):
     success_url = reverse_lazy('accounts:login')
     template_name = "registration/signup.html"
 
+    # The wallet of the new user is created in the transaction of the user: it is a single insert, and a wallet created
+    # later by the worker would leave the user without wallet (cached as missing by the web processes) until then.
     def form_valid(self, form):
-        self.object = form.save()
-        wallet = Wallet(owner=self.object, balance=50.0)
-        wallet.save()
+        with transaction.atomic():
+            self.object = form.save()
+            Wallet.objects.create(owner=self.object, balance=50.0)
         return HttpResponseRedirect(self.get_success_url())
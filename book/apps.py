@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class BookConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'book'
+
+    # The signals are imported here in order to connect them once the models are loaded, and the tasks in order to
+    # register them in the job queue
+    def ready(self):
+        from . import signals, tasks
@@ -0,0 +1,208 @@
+import functools
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core import checks
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.finders import BaseFinder
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+
+# brotli is not a dependency of the project: pip install brotli. Without it only the gzip variants are written.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# The stylesheet of each page: the fonts, then the css files of the page, bundled and minified in one file
+BUNDLES = {
+    'book/bundles/shop.css': ['book/shop.css'],
+    'book/bundles/books.css': ['book/shop.css', 'book/books.css'],
+    'book/bundles/create.css': ['book/create.css'],
+    'book/bundles/delete.css': ['book/delete.css'],
+    'book/bundles/index.css': ['book/index.css'],
+    'book/bundles/login.css': ['book/login.css'],
+    'book/bundles/signup.css': ['book/singup.css'],
+}
+
+# The fonts of the website, served from our static files instead of Google Fonts: (family, weight, file). The files
+# are downloaded once with the download_fonts command and committed. Each bundle declares the fonts of its css files
+# with font-display: swap, and the pages preload them (see the preload_fonts tag). collectstatic fails while a file is
+# missing, the url of the font in the bundle can not be hashed.
+FONTS = [
+    ('Golos Text', 600, 'book/fonts/golos-text-600.woff2'),
+    ('Oswald', 300, 'book/fonts/oswald-300.woff2'),
+    ('Comfortaa', 700, 'book/fonts/comfortaa-700.woff2'),
+]
+
+# The bundles are built in this directory, where the development server and collectstatic find them
+ASSETS_BUILD_DIR = Path(getattr(settings, 'ASSETS_BUILD_DIR', settings.BASE_DIR / '.assets'))
+
+# The files compressed by collectstatic, the other formats (images, fonts) are already compressed
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.json', '.html')
+
+# Number of seconds a static file without a hash in its name stays in the cache of the browsers
+STATIC_MAX_AGE = getattr(settings, 'STATIC_MAX_AGE', 60)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+# This def removes the comments and the whitespace of a stylesheet. The spaces before a ':' are kept, "a :hover" and
+# "a:hover" are two different selectors.
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+
+# The fonts used by a stylesheet, in the order of FONTS
+def used_fonts(css):
+    return [(family, weight, path) for family, weight, path in FONTS
+            if re.search(r'font-family:[^;}]*["\']%s["\']' % re.escape(family), css)]
+
+
+def read_sources(bundle):
+    parts = []
+    for path in BUNDLES[bundle]:
+        with open(finders.find(path), encoding='utf-8') as source:
+            parts.append(source.read())
+    return '\n'.join(parts)
+
+
+# The files of the fonts of a bundle, preloaded by its pages. The css files are read once per process, not for each
+# request.
+@functools.lru_cache(maxsize=None)
+def bundle_fonts(bundle):
+    return [path for _, _, path in used_fonts(read_sources(bundle))]
+
+
+# The @font-face rules of the fonts used by a stylesheet, with urls relative to the bundle
+def font_faces(bundle, css):
+    return '\n'.join(
+        "@font-face { font-family: '%s'; font-style: normal; font-weight: %d; font-display: swap; "
+        "src: local('%s'), url('%s') format('woff2'); }" % (
+            family, weight, family, posixpath.relpath(path, posixpath.dirname(bundle)))
+        for family, weight, path in used_fonts(css))
+
+
+def build_bundle(bundle):
+    css = read_sources(bundle)
+    return minify_css(font_faces(bundle, css) + '\n' + css)
+
+
+# This finder gives the bundles to the development server and to collectstatic. Each bundle is built again when it is
+# requested, so a change of a css file is seen at once in development.
+class BundleFinder(BaseFinder):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.storage = FileSystemStorage(location=ASSETS_BUILD_DIR)
+
+    def build(self, bundle):
+        path = ASSETS_BUILD_DIR / bundle
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(build_bundle(bundle), encoding='utf-8')
+        return str(path)
+
+    # A font file that is not committed is reported by the checks of the development server
+    def check(self, **kwargs):
+        return [checks.Warning('The font file %s is missing.' % path, hint='Run python manage.py download_fonts and '
+                               'commit the files.', id='book.W001')
+                for _, _, path in FONTS if not finders.find(path)]
+
+    def find(self, path, all=False):
+        if path not in BUNDLES:
+            return []
+        path = self.build(path)
+        return [path] if all else path
+
+    def list(self, ignore_patterns):
+        for bundle in BUNDLES:
+            self.build(bundle)
+            yield bundle, self.storage
+
+
+# This storage is used by collectstatic in production. The files are copied with a hash of their content in their name
+# (the references between css files are rewritten) and a manifest tells the {% static %} tag the hashed name of each
+# file. A gzip variant (and a brotli variant when brotli is installed) of each text file is written next to it, so the
+# compression is done once and not for each request.
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(paths) | set(self.hashed_files.values()):
+            if name.endswith(COMPRESSED_EXTENSIONS) and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name):
+        with self.open(name) as original:
+            content = original.read()
+        variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content)))
+        for extension, compressed in variants:
+            # A variant bigger than the file is useless, a small file can grow when compressed
+            if len(compressed) < len(content):
+                with open(self.path(name + extension), 'wb') as variant:
+                    variant.write(compressed)
+
+
+# This middleware serves the collected static files when there is no web server in front of django (SERVE_STATIC
+# setting). A file with a hash in its name never changes: it is sent with a far-future immutable Cache-Control, the
+# browsers never revalidate it. The precompressed variant accepted by the browser is sent when it exists.
+class StaticFilesMiddleware:
+    ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = '/' + settings.STATIC_URL.lstrip('/')
+
+    def __call__(self, request):
+        if (not getattr(settings, 'SERVE_STATIC', False) or not request.path.startswith(self.prefix)
+                or request.method not in ('GET', 'HEAD')):
+            return self.get_response(request)
+        return self.serve(request, request.path[len(self.prefix):])
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except ValueError:
+            raise Http404(name)
+        if not os.path.isfile(path):
+            raise Http404(name)
+        accepted = {value.split(';')[0].strip() for value in request.headers.get('Accept-Encoding', '').split(',')}
+        encoding = None
+        for candidate, extension in self.ENCODINGS:
+            if candidate in accepted and os.path.isfile(path + extension):
+                encoding, path = candidate, path + extension
+                break
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        # FileResponse names the file it sends, which would be the compressed variant
+        response.headers.pop('Content-Disposition', None)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Vary'] = 'Accept-Encoding'
+        if is_hashed(name):
+            response['Cache-Control'] = 'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+        else:
+            response['Cache-Control'] = 'public, max-age=%d' % STATIC_MAX_AGE
+        return response
+
+
+# A hashed name is one of the values of the manifest written by collectstatic
+def is_hashed(name):
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', None)
+    if hashed_files is None:
+        return False
+    if not hasattr(staticfiles_storage, '_hashed_names'):
+        staticfiles_storage._hashed_names = set(hashed_files.values())
+    return name in staticfiles_storage._hashed_names
@@ -0,0 +1,33 @@
+from django.conf import settings
+
+CART_SESSION_KEY = 'cart'
+# The checkout reads and updates every book of the cart at once, the size of the cart bounds the size of its queries
+CART_MAX_BOOKS = getattr(settings, 'CART_MAX_BOOKS', 100)
+
+
+# The cart is kept in the session as the list of the ids of its books, in the order they were added. Nothing is
+# written in the database before the checkout.
+def get_cart(request):
+    return list(request.session.get(CART_SESSION_KEY, []))
+
+
+# This def adds a book to the cart and returns False when the cart is full. A book already in the cart is not added
+# twice.
+def add_to_cart(request, book_id):
+    cart = get_cart(request)
+    if book_id in cart:
+        return True
+    if len(cart) >= CART_MAX_BOOKS:
+        return False
+    cart.append(book_id)
+    request.session[CART_SESSION_KEY] = cart
+    return True
+
+
+def remove_from_cart(request, *book_ids):
+    cart = get_cart(request)
+    request.session[CART_SESSION_KEY] = [book_id for book_id in cart if book_id not in book_ids]
+
+
+def clear_cart(request):
+    request.session.pop(CART_SESSION_KEY, None)
@@ -0,0 +1,10 @@
+from django.utils.functional import SimpleLazyObject
+
+from .wallets import get_request_wallet
+
+
+# This context processor gives the wallet of the connected user to every template. The wallet is only loaded if the
+# template uses it.
+def wallet(request):
+    return {'wallet': SimpleLazyObject(lambda: get_request_wallet(request))}
+
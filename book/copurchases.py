@@ -0,0 +1,130 @@
+import itertools
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Book, BookRecommendation
+from .recommendations import MAX_BASKET, RECOMMENDATIONS_PER_BOOK, invalidate_recommendations
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is only needed by the batch build, the pages never import this module
+    np = None
+
+# The number of pairs counted at once, it bounds the memory used by the expansion of the baskets (16 bytes per pair)
+CHUNK_PAIRS = getattr(settings, 'RECOMMENDATIONS_CHUNK_PAIRS', 10_000_000)
+
+
+# The batch build. The purchases are two arrays of integers (user ids, book ids), one item per edge of the
+# purchasers table. Every step works on whole arrays, there is no python loop over the purchases:
+# - the edges are sorted by user, so the basket of each user is a contiguous block,
+# - each block of n books is expanded into its n² (book, other book) pairs with np.repeat,
+# - each pair is encoded as one integer (book * base + other book) and the pairs are counted with np.unique,
+# - the pairs are sorted by book then by count, and the first k pairs of each book are kept.
+# The baskets are expanded by chunks of about CHUNK_PAIRS pairs, whose counts are merged.
+
+# This def returns the position of each item in its block, for blocks of the given sizes laid end to end
+def positions_in_blocks(sizes):
+    ends = np.cumsum(sizes)
+    return np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - sizes, sizes)
+
+
+# This def returns the encoded (book, other book) pairs of the given baskets, the pairs of a book with itself excluded
+def basket_pairs(books, starts, sizes, base):
+    # The position, in the sorted edges, of each book of the baskets
+    edges = np.repeat(starts, sizes) + positions_in_blocks(sizes)
+    # Each book is repeated once per book of its basket, then paired with each of them in turn
+    repeats = np.repeat(sizes, sizes)
+    left = np.repeat(books[edges], repeats)
+    right = books[np.repeat(np.repeat(starts, sizes), repeats) + positions_in_blocks(repeats)]
+    distinct = left != right
+    return left[distinct] * base + right[distinct]
+
+
+# This def merges two sets of counted pairs, each sorted by pair. The stable sort of two sorted runs is a merge.
+def merge_counts(keys, counts, new_keys, new_counts):
+    if not len(keys):
+        return new_keys, new_counts
+    keys, counts = np.concatenate([keys, new_keys]), np.concatenate([counts, new_counts])
+    order = np.argsort(keys, kind='stable')
+    keys, counts = keys[order], counts[order]
+    firsts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[firsts], np.add.reduceat(counts, firsts)
+
+
+# This def counts the co-purchases of the given purchase edges and returns three arrays: book, recommended book and
+# score (the number of users who purchased both), with the k best recommendations of each book.
+def co_purchases(users, books, k=RECOMMENDATIONS_PER_BOOK, max_basket=MAX_BASKET, chunk_pairs=CHUNK_PAIRS):
+    users = np.asarray(users, dtype=np.int64)
+    books = np.asarray(books, dtype=np.int64)
+    empty = np.empty(0, dtype=np.int64)
+    if not len(books):
+        return empty, empty, empty
+    order = np.argsort(users, kind='stable')
+    users, books = users[order], books[order]
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    sizes = np.diff(np.r_[starts, len(users)])
+    kept = (sizes > 1) & (sizes <= max_basket)
+    starts, sizes = starts[kept], sizes[kept]
+
+    base = int(books.max()) + 1
+    keys, counts = empty, empty
+    # The baskets are cut in chunks of about chunk_pairs pairs (a basket is never split)
+    chunk_ids = np.cumsum(sizes.astype(np.int64) ** 2) // max(chunk_pairs, 1)
+    bounds = np.flatnonzero(np.r_[True, chunk_ids[1:] != chunk_ids[:-1], True]) if len(sizes) else []
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        chunk_keys, chunk_counts = np.unique(basket_pairs(books, starts[first:last], sizes[first:last], base),
+                                             return_counts=True)
+        keys, counts = merge_counts(keys, counts, chunk_keys, chunk_counts)
+
+    left, right = keys // base, keys % base
+    # The pairs are sorted by book, then by decreasing score, then by recommended book. They are already sorted by
+    # book and recommended book, so a stable sort on a single (book, decreasing score) key is enough.
+    top = int(counts.max()) if len(counts) else 0
+    order = np.argsort(left * (top + 1) + (top - counts), kind='stable')
+    left, right, counts = left[order], right[order], counts[order]
+    groups = np.flatnonzero(np.r_[True, left[1:] != left[:-1]]) if len(left) else empty
+    best = positions_in_blocks(np.diff(np.r_[groups, len(left)])) < k
+    return left[best], right[best], counts[best]
+
+
+# This def reads the purchase edges of the purchasers table in two arrays, without a python object per row
+def load_purchases(batch_size=100_000):
+    edges = Book.purchasers.through.objects.order_by().values_list('user_id', 'book_id')
+    chunks, rows = [], []
+    for row in edges.iterator(chunk_size=batch_size):
+        rows.append(row)
+        if len(rows) == batch_size:
+            chunks.append(np.array(rows, dtype=np.int64))
+            rows = []
+    chunks.append(np.array(rows, dtype=np.int64).reshape(-1, 2))
+    edges = np.concatenate(chunks)
+    return edges[:, 0], edges[:, 1]
+
+
+# This def replaces the whole recommendation table, in one transaction so the pages never see an empty table
+def store_recommendations(books, recommended, scores, batch_size=5000):
+    with transaction.atomic():
+        BookRecommendation.objects.all().delete()
+        rows = zip(books.tolist(), recommended.tolist(), scores.tolist())
+        while batch := list(itertools.islice(rows, batch_size)):
+            BookRecommendation.objects.bulk_create([
+                BookRecommendation(book_id=book_id, recommended_id=other, score=score)
+                for book_id, other, score in batch])
+        invalidate_recommendations()
+
+
+# This def runs the batch build and returns the number of rows stored and the time of each step
+def build_recommendations(k=RECOMMENDATIONS_PER_BOOK, max_basket=MAX_BASKET):
+    timings = {}
+    start = time.perf_counter()
+    users, books = load_purchases()
+    timings['load'] = time.perf_counter() - start
+    start = time.perf_counter()
+    result = co_purchases(users, books, k, max_basket)
+    timings['compute'] = time.perf_counter() - start
+    start = time.perf_counter()
+    store_recommendations(*result)
+    timings['store'] = time.perf_counter() - start
+    return len(result[0]), timings
@@ -0,0 +1,53 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Book
+
+EXPORT_FIELDS = ['id', 'title', 'author', 'description', 'gender', 'num_pages', 'price', 'publication_date', 'owner']
+EXPORT_FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+EXPORT_SCOPES = ['shop', 'owned', 'purchased']
+
+
+# This def returns the books of an export: the books on sale for the user, the books he owns or the books he purchased.
+def export_queryset(scope, user):
+    if scope == 'owned':
+        return Book.objects.filter(owner_id=user.id)
+    if scope == 'purchased':
+        return Book.objects.filter(purchasers__id=user.id)
+    return Book.objects.exclude(owner_id=user.id)
+
+
+# This def reads the rows of a queryset chunk by chunk, ordered by id. Each chunk is a new "WHERE id > last_id LIMIT n"
+# query, so only one chunk is in memory at a time, even with the database drivers that load the whole result of a
+# query in memory (MySQL).
+def iter_rows(queryset, chunk_size=2000):
+    columns = [field if field != 'owner' else 'owner__username' for field in EXPORT_FIELDS]
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by('id').values_list(*columns)[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
+# The csv module can only write in a file. This file-like object just returns what is written, so each line can be
+# yielded as soon as it is ready.
+class Echo:
+    def write(self, value):
+        return value
+
+
+# This generator yields the lines of an export, starting with the csv header, so the first byte is sent before the
+# first query is made.
+def export_lines(queryset, fmt, chunk_size=2000):
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        for row in iter_rows(queryset, chunk_size):
+            yield writer.writerow(row)
+    else:
+        for row in iter_rows(queryset, chunk_size):
+            yield json.dumps(dict(zip(EXPORT_FIELDS, row)), cls=DjangoJSONEncoder) + '\n'
@@ -0,0 +1,10 @@
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+
+# This def returns a "CASE column WHEN key THEN value ... END" expression, used to change many rows with a single
+# update (the sales rollups, the wallet credits, the counts of the search terms). It is written in SQL with parameters:
+# the ORM resolves each When as a filter, which costs more than the update itself for a cart of a few dozen books.
+def case(column, values, output_field):
+    sql = 'CASE %s %s END' % (connection.ops.quote_name(column), ' '.join(['WHEN %s THEN %s'] * len(values)))
+    return RawSQL(sql, [param for item in values.items() for param in item], output_field=output_field)
@@ -0,0 +1,101 @@
+from bisect import bisect_right
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+from .models import Book, BookFacet
+from .versions import get_catalog_version
+
+FACETS_CACHE_TIMEOUT = getattr(settings, 'FACETS_CACHE_TIMEOUT', 3600)
+
+# The lower bound of each price bucket. The buckets are stored by number: the facets must be rebuilt
+# (rebuild_facets) when the bounds are changed.
+PRICE_BUCKETS = [0, 5, 10, 20, 50, 100]
+
+
+def price_bucket(price):
+    return max(bisect_right(PRICE_BUCKETS, float(price)) - 1, 0)
+
+
+def price_bucket_label(bucket):
+    if bucket + 1 < len(PRICE_BUCKETS):
+        return '%s - %s €' % (PRICE_BUCKETS[bucket], PRICE_BUCKETS[bucket + 1])
+    return '%s € and more' % PRICE_BUCKETS[bucket]
+
+
+def facet_key(gender, price):
+    return gender, price_bucket(price)
+
+
+# This def returns the number of books of each facet in a list of books
+def count_books(books):
+    return Counter(facet_key(book.gender, book.price) for book in books)
+
+
+# This def adds the given numbers (negative to remove books) to the counts of the facets. Each count is changed with
+# an "UPDATE ... SET count = count + n", so concurrent changes are never lost. A missing facet is created, and when
+# another request created it first, the update is made again.
+def change_facets(deltas):
+    for (gender, bucket), delta in deltas.items():
+        if not delta:
+            continue
+        facets = BookFacet.objects.filter(gender=gender, price_bucket=bucket)
+        if facets.update(count=F('count') + delta) or delta < 0:
+            continue
+        try:
+            with transaction.atomic():
+                BookFacet.objects.create(gender=gender, price_bucket=bucket, count=delta)
+        except IntegrityError:
+            facets.update(count=F('count') + delta)
+
+
+# This def counts the books of each facet from the Book table, with a single GROUP BY query
+def count_catalog():
+    bucket = Case(*[When(price__lt=bound, then=Value(number)) for number, bound in enumerate(PRICE_BUCKETS[1:])],
+                  default=Value(len(PRICE_BUCKETS) - 1), output_field=IntegerField())
+    rows = Book.objects.annotate(bucket=bucket).values_list('gender', 'bucket').annotate(count=Count('id'))
+    return Counter({(gender, bucket): count for gender, bucket, count in rows})
+
+
+def facets_cache_key():
+    return 'facets:%s' % get_catalog_version()
+
+
+# The facets are given to the templates as the number of books by gender and the number of books by price bucket
+def summarize(rows):
+    genders, prices = Counter(), Counter()
+    for gender, bucket, count in rows:
+        if count > 0:
+            genders[gender] += count
+            prices[bucket] += count
+    return {'genders': sorted(genders.items(), key=lambda item: (-item[1], item[0])),
+            'prices': [(price_bucket_label(bucket), prices[bucket]) for bucket in sorted(prices)]}
+
+
+# This def returns the facets of the catalog. They are cached for the current version of the catalog, which changes
+# with every book saved or deleted, and are otherwise read from the few rows of the facet table.
+def get_facets():
+    key = facets_cache_key()
+    facets = cache.get(key)
+    if facets is None:
+        facets = summarize(BookFacet.objects.values_list('gender', 'price_bucket', 'count'))
+        cache.set(key, facets, FACETS_CACHE_TIMEOUT)
+    return facets
+
+
+# This def must be called when the facets are changed without a change of the catalog (rebuild_facets)
+def invalidate_facets():
+    transaction.on_commit(lambda: cache.delete(facets_cache_key()))
+
+
+# The same def for the async views
+async def aget_facets():
+    key = facets_cache_key()
+    facets = cache.get(key)
+    if facets is None:
+        facets = summarize([row async for row in BookFacet.objects.values_list('gender', 'price_bucket', 'count')])
+        cache.set(key, facets, FACETS_CACHE_TIMEOUT)
+    return facets
@@ -8,6 +8,46 @@ class ConfirmationForm(forms.Form):
     pass
 
 
+# This form will store the search query and the optional filters of the search view
+class SearchForm(forms.Form):
+    q = forms.CharField(required=False)
+    gender = forms.CharField(required=False)
+    min_price = forms.FloatField(required=False, min_value=0)
+    max_price = forms.FloatField(required=False, min_value=0)
+
+
+# This form will store the optional filters and the sort order of the shop. Each sort order is the keyset of the
+# pagination, the id makes it unique.
+class ShopFilterForm(forms.Form):
+    SORTS = {
+        'date': ('publication_date', 'id'),
+        '-date': ('-publication_date', '-id'),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+        'title': ('title', 'id'),
+        'bestsellers': ('-purchase_count', '-id'),
+    }
+
+    gender = forms.CharField(required=False)
+    author = forms.CharField(required=False)
+    min_price = forms.FloatField(required=False, min_value=0)
+    max_price = forms.FloatField(required=False, min_value=0)
+    sort = forms.ChoiceField(required=False, choices=[(sort, sort) for sort in SORTS])
+
+
+# This form will store the parameters of the bestsellers api: the number of books and an optional gender
+class BestsellersForm(forms.Form):
+    limit = forms.IntegerField(required=False, min_value=1, max_value=100)
+    gender = forms.CharField(required=False)
+
+
+# This form will store the period of the sales analytics, in days
+class SalesForm(forms.Form):
+    PERIODS = [7, 30, 90, 365]
+
+    days = forms.TypedChoiceField(required=False, coerce=int, choices=[(days, days) for days in PERIODS])
+
+
 # This form will store the fields that will be modified in the book
 class EditBookForm(forms.Form):
     title = forms.CharField()
@@ -17,15 +57,15 @@ class EditBookForm(forms.Form):
     num_pages = forms.IntegerField()
     price = forms.FloatField()
 
+    # The fields are validated first, so a missing or non-numeric price or number of pages is rejected with the error
+    # of its field
     def is_valid(self):
-        try:
-            if float(self.data.get('price')) <= 0 or float(self.data.get('num_pages')) < 0:
-                return False
-        except(KeyError, ValueError):
+        if not super().is_valid():
             return False
-        return super().is_valid()
+        return self.cleaned_data['price'] > 0 and self.cleaned_data['num_pages'] >= 0
 
-    # This custom def will apply the book update in the database
+    # This custom def will apply the book update in the database. Only the edited fields are saved: the purchase count
+    # is incremented by the purchases meanwhile, and must not be overwritten with the value read with the book.
     def update_book(self, book):
         book.title = self.data['title']
         book.author = self.data['author']
@@ -33,7 +73,7 @@ class EditBookForm(forms.Form):
         book.gender = self.data['gender']
         book.num_pages = self.data['num_pages']
         book.price = self.data['price']
-        book.save()
+        book.save(update_fields=['title', 'author', 'description', 'gender', 'num_pages', 'price', 'updated_at'])
 
 
 # This class-based form will store the fields in order to create a new book
@@ -45,13 +85,12 @@ class CreateBookForm(forms.Form):
     num_pages = forms.IntegerField()
     price = forms.FloatField()
 
+    # The fields are validated first, so a missing or non-numeric price or number of pages is rejected with the error
+    # of its field
     def is_valid(self):
-        try:
-            if float(self.data.get('price')) < 0 or float(self.data.get('num_pages')) < 0:
-                return False
-        except(KeyError, ValueError):
+        if not super().is_valid():
             return False
-        return super().is_valid()
+        return self.cleaned_data['price'] >= 0 and self.cleaned_data['num_pages'] >= 0
 
     # This custom def will apply the book create in the database
     def create_book(self, user):
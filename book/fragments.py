@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+BOOK_CARD_CACHE_TIMEOUT = getattr(settings, 'BOOK_CARD_CACHE_TIMEOUT', 3600)
+
+
+def version_cache_key(book_id):
+    return 'book-version:%s' % book_id
+
+
+# This def returns the current version of each book. A missing version (new book or evicted key) is built from the
+# clock, so a fragment rendered for an older version of the book can never be used again.
+def get_versions(book_ids):
+    keys = {version_cache_key(book_id): book_id for book_id in book_ids}
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            cache.add(key, version, None)
+        versions.update(cache.get_many(missing))
+    return {keys[key]: version for key, version in versions.items()}
+
+
+# This def must be called each time a book is saved or deleted. The version is bumped once the transaction is
+# committed, otherwise another request could cache the old card again under the new version.
+def bump_version(book_id):
+    def bump():
+        try:
+            cache.incr(version_cache_key(book_id))
+        except ValueError:
+            cache.set(version_cache_key(book_id), time.time_ns(), None)
+    transaction.on_commit(bump)
+
+
+# This def gives a 'card' attribute to each book: the html of the part of the book card that is the same for every
+# viewer. The cards are read from the cache with two round trips for the whole page (versions then cards), and only
+# the missing ones are rendered and stored. The update date of the book is part of the key: a book read from a replica
+# that is late is not cached under the version of the new book.
+def render_cards(books, template_name):
+    books = list(books)
+    versions = get_versions([book.id for book in books])
+    keys = {book.id: 'book-card:%s:%s:%s:%s' % (template_name, book.id, versions.get(book.id),
+                                                book.updated_at.timestamp()) for book in books}
+    cards = cache.get_many(keys.values())
+    template = None
+    rendered = {}
+    for book in books:
+        card = cards.get(keys[book.id])
+        if card is None:
+            template = template or get_template(template_name)
+            card = rendered[keys[book.id]] = template.render({'book': book})
+        book.card = mark_safe(card)
+    if rendered:
+        cache.set_many(rendered, BOOK_CARD_CACHE_TIMEOUT)
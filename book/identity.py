@@ -0,0 +1,44 @@
+from .models import Book
+
+
+# This class is the identity map of a request: each object is loaded once, the first time it is asked for, and the
+# same instance is given to every part of the view (dispatch, get_context_data, form_valid, the templates...). A
+# missing object is kept too (as None), so it is not looked for twice either. The objects are read once: a change made
+# to the database by the request without the instance of the map is not seen by the rest of the request.
+class IdentityMap:
+    def __init__(self):
+        self.objects = {}
+
+    # The object is found by its model and a key (its primary key, the owner of a wallet...), and loaded with the given
+    # function when it is not in the map yet
+    def get(self, model, key, load):
+        if (model, key) not in self.objects:
+            self.objects[model, key] = load()
+        return self.objects[model, key]
+
+    # The same def for the async views, the object is loaded by the given coroutine function
+    async def aget(self, model, key, load):
+        if (model, key) not in self.objects:
+            self.objects[model, key] = await load()
+        return self.objects[model, key]
+
+
+def get_identity_map(request):
+    if not hasattr(request, '_identity_map'):
+        request._identity_map = IdentityMap()
+    return request._identity_map
+
+
+# This def returns the book with the given id, or None, loaded at most once per request. The owner is not loaded: the
+# owner_id of the book is enough to know if the connected user owns it.
+def get_request_book(request, book_id):
+    try:
+        book_id = int(book_id)
+    except (TypeError, ValueError):
+        return None
+    return get_identity_map(request).get(Book, book_id, lambda: Book.objects.filter(pk=book_id).first())
+
+
+# The same def for the async views
+async def aget_request_book(request, book_id):
+    return await get_identity_map(request).aget(Book, int(book_id), lambda: Book.objects.filter(pk=book_id).afirst())
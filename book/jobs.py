@@ -0,0 +1,186 @@
+import datetime
+import logging
+import threading
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# The tasks the worker can run, by name: (function, maximum number of attempts). See the task decorator.
+TASKS = {}
+
+# Number of attempts of a job before it is marked as failed
+JOB_MAX_ATTEMPTS = getattr(settings, 'JOB_MAX_ATTEMPTS', 5)
+# Number of seconds before the second attempt of a failed job, doubled for each following attempt
+JOB_RETRY_DELAY = getattr(settings, 'JOB_RETRY_DELAY', 10)
+# Number of seconds after which a running job is considered lost (the worker was killed) and is run again
+JOB_TIMEOUT = getattr(settings, 'JOB_TIMEOUT', 300)
+# Number of days the finished jobs (and their keys) are kept
+JOB_KEEP_DAYS = getattr(settings, 'JOB_KEEP_DAYS', 7)
+
+
+# This decorator registers a function as a task that can be enqueued by name. The arguments of a task are stored as
+# json: only numbers, strings, lists and dicts. A job can run more than once (a worker killed after the task, before
+# the job is marked as done), so a task must not repeat its effect when it is run twice.
+def task(name, max_attempts=None):
+    def register(func):
+        TASKS[name] = (func, max_attempts or JOB_MAX_ATTEMPTS)
+        return func
+    return register
+
+
+# This def adds a job to the queue, to run the given task with the given arguments after the given number of seconds.
+# The job is inserted in the current transaction: a request that fails enqueues nothing, and the worker only sees the
+# job once the request is committed. The jobs with a key are enqueued once: a job with the same key is ignored.
+def enqueue(name, key=None, delay=0, **kwargs):
+    if name not in TASKS:
+        raise ValueError('Unknown task: %s' % name)
+    job = Job(name=name, kwargs=kwargs, key=key, max_attempts=TASKS[name][1],
+              run_at=timezone.now() + datetime.timedelta(seconds=delay))
+    Job.objects.bulk_create([job], ignore_conflicts=True)
+
+
+# This def takes at most the given number of jobs that are due, oldest first, and marks them as running. The rows are
+# locked while they are taken and the rows locked by another worker are skipped, so two workers never take the same
+# job and never wait for each other.
+def claim_jobs(limit):
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(Job.objects.select_for_update(skip_locked=True).filter(status=Job.Status.QUEUED, run_at__lte=now)
+                   .order_by('run_at', 'id').values_list('id', flat=True)[:limit])
+        if not ids:
+            return []
+        Job.objects.filter(id__in=ids).update(status=Job.Status.RUNNING, started_at=now, attempts=F('attempts') + 1)
+        return list(Job.objects.filter(id__in=ids).order_by('run_at', 'id'))
+
+
+# This def runs a job taken by claim_jobs. The task and the update of the job are done in one transaction: the changes
+# made by a task in the database are never applied twice. A failed job is queued again with an exponential backoff,
+# and marked as failed after its last attempt.
+def run_job(job):
+    try:
+        func, _ = TASKS[job.name]
+        with transaction.atomic():
+            func(**job.kwargs)
+            Job.objects.filter(pk=job.pk).update(status=Job.Status.DONE, finished_at=timezone.now(), last_error='')
+    except Exception:
+        now = timezone.now()
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error('Job %d (%s) failed after %d attempts:\n%s', job.pk, job.name, job.attempts, error)
+            Job.objects.filter(pk=job.pk).update(status=Job.Status.FAILED, finished_at=now, last_error=error)
+        else:
+            delay = JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            logger.warning('Job %d (%s) failed, attempt %d of %d, retried in %ds:\n%s', job.pk, job.name, job.attempts,
+                           job.max_attempts, delay, error)
+            Job.objects.filter(pk=job.pk).update(status=Job.Status.QUEUED, last_error=error,
+                                                 run_at=now + datetime.timedelta(seconds=delay))
+
+
+# This def runs the jobs that are due one after the other in the current thread, until there are none left. It returns
+# the number of jobs run.
+def run_due_jobs():
+    count = 0
+    while jobs := claim_jobs(1):
+        run_job(jobs[0])
+        count += 1
+    return count
+
+
+# This def queues again the jobs left running by a worker that was killed, and marks as failed the ones that have no
+# attempt left. The finished jobs older than JOB_KEEP_DAYS are deleted.
+def clean_jobs():
+    now = timezone.now()
+    lost = Job.objects.filter(status=Job.Status.RUNNING, started_at__lt=now - datetime.timedelta(seconds=JOB_TIMEOUT))
+    lost.filter(attempts__lt=F('max_attempts')).update(status=Job.Status.QUEUED, run_at=now,
+                                                        last_error='The worker was stopped.')
+    lost.update(status=Job.Status.FAILED, finished_at=now, last_error='The worker was stopped.')
+    Job.objects.filter(status__in=[Job.Status.DONE, Job.Status.FAILED],
+                       finished_at__lt=now - datetime.timedelta(days=JOB_KEEP_DAYS)).delete()
+
+
+# This def returns the metrics of the queue for the monitoring: the number of jobs of each status, the number of jobs
+# that are due and the age of the oldest one, and the latency (time waited in the queue once due) and the duration of
+# the last finished jobs, in milliseconds.
+def job_metrics(window=500):
+    now = timezone.now()
+    counts = dict(Job.objects.values_list('status').annotate(count=Count('id')).order_by())
+    due = Job.objects.filter(status=Job.Status.QUEUED, run_at__lte=now).aggregate(count=Count('id'),
+                                                                                 oldest=Min('run_at'))
+    recent = (Job.objects.filter(status=Job.Status.DONE, finished_at__isnull=False).order_by('-finished_at')
+              .values_list('run_at', 'started_at', 'finished_at')[:window])
+    latencies, durations = [], []
+    for run_at, started_at, finished_at in recent:
+        latencies.append(max((started_at - run_at).total_seconds(), 0) * 1000)
+        durations.append((finished_at - started_at).total_seconds() * 1000)
+    return {
+        **{status: counts.get(status, 0) for status in Job.Status.values},
+        'due': due['count'],
+        'oldest_due_seconds': round((now - due['oldest']).total_seconds(), 3) if due['oldest'] else 0,
+        'latency_ms': percentiles(latencies),
+        'duration_ms': percentiles(durations),
+    }
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {'p50': None, 'p95': None, 'max': None}
+    return {'p50': round(values[len(values) // 2], 2), 'p95': round(values[int(len(values) * 0.95)], 2),
+            'max': round(values[-1], 2)}
+
+
+# This class is the worker started by the run_jobs command. A thread pool runs the jobs, and the main thread only takes
+# as many jobs as there are idle threads: the number of jobs running at the same time (and of database connections) is
+# bounded by the number of threads, and the jobs waiting are left in the queue for the other workers. The queue is
+# polled when every thread is idle, and the metrics are logged every metrics_interval seconds.
+class Worker:
+    def __init__(self, threads=4, poll_interval=1.0, metrics_interval=60):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.metrics_interval = metrics_interval
+        self.stopping = threading.Event()
+
+    # The jobs already running are finished before run returns
+    def stop(self):
+        self.stopping.set()
+
+    def run(self, once=False):
+        running = set()
+        last_clean = None
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='job') as pool:
+            while not self.stopping.is_set():
+                now = timezone.now()
+                if last_clean is None or (now - last_clean).total_seconds() >= self.metrics_interval:
+                    clean_jobs()
+                    logger.info('Job queue: %s', job_metrics())
+                    last_clean = now
+                running = {future for future in running if not future.done()}
+                jobs = claim_jobs(self.threads - len(running)) if len(running) < self.threads else []
+                for job in jobs:
+                    running.add(pool.submit(self.run_job, job))
+                if once and not jobs and not running:
+                    break
+                if jobs and len(running) < self.threads:
+                    continue
+                if running:
+                    wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                else:
+                    self.stopping.wait(self.poll_interval)
+            close_old_connections()
+
+    # The threads of the pool keep their database connection between the jobs, it is closed when it is too old
+    # (CONN_MAX_AGE) or broken
+    def run_job(self, job):
+        close_old_connections()
+        try:
+            run_job(job)
+        finally:
+            close_old_connections()
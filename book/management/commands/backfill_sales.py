@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from book.sales import backfill_purchases, rebuild_rollups
+
+
+# This command rebuilds the daily sales rollups of the sellers and of the books from the sale records, to repair them
+# or after the sale records were changed by hand. With --purchases, the purchases made before the sales were recorded
+# (or inserted without buy_book) first get a sale record, at the current price of the book and at its publication date.
+# Example: python manage.py backfill_sales --purchases
+class Command(BaseCommand):
+    help = 'Rebuild the daily sales rollups from the sale records.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--purchases', action='store_true',
+                            help='Create the missing sale records of the purchasers table first.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['purchases']:
+            created = backfill_purchases(options['batch_size'])
+            self.stdout.write('%d sale records created in %.1fs' % (created, time.perf_counter() - start))
+        sellers, books = rebuild_rollups(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('%d seller days and %d book days rebuilt in %.1fs' % (
+            sellers, books, time.perf_counter() - start)))
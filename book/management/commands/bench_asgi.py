@@ -0,0 +1,127 @@
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+SERVERS = {
+    # The threaded development server of django
+    'wsgi': [sys.executable, 'manage.py', 'runserver', '127.0.0.1:{port}', '--noreload'],
+    # uvicorn is not a dependency of the project: pip install uvicorn
+    'asgi': [sys.executable, '-m', 'uvicorn', 'books.asgi:application', '--port', '{port}', '--log-level', 'warning'],
+}
+
+
+# This command compares the throughput of the WSGI and of the ASGI servers on the book lists. Each server is started in
+# its own process on the current database (run seed_catalog first), then the pages are requested by many concurrent
+# clients, as the given user. Under ASGI the async views are used (see books/asgi.py).
+# Example: python manage.py bench_asgi --requests 2000 --concurrency 100 --url /shop/ --url /owned/
+class Command(BaseCommand):
+    help = 'Compare the throughput of the book lists under WSGI and under ASGI.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', default='seed-user-0', help='Username of the connected user.')
+        parser.add_argument('--url', action='append', dest='urls',
+                            help='Page to request, can be repeated (default: the shop, owned and purchased books).')
+        parser.add_argument('--requests', type=int, default=1000, help='Number of requests per server and page.')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--server', action='append', dest='servers', choices=list(SERVERS),
+                            help='Server to benchmark, can be repeated (default: both).')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('Unknown user %s, run seed_catalog first.' % options['user'])
+        # The session is saved in the database, so the servers can read it
+        client = Client()
+        client.force_login(user)
+        session_key = client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.cookie = '%s=%s' % (settings.SESSION_COOKIE_NAME, session_key)
+        try:
+            for server in options['servers'] or list(SERVERS):
+                for url in options['urls'] or ['/shop/', '/owned/', '/purchased/']:
+                    self.run(server, url, options['port'], options['requests'], options['concurrency'])
+        finally:
+            Session.objects.filter(session_key=session_key).delete()
+
+    def run(self, server, url, port, requests, concurrency):
+        command = [part.format(port=port) for part in SERVERS[server]]
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=os.environ.copy(), stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE)
+        try:
+            self.wait_for(process, port)
+            # The caches of the server are filled before the measures
+            asyncio.run(self.load(port, url, concurrency, concurrency, process.pid))
+            start = time.perf_counter()
+            timings, errors, threads = asyncio.run(self.load(port, url, requests, concurrency, process.pid))
+            elapsed = time.perf_counter() - start
+        finally:
+            process.terminate()
+            process.wait()
+        timings.sort()
+        self.stdout.write('%s %s: %d requests/s, p50 %.1fms, p95 %.1fms, %d errors, %s threads' % (
+            server, url, requests / elapsed, statistics.median(timings) if timings else 0,
+            timings[int(len(timings) * 0.95)] if timings else 0, errors, threads or '?'))
+
+    def wait_for(self, process, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError('The server has stopped:\n%s' % process.stderr.read().decode(errors='replace'))
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError('The server has not started in %d seconds.' % timeout)
+
+    # This def sends the requests with a fixed number of concurrent clients, one connection per request. It returns the
+    # latencies in ms, the number of errors and the highest number of threads seen in the server process.
+    async def load(self, port, url, requests, concurrency, pid):
+        remaining = iter(range(requests))
+        timings, errors, threads = [], [0], [0]
+
+        async def client():
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    status = await self.get(port, url)
+                except OSError:
+                    status = None
+                timings.append((time.perf_counter() - start) * 1000)
+                if status != 200:
+                    errors[0] += 1
+
+        async def count_threads():
+            while True:
+                try:
+                    threads[0] = max(threads[0], len(os.listdir('/proc/%d/task' % pid)))
+                except OSError:
+                    return
+                await asyncio.sleep(0.05)
+
+        counter = asyncio.ensure_future(count_threads())
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        counter.cancel()
+        return timings, errors[0], threads[0]
+
+    async def get(self, port, url):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            writer.write(('GET %s HTTP/1.1\r\nHost: 127.0.0.1\r\nCookie: %s\r\nConnection: close\r\n\r\n' % (
+                url, self.cookie)).encode())
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+        return int(response.split(b' ', 2)[1]) if response else None
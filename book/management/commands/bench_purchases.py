@@ -0,0 +1,98 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from book.models import Book, Wallet
+from book.purchase import PurchaseResult, buy_book
+from book.sales import seller_analytics
+from book.wallets import compact_wallets, wallets_with_credits
+
+
+# This command measures the purchases of a single popular seller through buy_book, the whole purchase: the payment,
+# the purchaser row, the sale record, the rollups and the purchase counts. Each thread is a buyer who buys every book of
+# the seller, in the same order as the other buyers, so the buyers fight for the rows of the seller and for the rows of
+# the same book at the same time. The command writes the purchases per second and the latency of the purchases, and
+# checks that no sale and no money were lost: the lifetime sales and the balance of the seller, and the purchase
+# counts of the books. The credits of the seller are spread over WALLET_CREDIT_SHARDS rows, the sales rollups and the
+# purchase counts are incremented in place in the purchase transaction.
+# SQLite locks the whole database for each write: run the command on MySQL or PostgreSQL to measure the waits for the
+# locks of the rows.
+# Example: python manage.py bench_purchases --threads 16 --books 50
+class Command(BaseCommand):
+    help = 'Measure the purchases of the books of a single seller by concurrent buyers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Number of buyers purchasing at the same time.')
+        parser.add_argument('--books', type=int, default=50,
+                            help='Number of books of the seller, bought by each buyer.')
+        parser.add_argument('--price', type=float, default=2.5)
+
+    def handle(self, *args, **options):
+        # SQLite has a single writer: the purchases made at the same time would fail with "database is locked"
+        if connection.vendor == 'sqlite':
+            self.stderr.write('SQLite locks the whole database for each write, the purchases are made by one thread.')
+            options['threads'] = 1
+        # The users of the benchmark (and their books, wallets and sales) are deleted at the end
+        User.objects.filter(username__startswith='bench-purchase-').delete()
+        try:
+            self.measure(options)
+        finally:
+            User.objects.filter(username__startswith='bench-purchase-').delete()
+
+    def measure(self, options):
+        price, count = options['price'], options['books']
+        seller = User.objects.create(username='bench-purchase-seller')
+        User.objects.bulk_create([User(username='bench-purchase-buyer-%d' % i) for i in range(options['threads'])])
+        buyers = list(User.objects.filter(username__startswith='bench-purchase-buyer-').order_by('id'))
+        Wallet.objects.bulk_create([Wallet(owner=seller, balance=0.0)] +
+                                   [Wallet(owner=buyer, balance=count * price) for buyer in buyers])
+        Book.objects.bulk_create([Book(title='Bench %d' % i, author='Bench', description='A book', gender='Bench',
+                                       num_pages=1, price=price, publication_date=timezone.now(), owner=seller)
+                                  for i in range(count)])
+        books = list(Book.objects.filter(owner=seller).order_by('id').values_list('id', flat=True))
+        latencies, errors = [], []
+        start_line = threading.Barrier(len(buyers))
+
+        def buyer(user):
+            try:
+                start_line.wait()
+                for book_id in books:
+                    start = time.perf_counter()
+                    result = buy_book(user, book_id)
+                    latencies.append(time.perf_counter() - start)
+                    if result != PurchaseResult.SUCCESS:
+                        raise AssertionError('The purchase failed: %s.' % result.value)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buyer, args=(user,)) for user in buyers]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        close_old_connections()
+        if errors:
+            raise errors[0]
+
+        # Every buyer bought every book once
+        purchases, expected = len(books) * len(buyers), len(books) * len(buyers) * price
+        analytics = seller_analytics(seller.id)
+        balance = wallets_with_credits().get(owner=seller)
+        compact_wallets()
+        counts = Book.objects.filter(owner=seller).aggregate(total=Sum('purchase_count'))['total']
+        exact = (analytics['lifetime_sales'] == purchases and analytics['lifetime_revenue'] == expected and
+                 balance.balance + balance.credits == expected and counts == purchases)
+        latencies.sort()
+        self.stdout.write('%d buyers, %d purchases: %.0f purchases/s, latency p50 %.1fms p95 %.1fms max %.1fms, %s' % (
+            len(buyers), purchases, purchases / elapsed, latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.95)] * 1000, latencies[-1] * 1000,
+            'exact' if exact else self.style.ERROR('WRONG')))
@@ -0,0 +1,80 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from book import copurchases, recommendations
+from book.models import Book
+
+
+class Rollback(Exception):
+    pass
+
+
+# This command measures the batch build of the recommendations on a synthetic purchase graph: the users buy a random
+# number of books, and the books are drawn with a Zipf-like popularity (a few bestsellers, a long tail of books
+# rarely bought). With --store, the book ids are taken from the catalog and the result is also written in the
+# recommendation table, inside a transaction that is rolled back at the end.
+# Example: python manage.py bench_recommendations --edges 1000000 --users 100000 --books 200000
+class Command(BaseCommand):
+    help = 'Benchmark the batch build of the co-purchase recommendations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--edges', type=int, default=1_000_000, help='Number of purchases.')
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--books', type=int, default=200_000)
+        parser.add_argument('--per-book', type=int, default=recommendations.RECOMMENDATIONS_PER_BOOK)
+        parser.add_argument('--max-basket', type=int, default=recommendations.MAX_BASKET)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--store', action='store_true', help='Also time the write of the table.')
+
+    def handle(self, *args, **options):
+        np = copurchases.np
+        if np is None:
+            raise CommandError('NumPy is needed to build the recommendations: pip install numpy')
+        book_ids = np.arange(1, options['books'] + 1)
+        if options['store']:
+            book_ids = np.fromiter(Book.objects.order_by('id').values_list('id', flat=True)[:options['books']],
+                                   dtype=np.int64)
+            if len(book_ids) < 2:
+                raise CommandError('The catalog must contain books to use --store, run seed_catalog first.')
+        users, books = self.generate(np.random.default_rng(options['seed']), options['edges'], options['users'],
+                                     book_ids)
+        self.stdout.write('%d purchases of %d users on %d books' % (len(users), len(np.unique(users)),
+                                                                   len(np.unique(books))))
+
+        timings = []
+        for _ in range(options['repeat']):
+            start = time.perf_counter()
+            result = copurchases.co_purchases(users, books, options['per_book'], options['max_basket'])
+            timings.append(time.perf_counter() - start)
+        # NumPy reports its allocations to tracemalloc, the peak is measured in a separate run
+        tracemalloc.start()
+        try:
+            copurchases.co_purchases(users, books, options['per_book'], options['max_basket'])
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.stdout.write('compute: best %.2fs, worst %.2fs, peak memory %.0fMB, %d recommendations' % (
+            min(timings), max(timings), peak / 2 ** 20, len(result[0])))
+
+        if options['store']:
+            try:
+                with transaction.atomic():
+                    start = time.perf_counter()
+                    copurchases.store_recommendations(*result)
+                    self.stdout.write('store: %.2fs' % (time.perf_counter() - start))
+                    raise Rollback
+            except Rollback:
+                pass
+
+    # Each purchase is a (user, book) pair, the pairs drawn twice are kept once like in the purchasers table
+    def generate(self, rng, edges, users, book_ids):
+        np = copurchases.np
+        popularity = 1 / np.arange(1, len(book_ids) + 1) ** 0.8
+        user_column = rng.integers(0, users, edges)
+        book_column = rng.permutation(book_ids)[rng.choice(len(book_ids), edges, p=popularity / popularity.sum())]
+        pairs = np.unique(user_column * (int(book_ids.max()) + 1) + book_column)
+        return pairs // (int(book_ids.max()) + 1), pairs % (int(book_ids.max()) + 1)
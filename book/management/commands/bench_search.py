@@ -0,0 +1,76 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from book.models import Book
+from book.search import index_books, search_books
+
+
+class Rollback(Exception):
+    pass
+
+
+# This command measures the latency of the search engine. With --books, a synthetic catalog is generated inside a
+# transaction that is rolled back at the end, so the database is left untouched.
+# Example: python manage.py bench_search --books 1000000 --queries 200
+class Command(BaseCommand):
+    help = 'Benchmark the full-text search engine.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=0,
+                            help='Number of synthetic books to generate (0 uses the existing catalog).')
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--vocabulary', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.words = ['w%x' % i for i in range(options['vocabulary'])]
+        try:
+            with transaction.atomic():
+                if options['books']:
+                    self.generate(options['books'])
+                self.run(options['queries'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    # Words are drawn with a Zipf-like distribution, like in real texts: a few words are very frequent and most of
+    # them are rare.
+    def text(self, length):
+        return ' '.join(self.words[min(int(self.random.paretovariate(1.1)) - 1, len(self.words) - 1)]
+                        for _ in range(length))
+
+    def generate(self, count, batch_size=5000):
+        owner = User.objects.create(username='bench-search-owner')
+        genders = ['Fantasy', 'Action', 'Romance', 'Horror', 'Poetry']
+        now = timezone.now()
+        start = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            books = Book.objects.bulk_create([
+                Book(title=self.text(3), author=self.text(2), description=self.text(30), owner=owner, num_pages=100,
+                     gender=self.random.choice(genders), price=round(self.random.uniform(1, 50), 2),
+                     publication_date=now) for _ in range(min(batch_size, count - offset))])
+            if books[0].id is None:
+                books = Book.objects.filter(owner=owner).order_by('-id')[:len(books)]
+            index_books(books, batch_size=50000)
+        self.stdout.write('Generated and indexed %d books in %.1fs' % (count, time.perf_counter() - start))
+
+    def run(self, count):
+        timings = []
+        for _ in range(count):
+            query = self.text(self.random.randint(1, 3))
+            filters = Book.objects.all()
+            if self.random.random() < 0.5:
+                filters = filters.filter(price__lte=25)
+            start = time.perf_counter()
+            search_books(query, filters, limit=20)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        self.stdout.write('%d queries: p50 %.2fms, p95 %.2fms, max %.2fms' % (
+            count, statistics.median(timings), timings[int(len(timings) * 0.95) - 1], timings[-1]))
@@ -0,0 +1,65 @@
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.loader import get_template
+from django.test import RequestFactory
+from django.utils import timezone
+
+from book.fragments import render_cards
+from book.models import Book
+
+
+class Rollback(Exception):
+    pass
+
+
+# This command measures the time spent rendering the shop template for a large catalog, with the book cards rendered
+# from scratch and with the book cards read from the cache. The books are generated inside a transaction that is
+# rolled back at the end.
+# Example: python manage.py bench_templates --books 10000
+class Command(BaseCommand):
+    help = 'Benchmark the rendering of the shop template with and without the cached book cards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                owner = User.objects.create(username='bench-templates-owner')
+                Book.objects.bulk_create([
+                    Book(title='Book %d' % i, author='Author %d' % i, description='Description of book %d' % i,
+                         gender='Fantasy', price=10.0, num_pages=100, publication_date=timezone.now(), owner=owner)
+                    for i in range(options['books'])], batch_size=1000)
+                self.run(list(Book.objects.filter(owner=owner)), options['runs'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def render(self, books):
+        request = RequestFactory().get('/shop/')
+        request.user = AnonymousUser()
+        start = time.perf_counter()
+        for book in books:
+            book.purchased = False
+        render_cards(books, 'book/shop_card.html')
+        html = get_template('book/shop.html').render({'books': books}, request)
+        return (time.perf_counter() - start) * 1000, html
+
+    def run(self, books, runs):
+        uncached, cached = [], []
+        for _ in range(runs):
+            cache.clear()
+            elapsed, cold = self.render(books)
+            uncached.append(elapsed)
+            elapsed, warm = self.render(books)
+            cached.append(elapsed)
+            if cold != warm:
+                raise AssertionError('The cached render is different from the uncached render.')
+        self.stdout.write('%d books: uncached %.1fms, cached %.1fms (median of %d runs)' % (
+            len(books), statistics.median(uncached), statistics.median(cached), runs))
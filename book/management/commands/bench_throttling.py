@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import contextlib
+import itertools
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.test import Client
+from django.test.utils import override_settings
+
+from book.models import Book
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+# The listen queue of the development server holds 10 connections: the connections of the buyers would be refused by
+# the flood and sent again by the client a second later. A production server has a longer queue (2048 for gunicorn).
+class Server(ThreadedWSGIServer):
+    request_queue_size = 2048
+
+
+# This command shows how the purchases are served while the shop is flooded. A threaded WSGI server (one thread per
+# request, like the development server) is started in another process on the current database (run seed_catalog
+# first), and three runs are measured:
+# - the buyers alone,
+# - the buyers while anonymous clients flood the shop, without throttling,
+# - the same flood with the throttling of the THROTTLES setting.
+# Each buyer is a connected user who opens the purchase page of a book (BuyBookView) at a steady pace. The flood sends
+# requests to the shop at a fixed rate, whatever the answers (a bot does not wait for the page, nor honour the
+# Retry-After header), from a number of addresses (X-Forwarded-For). The p50/p95 of the purchase pages and the status
+# codes of the shop are written for each run: with the throttling, the p95 of the purchases must stay close to the one
+# of the buyers alone.
+# Example: python manage.py bench_throttling --flood-rate 300 --duration 10
+class Command(BaseCommand):
+    help = 'Measure the purchase pages during a flood of the shop, with and without throttling.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=5, help='Number of connected buyers.')
+        parser.add_argument('--buyer-interval', type=float, default=0.25,
+                            help='Number of seconds between two requests of a buyer.')
+        parser.add_argument('--flooders', type=int, default=50, help='Number of addresses flooding the shop.')
+        parser.add_argument('--flood-rate', type=float, default=200, help='Number of shop requests per second.')
+        parser.add_argument('--duration', type=float, default=5, help='Number of seconds of each run.')
+        parser.add_argument('--port', type=int, default=8766)
+        # The server started by the command runs the same command with these options
+        parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+        parser.add_argument('--throttle', action='store_true', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            return self.serve(options['port'], options['throttle'])
+        buyers = list(User.objects.filter(username__startswith='seed-user-').order_by('id')[:options['buyers']])
+        if len(buyers) < options['buyers']:
+            raise CommandError('Not enough users, run seed_catalog first.')
+        books = list(Book.objects.exclude(owner__in=buyers).order_by('id').values_list('id', flat=True)[:1000])
+        self.cookies = []
+        for user in buyers:
+            client = Client()
+            client.force_login(user)
+            self.cookies.append('%s=%s' % (settings.SESSION_COOKIE_NAME,
+                                           client.cookies[settings.SESSION_COOKIE_NAME].value))
+        self.books = itertools.cycle(books)
+        self.port = options['port']
+        try:
+            with self.server(False):
+                # The caches of the views are filled before the measures
+                self.run(options, 1)
+                self.report('buyers alone', self.run(options, options['duration']))
+                self.report('flood', self.run(options, options['duration'], flood=True))
+            with self.server(True):
+                self.run(options, 1)
+                self.report('flood, throttled', self.run(options, options['duration'], flood=True))
+        finally:
+            Session.objects.filter(session_key__in=[cookie.split('=', 1)[1] for cookie in self.cookies]).delete()
+
+    # The server reads the limits of the settings, the flooders are told apart by their X-Forwarded-For header
+    def serve(self, port, throttle):
+        server = Server(('127.0.0.1', port), QuietRequestHandler)
+        server.set_app(get_internal_wsgi_application())
+        with override_settings(THROTTLE_ENABLED=throttle, THROTTLE_CLIENT_HEADER='HTTP_X_FORWARDED_FOR'):
+            server.serve_forever()
+
+    @contextlib.contextmanager
+    def server(self, throttle):
+        command = [sys.executable, 'manage.py', 'bench_throttling', '--serve', '--port', str(self.port)]
+        process = subprocess.Popen(command + (['--throttle'] if throttle else []), cwd=settings.BASE_DIR,
+                                   env=os.environ.copy(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise CommandError('The server has not started.')
+                try:
+                    socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            yield
+        finally:
+            process.terminate()
+            process.wait()
+
+    def report(self, name, results):
+        timings, statuses, elapsed = results
+        timings.sort()
+        self.stdout.write('%s: buy p50 %.1fms, p95 %.1fms (%d requests), shop %d requests/s %s' % (
+            name, statistics.median(timings), timings[int(len(timings) * 0.95)], len(timings),
+            sum(statuses.values()) / elapsed, dict(sorted(statuses.items()))))
+
+    def run(self, options, duration, flood=False):
+        return asyncio.run(self.load(options['buyer_interval'], options['flooders'],
+                                     options['flood_rate'] if flood else 0, duration))
+
+    # This def runs the buyers and the flood for the given number of seconds. It returns the latencies of the purchase
+    # pages in ms, the status codes of the shop and the duration of the run. The shop requests still running at the end
+    # are cancelled.
+    async def load(self, interval, flooders, rate, duration):
+        start = time.perf_counter()
+        deadline = start + duration
+        timings, statuses = [], Counter()
+
+        async def buyer(cookie):
+            while time.perf_counter() < deadline:
+                request_start = time.perf_counter()
+                status = await self.get('/shop/%d' % next(self.books), 'Cookie: %s' % cookie)
+                if status != 200:
+                    raise CommandError('The purchase page answered %s.' % status)
+                timings.append((time.perf_counter() - request_start) * 1000)
+                await asyncio.sleep(interval)
+
+        async def flood_request(number):
+            address = 'X-Forwarded-For: 10.%d.%d.%d' % (number >> 16 & 255, number >> 8 & 255, number & 255)
+            statuses[await self.get('/shop/', address)] += 1
+
+        async def flood():
+            requests = []
+            for number in itertools.count():
+                next_request = start + number / rate
+                if next_request >= deadline:
+                    break
+                await asyncio.sleep(next_request - time.perf_counter())
+                requests.append(asyncio.ensure_future(flood_request(number % flooders)))
+            for request in requests:
+                request.cancel()
+
+        await asyncio.gather(*(buyer(cookie) for cookie in self.cookies), *([flood()] if rate else []))
+        return timings, statuses, time.perf_counter() - start
+
+    async def get(self, url, header):
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        except OSError:
+            return None
+        try:
+            writer.write(('GET %s HTTP/1.1\r\nHost: 127.0.0.1\r\n%s\r\nConnection: close\r\n\r\n' % (
+                url, header)).encode())
+            await writer.drain()
+            response = await reader.read()
+        except OSError:
+            return None
+        finally:
+            writer.close()
+        return int(response.split(b' ', 2)[1]) if response else None
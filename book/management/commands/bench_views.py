@@ -0,0 +1,196 @@
+import gc
+import itertools
+import json
+import os
+import statistics
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import NoReverseMatch, reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from accounts import urls as accounts_urls
+from book import urls as book_urls
+from book.cart import CART_SESSION_KEY
+from book.models import Book, Wallet
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'perf_budgets.json')
+
+# The urls that are not read with a GET request
+METHODS = {'accounts:logout': 'post', 'book:cartBook': 'post', 'book:checkout': 'post'}
+
+# The urls requested with books in the cart of the session, each request gets books that were never bought
+CART_URLS = ('book:cart', 'book:checkout')
+CART_SIZE = 10
+
+
+class Rollback(Exception):
+    pass
+
+
+# This command requests every url of book/urls.py and accounts/urls.py with the test client, as a connected user, and
+# measures the number of queries, the p50/p95 latency and the peak of memory allocated by each view. The results are
+# written in a json report and compared to the budgets committed in book/perf_budgets.json: the command fails when a
+# view goes over its budget, or when a url has no budget. It is meant to run on a catalog made by seed_catalog.
+# Everything runs inside a transaction that is rolled back at the end, so the database is left untouched.
+# Example: python manage.py bench_views --iterations 50 --report bench.json
+class Command(BaseCommand):
+    help = 'Benchmark every view against its committed performance budget.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', default='seed-user-0', help='Username of the connected user.')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2, help='Requests made before the measures (warm caches).')
+        parser.add_argument('--report', help='File where the json report is written (default: standard output).')
+        parser.add_argument('--budgets', default=BUDGETS_PATH)
+        parser.add_argument('--no-budgets', action='store_true', help='Only write the report.')
+
+    # The views are measured, not the throttling: the same user requests each view many times
+    @override_settings(THROTTLE_ENABLED=False)
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('At least one iteration is needed.')
+        try:
+            self.user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('Unknown user %s, run seed_catalog first.' % options['user'])
+        budgets = {}
+        if not options['no_budgets']:
+            with open(options['budgets'], encoding='utf-8') as budgets_file:
+                budgets = json.load(budgets_file)
+
+        results = {}
+        try:
+            with transaction.atomic():
+                # The checkouts must not fail for lack of money
+                Wallet.objects.filter(owner=self.user).update(balance=10 ** 9)
+                # The metrics of the job queue are only shown to the staff
+                User.objects.filter(pk=self.user.pk).update(is_staff=True)
+                self.cart_books = iter(Book.objects.exclude(owner=self.user).exclude(purchasers=self.user)
+                                       .values_list('id', flat=True)[:len(CART_URLS) * CART_SIZE *
+                                                                     (options['iterations'] + options['warmup'] + 1)])
+                for name, url in self.urls():
+                    # Each url is measured in its own savepoint, so the purchases of the checkout do not change the
+                    # pages measured after it
+                    try:
+                        with transaction.atomic():
+                            results[name] = self.measure(name, url, options['iterations'], options['warmup'])
+                            raise Rollback
+                    except Rollback:
+                        pass
+                raise Rollback
+        except Rollback:
+            pass
+
+        failures = [] if options['no_budgets'] else self.over_budget(results, budgets)
+        report = json.dumps({'user': self.user.username, 'iterations': options['iterations'], 'views': results,
+                             'failures': failures}, indent=2)
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8') as report_file:
+                report_file.write(report + '\n')
+        else:
+            self.stdout.write(report)
+        if failures:
+            raise CommandError('%d views are over their budget:\n%s' % (len(failures), '\n'.join(failures)))
+
+    # This def returns the arguments needed to reverse each url, built from the data of the connected user
+    def arguments(self):
+        owned = Book.objects.filter(owner=self.user).values_list('id', flat=True).first()
+        on_sale = Book.objects.exclude(owner=self.user).values_list('id', flat=True).first()
+        if owned is None or on_sale is None:
+            raise CommandError('The user %s must own a book and another user must sell one.' % self.user.username)
+        word = Book.objects.values_list('title', flat=True).get(id=on_sale).split()[0]
+        return {
+            'book:edit': ([owned], ''),
+            'book:delete': ([owned], ''),
+            'book:buyBook': ([on_sale], ''),
+            'book:cartBook': ([on_sale], ''),
+            'book:apiBook': ([on_sale], ''),
+            'book:export': (['purchased', 'jsonl'], ''),
+            'book:search': ([], '?q=%s' % word.lower()),
+            'accounts:password_reset_confirm': ([urlsafe_base64_encode(force_bytes(self.user.pk)),
+                                                 default_token_generator.make_token(self.user)], ''),
+        }
+
+    # This def yields every named url of the two applications. A url that can not be reversed (a new url with
+    # parameters) stops the command, so no view is left out of the benchmark.
+    def urls(self):
+        arguments = self.arguments()
+        for module in (book_urls, accounts_urls):
+            for pattern in module.urlpatterns:
+                name = '%s:%s' % (module.app_name, pattern.name)
+                args, query = arguments.get(name, ([], ''))
+                try:
+                    yield name, reverse(name, args=args) + query
+                except NoReverseMatch:
+                    raise CommandError('No arguments are given for the url %s in bench_views.' % name)
+
+    # Each request is made by a new session of the user
+    def login(self, client, name):
+        client.force_login(self.user)
+        if name in CART_URLS:
+            session = client.session
+            session[CART_SESSION_KEY] = list(itertools.islice(self.cart_books, CART_SIZE))
+            session.save()
+
+    def request(self, client, name, url):
+        response = getattr(client, METHODS.get(name, 'get'))(url)
+        # The streamed responses are produced while they are read
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def measure(self, name, url, iterations, warmup):
+        # The garbage left by the previous url is collected now, and not in the middle of the measures of this one
+        gc.collect()
+        client = Client(SERVER_NAME='127.0.0.1')
+        for _ in range(warmup):
+            self.login(client, name)
+            self.request(client, name, url)
+
+        timings = []
+        for _ in range(iterations):
+            self.login(client, name)
+            # The query log is emptied by each request (request_started signal), so it is emptied before the capture
+            # and the queries are counted before the next request
+            reset_queries()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = self.request(client, name, url)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries = len(captured)
+
+        # The memory is traced in a separate request, tracemalloc slows down the code it traces
+        self.login(client, name)
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            self.request(client, name, url)
+            peak = tracemalloc.get_traced_memory()[1] - before
+        finally:
+            tracemalloc.stop()
+
+        timings.sort()
+        return {'url': url, 'status': response.status_code, 'queries': queries,
+                'p50_ms': round(statistics.median(timings), 2),
+                'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+                'peak_kb': round(peak / 1024, 1)}
+
+    def over_budget(self, results, budgets):
+        failures = []
+        for name, result in results.items():
+            budget = budgets.get(name)
+            if budget is None:
+                failures.append('%s: no budget in %s' % (name, os.path.basename(BUDGETS_PATH)))
+                continue
+            for measure, limit in (('queries', 'max_queries'), ('p95_ms', 'p95_ms'), ('peak_kb', 'peak_kb')):
+                if limit in budget and result[measure] > budget[limit]:
+                    failures.append('%s: %s %s > %s' % (name, measure, result[measure], budget[limit]))
+        return failures
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection, transaction
+from django.test.utils import override_settings
+
+from book.models import Wallet, WalletCredit
+from book.wallets import compact_wallets, credit_wallets, debit_wallet, wallets_with_credits
+
+
+# This command measures the purchases of a single popular seller for a few numbers of shards (WALLET_CREDIT_SHARDS).
+# Each thread is a buyer who pays for books of the seller as fast as it can: the payment of buy_book (debit_wallet and
+# credit_wallets) runs in a transaction that stays open for --hold seconds after the credit, for the rest of the
+# purchase (purchaser row, sales rollups, commit). A compaction runs at the same time every --compact-interval
+# seconds. For each number of shards, the command writes the purchases per second, and checks that no money was
+# created or lost: the balance of the seller is the sum of the prices, before and after a last compaction.
+# With one shard every purchase waits for the same row, the throughput is about 1 / hold; it should grow with the
+# shards, up to the number of threads. The sales rollups of the seller are not part of the measure. SQLite locks the
+# whole database for each write: run the command on MySQL or PostgreSQL.
+# Example: python manage.py bench_wallets --shards 1,4,16 --threads 16 --purchases 2000
+class Command(BaseCommand):
+    help = 'Measure the purchases of a single seller for a few numbers of credit shards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', default='1,2,4,8,16', help='Comma-separated numbers of shards to measure.')
+        parser.add_argument('--threads', type=int, default=16, help='Number of buyers paying at the same time.')
+        parser.add_argument('--purchases', type=int, default=800, help='Number of purchases of each run.')
+        parser.add_argument('--hold', type=float, default=0.005,
+                            help='Number of seconds each purchase keeps its transaction open after the credit.')
+        parser.add_argument('--price', type=float, default=2.5)
+        parser.add_argument('--compact-interval', type=float, default=0.1,
+                            help='Number of seconds between two compactions during a run, 0 for none.')
+
+    def handle(self, *args, **options):
+        # SQLite has a single writer: the purchases made at the same time would fail with "database is locked"
+        if connection.vendor == 'sqlite':
+            self.stderr.write('SQLite locks the whole database for each write, the purchases are made by one thread: '
+                              'the throughput can not grow with the shards.')
+            options['threads'], options['compact_interval'] = 1, 0
+        # The users of the benchmark (and their wallets and credits) are deleted at the end
+        User.objects.filter(username__startswith='bench-wallet-').delete()
+        try:
+            seller = User.objects.create(username='bench-wallet-seller')
+            User.objects.bulk_create([User(username='bench-wallet-buyer-%d' % i) for i in range(options['threads'])])
+            buyers = list(User.objects.filter(username__startswith='bench-wallet-buyer-').order_by('id'))
+            for shards in [int(shards) for shards in options['shards'].split(',')]:
+                self.measure(seller, buyers, shards, options)
+        finally:
+            User.objects.filter(username__startswith='bench-wallet-').delete()
+
+    def measure(self, seller, buyers, shards, options):
+        price, purchases = options['price'], options['purchases']
+        users = [seller] + buyers
+        Wallet.objects.filter(owner__in=users).delete()
+        WalletCredit.objects.filter(owner__in=users).delete()
+        Wallet.objects.bulk_create([Wallet(owner=seller, balance=0.0)] +
+                                   [Wallet(owner=buyer, balance=purchases * price) for buyer in buyers])
+        queue = list(range(purchases))
+        lock, done, errors = threading.Lock(), threading.Event(), []
+
+        def buyer(user):
+            try:
+                while True:
+                    with lock:
+                        if not queue:
+                            return
+                        queue.pop()
+                    with transaction.atomic():
+                        if not debit_wallet(user.id, price):
+                            raise AssertionError('The buyer can not pay.')
+                        credit_wallets({seller.id: price})
+                        time.sleep(options['hold'])
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        def compaction():
+            try:
+                while not done.wait(options['compact_interval']):
+                    compact_wallets()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        with override_settings(WALLET_CREDIT_SHARDS=shards):
+            threads = [threading.Thread(target=buyer, args=(user,)) for user in buyers]
+            if options['compact_interval']:
+                threads.append(threading.Thread(target=compaction))
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads[:len(buyers)]:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            done.set()
+            for thread in threads:
+                thread.join()
+        close_old_connections()
+        if errors:
+            raise errors[0]
+
+        # Each buyer had enough for every purchase, the money of the buyers is now shared with the seller
+        expected = purchases * price
+        balance = wallets_with_credits().get(owner=seller)
+        compact_wallets()
+        total = sum(Wallet.objects.filter(owner__in=users).values_list('balance', flat=True))
+        exact = (balance.balance + balance.credits == expected and
+                 Wallet.objects.get(owner=seller).balance == expected and total == expected * len(buyers))
+        self.stdout.write('%d shards: %.0f purchases/s, seller balance %.2f for %.2f expected, %s' % (
+            shards, purchases / elapsed, balance.balance + balance.credits, expected,
+            'exact' if exact else self.style.ERROR('WRONG')))
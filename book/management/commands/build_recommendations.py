@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from book import copurchases, recommendations
+from book.models import BookRecommendation
+
+
+# This command rebuilds the "customers who bought this also bought" table from the whole purchasers table. Between two
+# builds the table is kept up to date by each purchase (see add_purchases), the build corrects the approximations of
+# these updates and drops the pairs that left the top-k. It needs NumPy (pip install numpy).
+# Example: python manage.py build_recommendations --per-book 20 --max-basket 500
+class Command(BaseCommand):
+    help = 'Rebuild the co-purchase recommendations of every book.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-book', type=int, default=recommendations.RECOMMENDATIONS_PER_BOOK,
+                            help='Number of recommendations kept for each book.')
+        parser.add_argument('--max-basket', type=int, default=recommendations.MAX_BASKET,
+                            help='The users with more purchases are left out.')
+
+    def handle(self, *args, **options):
+        if copurchases.np is None:
+            raise CommandError('NumPy is needed to build the recommendations: pip install numpy')
+        before = BookRecommendation.objects.count()
+        rows, timings = copurchases.build_recommendations(options['per_book'], options['max_basket'])
+        self.stdout.write('load %.2fs, compute %.2fs, store %.2fs' % (timings['load'], timings['compute'],
+                                                                      timings['store']))
+        self.stdout.write(self.style.SUCCESS('%d recommendations stored (%d before).' % (rows, before)))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from book.wallets import compact_wallets
+
+
+# This command adds the credits of the sales to the wallets of the sellers (see compact_wallets in wallets.py). The
+# balances shown to the users do not change, the compaction only keeps the number of credits to sum small. It can run
+# from cron, or stay in the foreground with --interval.
+# Example: python manage.py compact_wallets --interval 60
+class Command(BaseCommand):
+    help = 'Add the credits of the sellers to their wallets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of sellers per transaction.')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Number of seconds between two compactions, compact once when not set.')
+
+    def handle(self, *args, **options):
+        while True:
+            sellers, total = compact_wallets(options['batch_size'])
+            self.stdout.write('%d sellers compacted, %.2f added to their wallets.' % (sellers, total))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
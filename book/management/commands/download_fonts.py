@@ -0,0 +1,48 @@
+import os
+import re
+import urllib.request
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from book.assets import FONTS
+
+GOOGLE_FONTS_URL = 'https://fonts.googleapis.com/css2?family=%s:wght@%d&display=swap'
+
+# Google Fonts sends woff2 files to the browsers that can read them
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+
+# This command downloads the latin subset of each font of book/assets.py from Google Fonts into the static files of the
+# book app, so the fonts are served from our own static files. It is run once, the files are committed.
+# Example: python manage.py download_fonts --force
+class Command(BaseCommand):
+    help = 'Download the fonts of the website into the static files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Download the fonts that are already there.')
+
+    def handle(self, *args, **options):
+        static_dir = os.path.join(apps.get_app_config('book').path, 'static')
+        for family, weight, path in FONTS:
+            target = os.path.join(static_dir, path)
+            if os.path.exists(target) and not options['force']:
+                continue
+            try:
+                css = self.fetch(GOOGLE_FONTS_URL % (family.replace(' ', '+'), weight)).decode()
+                # The css has one @font-face per subset, each one preceded by a /* subset */ comment
+                match = re.search(r'/\* latin \*/[^}]*?url\((\S+?)\)', css)
+                if match is None:
+                    raise CommandError('No latin subset found for %s %d.' % (family, weight))
+                content = self.fetch(match.group(1))
+            except OSError as error:
+                raise CommandError('Could not download %s %d: %s' % (family, weight, error))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as font:
+                font.write(content)
+            self.stdout.write('%s %d: %s (%d bytes)' % (family, weight, path, len(content)))
+
+    def fetch(self, url):
+        request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.read()
@@ -0,0 +1,37 @@
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand, CommandError
+
+from book.export import EXPORT_FORMATS, EXPORT_SCOPES, export_lines, export_queryset
+
+
+# This command writes the same exports as the export view: the books on sale, or the books owned or purchased by a
+# user, in csv or in json lines. The books are read chunk by chunk, so the memory used does not depend on their number.
+# Example: python manage.py export_books purchased --user reader --format jsonl --output purchases.jsonl
+class Command(BaseCommand):
+    help = 'Export books as csv or json lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scope', choices=EXPORT_SCOPES)
+        parser.add_argument('--user', help='Username of the user whose books are exported.')
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help='File where the export is written (default: standard output).')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError('Unknown user %s.' % options['user'])
+        elif options['scope'] == 'shop':
+            user = AnonymousUser()
+        else:
+            raise CommandError('The %s export needs a --user.' % options['scope'])
+
+        lines = export_lines(export_queryset(options['scope'], user), options['format'], options['chunk_size'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            output.writelines(lines)
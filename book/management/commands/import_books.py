@@ -0,0 +1,199 @@
+import contextlib
+import csv
+import itertools
+import json
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from book.facets import change_facets, count_books, facet_key
+from book.forms import CreateBookForm
+from book.fragments import bump_version
+from book.models import Book
+from book.search import reindex_books
+from book.versions import bump_catalog_version
+
+FIELDS = ['title', 'author', 'description', 'gender', 'num_pages', 'price']
+
+
+# This command imports a catalog of books from a CSV file (with a header line) or from a JSON lines file. The file is
+# streamed through a pipeline of generators (read, validate, batch), so the memory used only depends on the batch size
+# and not on the size of the file. Each batch is inserted with bulk_create in its own transaction.
+# Every row is validated with the rules of CreateBookForm. Invalid rows do not stop the import: they are written with
+# their errors in the error file.
+# The owner of the books is given with --owner, or with an 'owner' column that contains a username.
+# Example: python manage.py import_books catalog.csv --owner seller --mode update --batch-size 2000
+class Command(BaseCommand):
+    help = 'Import books from a CSV or JSON lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSON lines file, '-' reads the standard input.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Format of the file, guessed from the extension by default.')
+        parser.add_argument('--owner', help='Username of the owner of the books without an owner column.')
+        parser.add_argument('--mode', choices=['insert', 'skip', 'update'], default='insert',
+                            help='What to do with a book that already exists with the same owner, title and author: '
+                                 'insert it again, skip it or update it.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--errors', help='File where the invalid rows are written (default: <path>.errors.jsonl).')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('jsonl' if options['path'].endswith(('.jsonl', '.json', '.ndjson')) else 'csv')
+        errors_path = options['errors'] or ('import.errors.jsonl' if options['path'] == '-'
+                                            else options['path'] + '.errors.jsonl')
+        self.mode = options['mode']
+        self.default_owner = options['owner']
+        self.counts = dict(rows=0, inserted=0, updated=0, skipped=0, errors=0)
+        self.start = time.perf_counter()
+
+        # The standard input is not closed at the end, and the error file is only created by the first invalid row
+        self.errors_path, self.errors_file = errors_path, None
+        try:
+            with (contextlib.nullcontext(sys.stdin) if options['path'] == '-'
+                  else open(options['path'], newline='', encoding='utf-8')) as source:
+                rows = self.read_csv(source) if fmt == 'csv' else self.read_jsonl(source)
+                for batch in self.batches(self.validate(rows), options['batch_size']):
+                    self.import_batch(batch)
+                    self.report()
+        except OSError as error:
+            raise CommandError(error)
+        finally:
+            if self.errors_file:
+                self.errors_file.close()
+        self.report(final=True)
+        if self.counts['errors']:
+            self.stdout.write('Invalid rows have been written in %s' % errors_path)
+
+    # The readers yield (line number, row) pairs
+    def read_csv(self, source):
+        reader = csv.DictReader(source)
+        for row in reader:
+            yield reader.line_num, row
+
+    def read_jsonl(self, source):
+        for line_num, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError('a row must be a JSON object')
+            except ValueError as error:
+                self.counts['rows'] += 1
+                self.write_error(line_num, line.strip(), {'__all__': [str(error)]})
+                continue
+            yield line_num, row
+
+    # This generator yields the rows that pass the validation of CreateBookForm, with their typed values
+    def validate(self, rows):
+        for line_num, row in rows:
+            self.counts['rows'] += 1
+            form = CreateBookForm(data={field: row.get(field) for field in FIELDS})
+            if not form.is_valid():
+                errors = form.errors or {'__all__': ['The price and the number of pages must be positive.']}
+                self.write_error(line_num, row, errors)
+                continue
+            owner = row.get('owner') or self.default_owner
+            if not owner:
+                self.write_error(line_num, row, {'owner': ['This field is required.']})
+                continue
+            yield line_num, row, owner, form.cleaned_data
+
+    def batches(self, iterable, size):
+        iterator = iter(iterable)
+        while batch := list(itertools.islice(iterator, size)):
+            yield batch
+
+    def import_batch(self, batch):
+        usernames = {owner for _, _, owner, _ in batch}
+        owners = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        now = timezone.now()
+        books = []
+        for line_num, row, owner, data in batch:
+            if owner not in owners:
+                self.write_error(line_num, row, {'owner': ['Unknown user %s.' % owner]})
+                continue
+            books.append(Book(publication_date=now, owner_id=owners[owner], **data))
+
+        with transaction.atomic():
+            if self.mode == 'insert':
+                to_create, to_update = books, []
+            else:
+                to_create, to_update = self.deduplicate(books)
+            self.create(to_create)
+            if to_update:
+                for book in to_update:
+                    book.updated_at = now
+                Book.objects.bulk_update(to_update, FIELDS + ['updated_at'])
+                reindex_books(to_update)
+                deltas = count_books(to_update)
+                deltas.subtract(book.old_facet for book in to_update)
+                change_facets(deltas)
+                for book in to_update:
+                    bump_version(book.id)
+            if to_create or to_update:
+                bump_catalog_version()
+        self.counts['inserted'] += len(to_create)
+        self.counts['updated'] += len(to_update)
+
+    # This def splits the books of a batch in books to create and books to update, using the (owner, title, author)
+    # key. A book repeated in the batch is handled like a book that already exists: the last one is kept in 'update'
+    # mode and the first one in 'skip' mode.
+    def deduplicate(self, books):
+        unique = {}
+        for book in books:
+            key = (book.owner_id, book.title, book.author)
+            if key in unique:
+                self.counts['skipped'] += 1
+                if self.mode == 'skip':
+                    continue
+            unique[key] = book
+        existing = Book.objects.filter(owner_id__in={key[0] for key in unique}, title__in={key[1] for key in unique},
+                                       author__in={key[2] for key in unique})
+        to_update = []
+        for book_id, owner_id, title, author, gender, price in existing.values_list('id', 'owner_id', 'title', 'author',
+                                                                                    'gender', 'price'):
+            book = unique.pop((owner_id, title, author), None)
+            if book is None:
+                continue
+            if self.mode == 'update':
+                book.id = book_id
+                book.old_facet = facet_key(gender, price)
+                to_update.append(book)
+            else:
+                self.counts['skipped'] += 1
+        return list(unique.values()), to_update
+
+    # bulk_create does not send the save signals, so the new books are added to the search index and to the facet
+    # counts here. On the databases that can not return the ids of the inserted rows (MySQL), the new books are read
+    # back with their (owner, title, author) key and the publication date of the batch, so the books inserted at the
+    # same time by other requests are not taken.
+    def create(self, books):
+        if not books:
+            return
+        last_id = Book.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        books = Book.objects.bulk_create(books)
+        if not connection.features.can_return_rows_from_bulk_insert:
+            keys = {(book.owner_id, book.title, book.author) for book in books}
+            created = Book.objects.filter(id__gt=last_id, publication_date=books[0].publication_date,
+                                          owner_id__in={key[0] for key in keys}, title__in={key[1] for key in keys},
+                                          author__in={key[2] for key in keys})
+            books = [book for book in created if (book.owner_id, book.title, book.author) in keys]
+        reindex_books(books)
+        change_facets(count_books(books))
+
+    def write_error(self, line_num, row, errors):
+        self.counts['errors'] += 1
+        if self.errors_file is None:
+            self.errors_file = open(self.errors_path, 'w', encoding='utf-8')
+        self.errors_file.write(json.dumps({'line': line_num, 'row': row, 'errors': errors}) + '\n')
+
+    def report(self, final=False):
+        elapsed = time.perf_counter() - self.start
+        self.stdout.write('%s%d rows in %.1fs (%d rows/s): %d inserted, %d updated, %d skipped, %d errors' % (
+            'Done: ' if final else '', self.counts['rows'], elapsed, self.counts['rows'] / max(elapsed, 1e-9),
+            self.counts['inserted'], self.counts['updated'], self.counts['skipped'], self.counts['errors']))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from book.facets import count_catalog, invalidate_facets, price_bucket_label
+from book.models import BookFacet
+
+
+# This command counts the books of each facet from the Book table and repairs the facet counts that have drifted
+# (books inserted without the save signals, raw SQL, concurrent edits of the same book...). The facets are locked
+# while they are rewritten.
+# Example: python manage.py rebuild_facets --dry-run
+class Command(BaseCommand):
+    help = 'Rebuild the facet counts of the shop from the books.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            stored = {(facet.gender, facet.price_bucket): facet for facet in BookFacet.objects.select_for_update()}
+            actual = count_catalog()
+            drift = 0
+            for key in sorted(set(stored) | set(actual)):
+                count = stored[key].count if key in stored else 0
+                if count != actual.get(key, 0):
+                    drift += 1
+                    self.stdout.write('%s, %s: %d instead of %d' % (key[0], price_bucket_label(key[1]), count,
+                                                                    actual.get(key, 0)))
+            if options['dry_run'] or not drift:
+                self.stdout.write('%d facets have drifted.' % drift)
+                return
+            for key, facet in stored.items():
+                if key not in actual:
+                    facet.delete()
+                elif facet.count != actual[key]:
+                    facet.count = actual[key]
+                    facet.save(update_fields=['count'])
+            BookFacet.objects.bulk_create([BookFacet(gender=gender, price_bucket=bucket, count=count)
+                                           for (gender, bucket), count in actual.items()
+                                           if (gender, bucket) not in stored])
+            invalidate_facets()
+        self.stdout.write(self.style.SUCCESS('%d facets have been repaired.' % drift))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from book.models import Book, BookTerm, BookTermCount
+from book.search import index_books
+
+
+# This command rebuilds the whole search index. It is only needed for books that have been inserted without the save
+# signals (bulk_create, raw SQL...), because the index is otherwise maintained book by book. The counts of the terms
+# are rebuilt with the postings.
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of the books.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            BookTerm.objects.all().delete()
+            BookTermCount.objects.all().delete()
+            books = Book.objects.only('id', 'title', 'author', 'description').iterator(chunk_size=options['batch_size'])
+            index_books(books, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Indexed %d books.' % Book.objects.count()))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from book.models import SellerSales
+from book.sales import actual_seller_sales, drifted_purchase_counts, repair_purchase_counts
+
+
+# This command repairs the counters kept up to date by the purchases: the purchase count of each book is compared to
+# its number of purchasers, and the lifetime sales of each seller to the sale records. The counters that have drifted
+# (purchases inserted with bulk_create or raw SQL, purchasers removed, refunds...) are rewritten. The lifetime sales
+# are locked while they are rewritten.
+# Example: python manage.py reconcile_purchase_counts --dry-run
+class Command(BaseCommand):
+    help = 'Repair the purchase counts of the books and the lifetime sales of the sellers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--verbose', action='store_true', help='Write every counter that has drifted.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            books = drifted_purchase_counts()
+            if options['verbose']:
+                for book_id, count, actual in books:
+                    self.stdout.write('book %d: %d purchases instead of %d' % (book_id, count, actual))
+            sellers = self.drifted_sellers(options['verbose'])
+            if options['dry_run'] or not (books or sellers):
+                self.stdout.write('%d books and %d sellers have drifted.' % (len(books), len(sellers)))
+                return
+            repair_purchase_counts([book_id for book_id, _, _ in books], options['batch_size'])
+            SellerSales.objects.bulk_create([SellerSales(seller_id=seller_id, sales=sales, revenue=revenue)
+                                             for seller_id, (sales, revenue) in sellers],
+                                            update_conflicts=True, unique_fields=['seller'],
+                                            update_fields=['sales', 'revenue'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('%d books and %d sellers have been repaired.' % (len(books),
+                                                                                              len(sellers))))
+
+    # This def returns the (seller id, (actual sales, actual revenue)) pairs of the lifetime sales that have drifted
+    def drifted_sellers(self, verbose):
+        stored = {row.seller_id: (row.sales, row.revenue) for row in SellerSales.objects.select_for_update()}
+        actual = actual_seller_sales()
+        drifted = []
+        for seller_id in sorted(set(stored) | set(actual)):
+            (sales, revenue), expected = stored.get(seller_id, (0, 0.0)), actual.get(seller_id, (0, 0.0))
+            if sales != expected[0] or round(revenue - expected[1], 2):
+                drifted.append((seller_id, expected))
+                if verbose:
+                    self.stdout.write('seller %d: %d sales and %.2f instead of %d and %.2f' % (
+                        seller_id, sales, revenue, *expected))
+        return drifted
@@ -0,0 +1,42 @@
+import signal
+
+from django.conf import settings
+from django.db import connection
+from django.core.management.base import BaseCommand
+
+from book.jobs import Worker, job_metrics, run_due_jobs
+
+
+# This command starts a worker of the job queue (see book/jobs.py). Several workers can run at the same time, on one or
+# more servers. SIGTERM or Ctrl-C stops the worker once the jobs running are finished.
+# Example: python manage.py run_jobs --threads 8
+class Command(BaseCommand):
+    help = 'Run the background jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=getattr(settings, 'JOB_WORKER_THREADS', 4),
+                            help='Number of jobs run at the same time.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Number of seconds between two reads of an empty queue.')
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due, then stop.')
+        parser.add_argument('--metrics', action='store_true', help='Only write the metrics of the queue.')
+
+    def handle(self, *args, **options):
+        if options['metrics']:
+            for name, value in job_metrics().items():
+                self.stdout.write('%s: %s' % (name, value))
+            return
+        threads = options['threads']
+        # SQLite has a single writer: the jobs run at the same time would fail with "database is locked"
+        if connection.vendor == 'sqlite' and threads > 1:
+            self.stderr.write('SQLite can only run one job at a time.')
+            threads = 1
+        if options['once'] and threads == 1:
+            self.stdout.write('%d jobs run.' % run_due_jobs())
+            return
+        worker = Worker(threads=threads, poll_interval=options['poll_interval'])
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: worker.stop())
+        self.stdout.write('Worker started with %d threads.' % threads)
+        worker.run(once=options['once'])
+        self.stdout.write('Worker stopped.')
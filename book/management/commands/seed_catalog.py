@@ -0,0 +1,125 @@
+import datetime
+import random
+import time
+from array import array
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from book.facets import change_facets, count_books
+from book.models import Book, SellerSales, Wallet
+from book.sales import (actual_seller_sales, backfill_purchases, drifted_purchase_counts, rebuild_rollups,
+                        repair_purchase_counts)
+from book.search import index_books
+
+GENDERS = ['Fantasy', 'Action', 'Romance', 'Horror', 'Poetry', 'Science-fiction', 'Thriller', 'History']
+WORDS = ('dragon kingdom night shadow river garden secret winter storm silver empire letter island ocean city '
+         'forest queen king journey war love stone fire star dream house road mountain ghost child time').split()
+
+# The password of every generated user, hashed once for all of them
+SEED_PASSWORD = 'seed-password'
+SEED_DATE = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+# This command fills the database with a deterministic synthetic catalog: users with their wallet, books and purchases.
+# The same seed always gives the same data. Everything is inserted with bulk_create, in batches, one transaction per
+# batch, the books are counted in the facets and the purchases are recorded as sales and counted. The generated users
+# are named seed-user-<n> and can log in with the password 'seed-password'.
+# Example: python manage.py seed_catalog --users 100000 --books 1000000 --purchases 3000000
+class Command(BaseCommand):
+    help = 'Generate a deterministic synthetic catalog for load tests and benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--purchases', type=int, default=30000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--no-search-index', action='store_true',
+                            help='Do not add the books to the search index (rebuild_search_index can do it later).')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith='seed-user-').exists():
+            raise CommandError('The database already contains a seeded catalog.')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        start = time.perf_counter()
+
+        users = self.create_users(options['users'])
+        self.stdout.write('%d users in %.1fs' % (len(users), time.perf_counter() - start))
+        books = self.create_books(users, options['books'], not options['no_search_index'])
+        self.stdout.write('%d books in %.1fs' % (len(books[0]), time.perf_counter() - start))
+        purchases = self.create_purchases(users, books, options['purchases'])
+        self.stdout.write('%d purchases in %.1fs' % (purchases, time.perf_counter() - start))
+        # The purchases are inserted without buy_book, their sales are recorded from the purchasers table
+        backfill_purchases(self.batch_size)
+        rebuild_rollups(self.batch_size)
+        repair_purchase_counts([book_id for book_id, _, _ in drifted_purchase_counts()], self.batch_size)
+        SellerSales.objects.bulk_create([SellerSales(seller_id=seller_id, sales=sales, revenue=revenue)
+                                         for seller_id, (sales, revenue) in actual_seller_sales().items()],
+                                        batch_size=self.batch_size)
+        self.stdout.write('sales in %.1fs' % (time.perf_counter() - start))
+
+    def batches(self, count):
+        for offset in range(0, count, self.batch_size):
+            yield offset, min(self.batch_size, count - offset)
+
+    def create_users(self, count):
+        password = make_password(SEED_PASSWORD)
+        for offset, size in self.batches(count):
+            with transaction.atomic():
+                users = User.objects.bulk_create([User(username='seed-user-%d' % i, password=password)
+                                                  for i in range(offset, offset + size)])
+                # The ids are read back for the databases that do not return them (MySQL)
+                ids = User.objects.filter(username__in=[user.username for user in users]).values_list('id', flat=True)
+                Wallet.objects.bulk_create([Wallet(owner_id=user_id, balance=round(self.random.uniform(0, 500), 2))
+                                            for user_id in sorted(ids)])
+        return list(User.objects.filter(username__startswith='seed-user-').order_by('id').values_list('id', flat=True))
+
+    def text(self, length):
+        return ' '.join(self.random.choice(WORDS) for _ in range(length))
+
+    def last_book_id(self):
+        return Book.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    def create_books(self, users, count, search_index):
+        first_id = self.last_book_id() + 1
+        for offset, size in self.batches(count):
+            with transaction.atomic():
+                last_id = self.last_book_id()
+                books = Book.objects.bulk_create([
+                    Book(title=self.text(3).title(), author=self.text(2).title(), description=self.text(25),
+                         gender=self.random.choice(GENDERS), num_pages=self.random.randint(50, 1200),
+                         price=round(self.random.uniform(1, 60), 2), owner_id=self.random.choice(users),
+                         publication_date=SEED_DATE + datetime.timedelta(minutes=self.random.randint(0, 10 ** 6)))
+                    for _ in range(size)])
+                change_facets(count_books(books))
+                if search_index:
+                    # The books are read back for the databases that do not return the ids (MySQL)
+                    if books[0].id is None:
+                        books = Book.objects.filter(id__gt=last_id)
+                    index_books(books, batch_size=self.batch_size * 10)
+        # The ids and the owners are kept in arrays of integers, a list of a million tuples would take 100MB
+        books = Book.objects.filter(id__gte=first_id).order_by('id').values_list('id', 'owner_id')
+        ids, owners = array('q'), array('q')
+        for book_id, owner_id in books.iterator(chunk_size=self.batch_size):
+            ids.append(book_id)
+            owners.append(owner_id)
+        return ids, owners
+
+    # The purchases are random (user, book) pairs, a pair drawn twice is only inserted once
+    def create_purchases(self, users, books, count):
+        ids, owners = books
+        through = Book.purchasers.through
+        for offset, size in self.batches(count):
+            rows = []
+            for _ in range(size):
+                position = self.random.randrange(len(ids))
+                user_id = self.random.choice(users)
+                if user_id != owners[position]:
+                    rows.append(through(book_id=ids[position], user_id=user_id))
+            with transaction.atomic():
+                through.objects.bulk_create(rows, ignore_conflicts=True)
+        return through.objects.filter(book_id__gte=ids[0]).count() if ids else 0
@@ -0,0 +1,106 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:36
+
+import copy
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# The production database already has these columns and tables: they were created before the migrations were kept up
+# to date. The operations below only update the state of the models, and this def creates what is missing, so the
+# migration runs on the existing databases as well as on the new ones. The missing columns are added nullable, the
+# existing rows are filled, and the columns are then made NOT NULL: adding a NOT NULL column directly would rebuild
+# the table on SQLite from the model, which already has the other missing columns.
+def create_missing(apps, schema_editor):
+    connection = schema_editor.connection
+    Book = apps.get_model('book', 'Book')
+    Wallet = apps.get_model('book', 'Wallet')
+    tables = connection.introspection.table_names()
+    with connection.cursor() as cursor:
+        columns = {column.name for column in connection.introspection.get_table_description(cursor,
+                                                                                             Book._meta.db_table)}
+    added = []
+    for name in ['description', 'gender', 'owner', 'price']:
+        field = Book._meta.get_field(name)
+        if field.column not in columns:
+            nullable = copy.copy(field)
+            nullable.null = True
+            schema_editor.add_field(Book, nullable)
+            added.append((nullable, field))
+    books = Book.objects.using(connection.alias)
+    if added and books.exists():
+        books.update(**{field.attname: default_value(apps, schema_editor, field) for nullable, field in added})
+    for nullable, field in added:
+        schema_editor.alter_field(Book, nullable, field)
+    purchasers = Book._meta.get_field('purchasers')
+    if purchasers.remote_field.through._meta.db_table not in tables:
+        schema_editor.create_model(purchasers.remote_field.through)
+    if Wallet._meta.db_table not in tables:
+        schema_editor.create_model(Wallet)
+
+
+# This def returns the value of an added column for the existing books. There is no user id that is sure to exist, so
+# the books are given to the first superuser (or the first user when there is no superuser), and the migration fails
+# when there is no user to give them to.
+def default_value(apps, schema_editor, field):
+    if field.name != 'owner':
+        return {'description': '', 'gender': '', 'price': 0.0}[field.name]
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    ordering = ['-is_superuser', 'pk'] if any(f.name == 'is_superuser' for f in User._meta.fields) else ['pk']
+    owner = User.objects.using(schema_editor.connection.alias).order_by(*ordering).values_list('pk', flat=True).first()
+    if owner is None:
+        raise RuntimeError('The existing books need an owner: create a user (manage.py createsuperuser) before '
+                           'running this migration.')
+    return owner
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('book', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AddField(
+                model_name='book',
+                name='description',
+                field=models.CharField(default='', max_length=1000),
+                preserve_default=False,
+            ),
+            migrations.AddField(
+                model_name='book',
+                name='gender',
+                field=models.CharField(default='', max_length=50),
+                preserve_default=False,
+            ),
+            migrations.AddField(
+                model_name='book',
+                name='owner',
+                field=models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, related_name='related_primary_manual_roats', to=settings.AUTH_USER_MODEL),
+                preserve_default=False,
+            ),
+            migrations.AddField(
+                model_name='book',
+                name='price',
+                field=models.FloatField(default=0.0),
+                preserve_default=False,
+            ),
+            migrations.AddField(
+                model_name='book',
+                name='purchasers',
+                field=models.ManyToManyField(related_name='related_secondary_manual_roats', to=settings.AUTH_USER_MODEL),
+            ),
+            migrations.CreateModel(
+                name='Wallet',
+                fields=[
+                    ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('balance', models.FloatField()),
+                    ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ],
+            ),
+        ]),
+        migrations.RunPython(create_missing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from book.search import book_terms
+
+
+# The books that already exist are added to the search index, by batches of postings
+def index_catalog(apps, schema_editor):
+    Book = apps.get_model('book', 'Book')
+    BookTerm = apps.get_model('book', 'BookTerm')
+    postings = []
+    for book in Book.objects.only('title', 'author', 'description').order_by('id').iterator(chunk_size=2000):
+        postings += [BookTerm(term=term, book_id=book.id, weight=weight) for term, weight in book_terms(book).items()]
+        if len(postings) >= 1000:
+            BookTerm.objects.bulk_create(postings)
+            postings = []
+    BookTerm.objects.bulk_create(postings)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0003_book_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=50)),
+                ('weight', models.IntegerField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='book.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'weight', 'book'], name='book_term_weight_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='bookterm',
+            constraint=models.UniqueConstraint(fields=('term', 'book'), name='book_term_unique'),
+        ),
+        migrations.RunPython(index_catalog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0004_bookterm'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['owner', 'title', 'author'], name='book_owner_title_author_idx'),
+        ),
+    ]
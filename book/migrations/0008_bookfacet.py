@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:18
+
+from collections import Counter
+
+from django.db import migrations, models
+
+from book.facets import facet_key
+
+
+# The books that already exist are counted in their facets
+def count_facets(apps, schema_editor):
+    Book = apps.get_model('book', 'Book')
+    BookFacet = apps.get_model('book', 'BookFacet')
+    counts = Counter(facet_key(gender, price) for gender, price in
+                     Book.objects.values_list('gender', 'price').iterator(chunk_size=5000))
+    BookFacet.objects.bulk_create([BookFacet(gender=gender, price_bucket=bucket, count=count)
+                                   for (gender, bucket), count in counts.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0007_book_shop_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gender', models.CharField(max_length=50)),
+                ('price_bucket', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='bookfacet',
+            constraint=models.UniqueConstraint(fields=('gender', 'price_bucket'), name='book_facet_unique'),
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
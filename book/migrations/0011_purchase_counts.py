@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:43
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+# The purchase counts of the books are read from the purchasers table, and the lifetime sales of the sellers from the
+# sale records
+def count_purchases(apps, schema_editor):
+    Book = apps.get_model('book', 'Book')
+    Purchase = apps.get_model('book', 'Purchase')
+    SellerSales = apps.get_model('book', 'SellerSales')
+    purchasers = (Book.purchasers.through.objects.filter(book_id=OuterRef('pk')).order_by()
+                  .values('book_id').annotate(count=Count('id')).values('count'))
+    Book.objects.update(purchase_count=Coalesce(Subquery(purchasers), 0))
+    rows = Purchase.objects.values_list('seller_id').annotate(sales=Count('id'), revenue=Sum('price')).order_by()
+    SellerSales.objects.bulk_create([SellerSales(seller_id=seller_id, sales=sales, revenue=revenue)
+                                     for seller_id, sales, revenue in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('book', '0010_sales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerSales',
+            fields=[
+                ('seller', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('sales', models.IntegerField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='purchase_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['purchase_count', 'id'], name='book_purchases_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['gender', 'purchase_count', 'id'], name='book_gender_purchases_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author', 'purchase_count', 'id'], name='book_author_purchases_id_idx'),
+        ),
+        migrations.RunPython(count_purchases, migrations.RunPython.noop),
+    ]
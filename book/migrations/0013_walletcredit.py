@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('book', '0012_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletCredit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.IntegerField()),
+                ('amount', models.FloatField(default=0.0)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='walletcredit',
+            constraint=models.UniqueConstraint(fields=('owner', 'shard'), name='wallet_credit_unique'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:40
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# The counts of the terms already in the search index are computed from the postings, with one GROUP BY query
+def count_terms(apps, schema_editor):
+    BookTerm = apps.get_model('book', 'BookTerm')
+    BookTermCount = apps.get_model('book', 'BookTermCount')
+    rows = BookTerm.objects.values_list('term').annotate(count=Count('id')).order_by().iterator(chunk_size=5000)
+    BookTermCount.objects.bulk_create((BookTermCount(term=term, count=count) for term, count in rows),
+                                      batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0013_walletcredit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookTermCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=50, unique=True)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_terms, migrations.RunPython.noop),
+    ]
@@ -12,13 +12,197 @@ class Book(models.Model):
     description = models.CharField(max_length=1000)
     gender = models.CharField(max_length=50)
     price = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # The number of users who purchased the book, incremented by each purchase (see sales.py) and repaired by the
+    # reconcile_purchase_counts command. It is the sort key of the bestsellers.
+    purchase_count = models.IntegerField(default=0)
 
     # ManyToManyField behave like a list. It will store a queryset of foreign key of User to know which user purchased
     # the book.
     purchasers = models.ManyToManyField(User, related_name='related_secondary_manual_roats')
 
+    # These indexes match the (publication_date, id) sort key used by the keyset pagination of the shop and of the
+    # owned books, so every page is read as an index range scan.
+    class Meta:
+        indexes = [
+            models.Index(fields=['publication_date', 'id'], name='book_pubdate_id_idx'),
+            models.Index(fields=['owner', 'publication_date', 'id'], name='book_owner_pubdate_id_idx'),
+            # This index is used by the import command to find the books that already exist
+            models.Index(fields=['owner', 'title', 'author'], name='book_owner_title_author_idx'),
+            # These indexes back the filters and the sort orders of the shop: the equality filter (gender or author)
+            # comes first, then the sort key. A price range is read on the price indexes.
+            models.Index(fields=['price', 'id'], name='book_price_id_idx'),
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+            models.Index(fields=['gender', 'publication_date', 'id'], name='book_gender_pubdate_id_idx'),
+            models.Index(fields=['gender', 'price', 'id'], name='book_gender_price_id_idx'),
+            models.Index(fields=['gender', 'title', 'id'], name='book_gender_title_id_idx'),
+            models.Index(fields=['author', 'publication_date', 'id'], name='book_author_pubdate_id_idx'),
+            models.Index(fields=['author', 'price', 'id'], name='book_author_price_id_idx'),
+            models.Index(fields=['author', 'title', 'id'], name='book_author_title_id_idx'),
+            # These indexes back the bestsellers, read in the (-purchase_count, -id) order
+            models.Index(fields=['purchase_count', 'id'], name='book_purchases_id_idx'),
+            models.Index(fields=['gender', 'purchase_count', 'id'], name='book_gender_purchases_id_idx'),
+            models.Index(fields=['author', 'purchase_count', 'id'], name='book_author_purchases_id_idx'),
+        ]
+
 
 # This model will store the wallet information of each user to give them the capability to buy books from the store
 class Wallet(models.Model):
     balance = models.FloatField()
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
+
+
+# This model holds the sales of a seller that are not added to their wallet yet. The credits of a seller are spread
+# over a few rows (the shards), so the purchases of a popular seller do not all wait for the lock of the same row. The
+# balance of a user is their wallet plus their credits, and the compact_wallets command adds the credits to the
+# wallets (see wallets.py).
+class WalletCredit(models.Model):
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    shard = models.IntegerField()
+    amount = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'shard'], name='wallet_credit_unique'),
+        ]
+
+
+# This model is the inverted index used by the search engine. Each row is a posting: a normalized term found in the
+# title, the author or the description of a book, with a weight that tells how much the term matters for this book.
+class BookTerm(models.Model):
+    term = models.CharField(max_length=50)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='terms')
+    weight = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'book'], name='book_term_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['term', 'weight', 'book'], name='book_term_weight_idx'),
+        ]
+
+
+# This model holds the number of books of each term of the search index, used for the inverse document frequency of
+# the terms. It is kept up to date with the postings (see search.py), so it is read instead of counting them.
+class BookTermCount(models.Model):
+    term = models.CharField(max_length=50, unique=True)
+    count = models.IntegerField(default=0)
+
+
+# This model holds the number of books of each facet of the shop: a gender and a price bucket (see facets.py). It is
+# kept up to date each time a book is created, edited or deleted, so the counts shown next to the shop are read from a
+# few rows instead of counting the whole catalog.
+class BookFacet(models.Model):
+    gender = models.CharField(max_length=50)
+    price_bucket = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['gender', 'price_bucket'], name='book_facet_unique'),
+        ]
+
+
+# This model is the precomputed "customers who bought this also bought" table: for each book, the books most often
+# purchased by the same users, with the number of users who purchased both books (see recommendations.py).
+class BookRecommendation(models.Model):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    score = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'recommended'], name='book_recommendation_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['book', '-score', 'recommended'], name='book_recommendation_score_idx'),
+        ]
+
+
+# This model is the record of a sale: the book, the buyer, the seller, the price paid and the time of the purchase. The
+# purchasers table only tells who owns what, the sales keep the history when a price changes. A deleted book keeps its
+# sales, without the book.
+class Purchase(models.Model):
+    book = models.ForeignKey(Book, on_delete=models.SET_NULL, null=True, related_name='sales')
+    buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    price = models.FloatField()
+    purchased_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['seller', 'purchased_at'], name='purchase_seller_date_idx'),
+            models.Index(fields=['book', 'buyer'], name='purchase_book_buyer_idx'),
+        ]
+
+
+# These models are the daily rollups of the sales, kept up to date by each purchase (see sales.py): the number of
+# sales and the revenue of each seller, and of each book, per day. The analytics of a seller only read these rows.
+class SellerDailySales(models.Model):
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    sales = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['seller', 'day'], name='seller_daily_sales_unique'),
+        ]
+
+
+class BookDailySales(models.Model):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    sales = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'day'], name='book_daily_sales_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['seller', 'day'], name='book_daily_sales_seller_idx'),
+        ]
+
+
+# This model holds the lifetime sales of a seller: the number of books sold and the revenue since the first sale. It is
+# incremented by each purchase with the daily rollups, and repaired from the sale records by the
+# reconcile_purchase_counts command.
+class SellerSales(models.Model):
+    seller = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    sales = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+
+# This model is the queue of the background jobs (see jobs.py): each row is a task to run by the run_jobs worker, with
+# its arguments. A job is inserted in the transaction of the request that enqueues it, so it is only run if the request
+# succeeds. The key makes the enqueue idempotent: a second job with the same key is not inserted.
+class Job(models.Model):
+    class Status(models.TextChoices):
+        QUEUED = 'queued'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict)
+    key = models.CharField(max_length=200, null=True, unique=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField()
+    # The job is not run before this time, it is pushed back after each failed attempt
+    run_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker reads the queued jobs that are due in the order of this index
+            models.Index(fields=['status', 'run_at', 'id'], name='job_status_run_at_idx'),
+            # The latency metrics read the last finished jobs, and the old ones are deleted, on this index
+            models.Index(fields=['status', 'finished_at'], name='job_status_finished_at_idx'),
+        ]
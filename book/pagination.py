@@ -0,0 +1,129 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.http import Http404
+
+
+# This class is a single page returned by the keyset paginator. It only knows the books it contains and the cursors
+# that lead to the previous and the next pages.
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+# This paginator will split a queryset in pages using a stable sort key instead of an OFFSET. Each page is fetched with
+# a "WHERE key > last_key ORDER BY key LIMIT n" query, so a deep page costs the same as the first one and a book
+# inserted or deleted while someone is paging will never shift the rows of the following pages.
+# Cursors are opaque tokens: an url-safe base64 encoding of the direction and of the key of the boundary row.
+class KeysetPaginator:
+    def __init__(self, queryset, per_page, ordering=('publication_date', 'id')):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+
+    # The fields of the ordering can be descending ('-price'): the key holds their values, and the comparisons of the
+    # keyset filter are reversed for them.
+    def get_key(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def encode_cursor(self, direction, values):
+        data = json.dumps([direction] + [str(value) for value in values], separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, *values = json.loads(data)
+            if direction not in ('n', 'p') or len(values) != len(self.ordering):
+                raise ValueError(cursor)
+            model = self.queryset.model
+            values = [model._meta.get_field(field.lstrip('-')).to_python(value)
+                      for field, value in zip(self.ordering, values)]
+        except Exception:
+            raise Http404('Invalid cursor.')
+        return direction, values
+
+    # This def builds the "row comes after (or before) the key" condition for a composite key:
+    # (a > x) OR (a = x AND b > y) OR ...
+    def keyset_filter(self, values, lookup):
+        reverse = {'gt': 'lt', 'lt': 'gt'}
+        names = [field.lstrip('-') for field in self.ordering]
+        condition = Q()
+        for position, field in enumerate(self.ordering):
+            equal = {name: value for name, value in zip(names[:position], values[:position])}
+            field_lookup = reverse[lookup] if field.startswith('-') else lookup
+            condition |= Q(**equal, **{'%s__%s' % (names[position], field_lookup): values[position]})
+        return condition
+
+    # This def returns the query of a page: the rows of the page plus one, to know if there is a page after it
+    def page_query(self, cursor=None):
+        if not cursor:
+            return self.queryset.order_by(*self.ordering)[:self.per_page + 1], None, None
+        direction, values = self.decode_cursor(cursor)
+        if direction == 'n':
+            queryset = self.queryset.filter(self.keyset_filter(values, 'gt')).order_by(*self.ordering)
+        else:
+            reversed_ordering = [field[1:] if field.startswith('-') else '-' + field for field in self.ordering]
+            queryset = self.queryset.filter(self.keyset_filter(values, 'lt')).order_by(*reversed_ordering)
+        return queryset[:self.per_page + 1], direction, values
+
+    def build_page(self, rows, direction, values):
+        if direction is None:
+            has_next, has_previous = len(rows) > self.per_page, False
+            rows = rows[:self.per_page]
+        else:
+            if direction == 'n':
+                has_next, has_previous = len(rows) > self.per_page, True
+                rows = rows[:self.per_page]
+            else:
+                has_next, has_previous = True, len(rows) > self.per_page
+                rows = rows[:self.per_page][::-1]
+            # An empty page can only be reached when the books around the cursor have been deleted. The cursor itself
+            # is then used as the boundary so the client is never stranded.
+            if not rows:
+                return KeysetPage(rows, next_cursor=self.encode_cursor('n', values) if direction == 'p' else None,
+                                  previous_cursor=self.encode_cursor('p', values) if direction == 'n' else None)
+        if not rows:
+            return KeysetPage(rows)
+        return KeysetPage(rows, next_cursor=self.encode_cursor('n', self.get_key(rows[-1])) if has_next else None,
+                          previous_cursor=self.encode_cursor('p', self.get_key(rows[0])) if has_previous else None)
+
+    def page(self, cursor=None):
+        queryset, direction, values = self.page_query(cursor)
+        return self.build_page(list(queryset), direction, values)
+
+    # The same page, read with the async ORM
+    async def apage(self, cursor=None):
+        queryset, direction, values = self.page_query(cursor)
+        return self.build_page([row async for row in queryset], direction, values)
+
+
+# This mixin replaces the OFFSET pagination of a ListView by the keyset paginator. The cursor is read from the
+# 'cursor' GET parameter and the page is given to the template as 'page_obj'.
+class KeysetPaginationMixin:
+    paginate_by = 20
+    keyset_ordering = ('publication_date', 'id')
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, self.keyset_ordering)
+        page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        return paginator, page, page.object_list, page.has_other_pages()
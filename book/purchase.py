@@ -0,0 +1,129 @@
+import enum
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.dispatch import Signal
+
+from .models import Book
+from .sales import record_sales
+from .wallets import credit_wallets, debit_wallet, invalidate_wallets
+
+
+# These are the possible outcomes of a purchase
+class PurchaseResult(enum.Enum):
+    SUCCESS = 'success'
+    INSUFFICIENT_FUNDS = 'insufficient funds'
+    ALREADY_OWNED = 'already owned'
+    OWN_BOOK = 'own book'
+    NOT_FOUND = 'not found'
+    EMPTY_CART = 'empty cart'
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+# This signal is sent once by each purchase (buy_book, checkout), in its transaction once everything is written, with
+# the id of the buyer and the ids of the books purchased. The purchaser rows are not inserted with purchasers.add: when
+# m2m_changed has receivers, add() ignores the rows that already exist instead of failing. The receivers of the
+# purchases listen to this signal instead (see signals.py).
+book_purchased = Signal()
+
+
+# This def transfers the price of a book from the buyer's wallet to the seller's wallet and records the purchase.
+# Everything is done in one transaction without reading the wallets first:
+# - the purchaser row is inserted first, the unique (book, user) constraint of the purchasers table rejects a book
+#   bought twice, even by two concurrent requests,
+# - the buyer is debited with a conditional "UPDATE ... SET balance = balance - price WHERE balance >= price", so the
+#   balance can never go below zero and no money is lost between a read and a write (see debit_wallet),
+# - the seller is credited on one of the shards of their credits, not on their wallet (see credit_wallets),
+# - the sale is recorded with its price, and added to the daily sales of the seller and of the book (see sales.py).
+# The database only locks the wallet of the buyer and a shard of the seller for the time of the transaction.
+# The cached wallets of both users are cleared once the transaction is committed, and book_purchased is sent.
+# The view can give the book when it is already loaded (see identity.py).
+def buy_book(user, book_id, book=None):
+    if book is None:
+        book = Book.objects.only('owner_id', 'price').filter(pk=book_id).first()
+    if book is None:
+        return PurchaseResult.NOT_FOUND
+    owner_id, price = book.owner_id, book.price
+    if owner_id == user.id:
+        return PurchaseResult.OWN_BOOK
+    through = Book.purchasers.through
+    try:
+        with transaction.atomic():
+            through.objects.create(book_id=book_id, user_id=user.id)
+            if not debit_wallet(user.id, price):
+                raise InsufficientFunds
+            credit_wallets({owner_id: price})
+            record_sales(user.id, [(book_id, owner_id, price)])
+            invalidate_wallets(user.id, owner_id)
+            book_purchased.send(sender=Book, user_id=user.id, book_ids={book_id})
+    except IntegrityError as error:
+        result, _ = integrity_error_result(user, [book_id], error)
+        return result
+    except InsufficientFunds:
+        return PurchaseResult.INSUFFICIENT_FUNDS
+    return PurchaseResult.SUCCESS
+
+
+# This def buys every book of a cart at once, in one transaction, with the same number of queries whatever the size of
+# the cart:
+# - the books and the purchases of the user among them are read with two queries, and the whole cart is checked before
+#   anything is written: every book must exist, be sold by another user and not be purchased yet,
+# - the purchaser rows are inserted with a single bulk insert, the unique (book, user) constraint still rejects a book
+#   bought by a concurrent request,
+# - the buyer is debited once with the total price, with the same conditional update as buy_book,
+# - the sellers are credited with a single "UPDATE ... SET amount = amount + CASE owner_id WHEN ... END" of their
+#   shards (see credit_wallets),
+# - the sales are recorded with the same number of queries as a single sale (see record_sales).
+# It returns the result and the ids of the books that made the checkout fail.
+def checkout(user, book_ids):
+    book_ids = set(book_ids)
+    if not book_ids:
+        return PurchaseResult.EMPTY_CART, []
+    books = {book_id: (owner_id, price) for book_id, owner_id, price in
+             Book.objects.filter(pk__in=book_ids).values_list('id', 'owner_id', 'price')}
+    if book_ids - books.keys():
+        return PurchaseResult.NOT_FOUND, sorted(book_ids - books.keys())
+    own = [book_id for book_id, (owner_id, price) in books.items() if owner_id == user.id]
+    if own:
+        return PurchaseResult.OWN_BOOK, sorted(own)
+    through = Book.purchasers.through
+    purchased = through.objects.filter(user_id=user.id, book_id__in=book_ids).values_list('book_id', flat=True)
+    if purchased := sorted(purchased):
+        return PurchaseResult.ALREADY_OWNED, purchased
+
+    credits = defaultdict(float)
+    for owner_id, price in books.values():
+        credits[owner_id] += price
+    try:
+        with transaction.atomic():
+            through.objects.bulk_create([through(book_id=book_id, user_id=user.id) for book_id in book_ids])
+            total = sum(credits.values())
+            if not debit_wallet(user.id, total):
+                raise InsufficientFunds
+            credit_wallets(credits)
+            record_sales(user.id, [(book_id, owner_id, price) for book_id, (owner_id, price) in books.items()])
+            invalidate_wallets(user.id, *credits)
+            book_purchased.send(sender=Book, user_id=user.id, book_ids=book_ids)
+    except IntegrityError as error:
+        return integrity_error_result(user, book_ids, error)
+    except InsufficientFunds:
+        return PurchaseResult.INSUFFICIENT_FUNDS, []
+    return PurchaseResult.SUCCESS, sorted(book_ids)
+
+
+# This def tells why a purchase failed with an integrity error, once its transaction is rolled back: a concurrent
+# request bought one of the books first (the unique constraint of the purchasers), or deleted one of them (the foreign
+# key of the purchasers). Any other integrity error is a bug, it is raised again. It returns the result and the ids of
+# the books concerned.
+def integrity_error_result(user, book_ids, error):
+    owned = sorted(Book.purchasers.through.objects.filter(user_id=user.id, book_id__in=book_ids)
+                   .values_list('book_id', flat=True))
+    if owned:
+        return PurchaseResult.ALREADY_OWNED, owned
+    missing = set(book_ids) - set(Book.objects.filter(pk__in=book_ids).values_list('id', flat=True))
+    if missing:
+        return PurchaseResult.NOT_FOUND, sorted(missing)
+    raise error
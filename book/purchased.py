@@ -0,0 +1,94 @@
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Book
+
+PURCHASED_CACHE_TIMEOUT = getattr(settings, 'PURCHASED_CACHE_TIMEOUT', 3600)
+
+
+# This class is the set of the books purchased by a user. The ids are kept sorted in an array of machine integers
+# (4 bytes per book, or 8 bytes when an id does not fit in 32 bits) instead of a python set (about 60 bytes per book),
+# so a user with 10,000 purchases costs about 40KB in the cache. A membership check is a binary search.
+class PurchasedBooks:
+    def __init__(self, ids=()):
+        ids = sorted(ids)
+        self.ids = array('i' if not ids or ids[-1] < 2 ** 31 else 'q', ids)
+
+    def __contains__(self, book_id):
+        position = bisect_left(self.ids, book_id)
+        return position < len(self.ids) and self.ids[position] == book_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    # The number of bytes used by the ids
+    def size(self):
+        return self.ids.itemsize * len(self.ids)
+
+
+def version_cache_key(user_id):
+    return 'purchased-version:%s' % user_id
+
+
+# The version of a user's set is the key of the set in the cache: bumping it makes the old set unreachable. When the
+# version is missing (first use or evicted), a new one is built from the clock, so an old set can never be reused.
+def get_version(user_id):
+    key = version_cache_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def purchased_cache_key(user_id):
+    return 'purchased:%s:%s' % (user_id, get_version(user_id))
+
+
+# This def returns the books purchased by a user. The purchasers table is only read when the set of the current
+# version is not cached yet.
+def get_purchased_books(user_id):
+    key = purchased_cache_key(user_id)
+    purchased = cache.get(key)
+    if purchased is None:
+        purchased = PurchasedBooks(purchased_ids(user_id))
+        cache.set(key, purchased, PURCHASED_CACHE_TIMEOUT)
+    return purchased
+
+
+# The same def for the async views, the purchases are read with the async ORM
+async def aget_purchased_books(user_id):
+    key = purchased_cache_key(user_id)
+    purchased = cache.get(key)
+    if purchased is None:
+        purchased = PurchasedBooks([book_id async for book_id in purchased_ids(user_id)])
+        cache.set(key, purchased, PURCHASED_CACHE_TIMEOUT)
+    return purchased
+
+
+# The books purchased by a user when they are cached, None otherwise. Nothing is cached, so it can be called in the
+# transaction of a purchase: a set read there could hold a purchase that is then rolled back.
+def get_cached_purchased_books(user_id):
+    return cache.get(purchased_cache_key(user_id))
+
+
+def purchased_ids(user_id):
+    return Book.purchasers.through.objects.filter(user_id=user_id).values_list('book_id', flat=True)
+
+
+# This def must be called each time the purchases of users are changed. The versions are bumped once the transaction
+# is committed, otherwise another request could cache the old purchases again under the new version.
+def invalidate_purchased_books(*user_ids):
+    def bump():
+        for user_id in user_ids:
+            try:
+                cache.incr(version_cache_key(user_id))
+            except ValueError:
+                cache.set(version_cache_key(user_id), time.time_ns(), None)
+    transaction.on_commit(bump)
@@ -0,0 +1,150 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .jobs import enqueue
+from .models import Book, BookRecommendation
+from .purchased import get_cached_purchased_books, get_version as get_purchased_version
+
+# The number of recommendations stored for each book by the batch build (copurchases.py)
+RECOMMENDATIONS_PER_BOOK = getattr(settings, 'RECOMMENDATIONS_PER_BOOK', 20)
+# The users with more purchases than this are left out: a basket of n books gives n² pairs, and says little about
+# the books it contains
+MAX_BASKET = getattr(settings, 'RECOMMENDATIONS_MAX_BASKET', 500)
+RECOMMENDATIONS_CACHE_TIMEOUT = getattr(settings, 'RECOMMENDATIONS_CACHE_TIMEOUT', 600)
+# The shop recommends the books bought with the last books purchased by the user
+SHOP_SOURCES = 20
+
+
+# This def adds new purchases of a user to the recommendations between two batch builds: each new book gains one
+# co-purchase with each book the user purchased before, and with the other new books, in both directions. It is called
+# in the transaction of the purchase (see signals.py): the books purchased before are read now, so the books purchased
+# in the same transaction are not counted twice, and the scores are changed by the job queue (count_copurchases in
+# tasks.py). The books purchased before are taken from the cached purchases of the user (see purchased.py), the
+# purchasers table is only read when they are not cached. The job is inserted in the transaction of the purchase: a
+# purchase that is rolled back is never counted, and a failure of the counting can not fail a purchase that is paid.
+def add_purchases(user_id, book_ids):
+    book_ids = set(book_ids)
+    purchased = get_cached_purchased_books(user_id)
+    if purchased is not None:
+        others = [book_id for book_id in purchased.ids if book_id not in book_ids][:MAX_BASKET]
+    else:
+        others = list(Book.purchasers.through.objects.filter(user_id=user_id).exclude(book_id__in=book_ids)
+                      .values_list('book_id', flat=True)[:MAX_BASKET])
+    if len(others) + len(book_ids) > MAX_BASKET or len(others) + len(book_ids) < 2:
+        return
+    enqueue('count_copurchases', book_ids=sorted(book_ids), others=others)
+
+
+# This def returns the (book, recommended book) pairs of new purchases: each new book with each book purchased before
+# and with the other new books, in both directions
+def copurchase_pairs(book_ids, others):
+    pairs = {(book_id, other) for book_id in book_ids for other in others + list(book_ids) if other != book_id}
+    return pairs | {(other, book_id) for book_id, other in pairs}
+
+
+# This def adds one co-purchase to each given (book, recommended book) pair. The existing rows are incremented with an
+# "UPDATE ... SET score = score + 1", the missing pairs are inserted with a score of 1. A missing pair may have been
+# left out of the top-k by the last build, its score is then too low until the next build corrects it. The refunds
+# are not handled, the next build forgets them.
+def count_pairs(pairs):
+    with transaction.atomic():
+        rows = BookRecommendation.objects.filter(book_id__in={left for left, _ in pairs},
+                                                 recommended_id__in={right for _, right in pairs})
+        existing = {(left, right): pk for pk, left, right in rows.values_list('pk', 'book_id', 'recommended_id')
+                    if (left, right) in pairs}
+        BookRecommendation.objects.filter(pk__in=existing.values()).update(score=F('score') + 1)
+        BookRecommendation.objects.bulk_create([BookRecommendation(book_id=left, recommended_id=right, score=1)
+                                                for left, right in pairs - existing.keys()], ignore_conflicts=True)
+
+
+# This def keeps the RECOMMENDATIONS_PER_BOOK best rows of the given books, like the batch build, so the pairs inserted
+# between two builds do not grow the table without bound. Only the books with too many rows are read.
+def trim_recommendations(book_ids, k=RECOMMENDATIONS_PER_BOOK):
+    full = (BookRecommendation.objects.filter(book_id__in=book_ids).values_list('book_id').annotate(count=Count('id'))
+            .filter(count__gt=k).order_by())
+    for book_id, _ in full:
+        extra = list(BookRecommendation.objects.filter(book_id=book_id).order_by('-score', 'recommended_id')
+                     .values_list('pk', flat=True)[k:])
+        BookRecommendation.objects.filter(pk__in=extra).delete()
+
+
+# The rows of a book are read in the order of the (book, -score, recommended) index, the books are joined
+def book_recommendations_query(book_id, limit):
+    rows = BookRecommendation.objects.filter(book_id=book_id).select_related('recommended')
+    return rows.order_by('-score', 'recommended_id')[:limit]
+
+
+# This def returns the books most often purchased with the given book, with a single query on the index of the table
+def get_recommendations(book_id, limit=5):
+    return [row.recommended for row in book_recommendations_query(book_id, limit)]
+
+
+# The same def for the async views
+async def aget_recommendations(book_id, limit=5):
+    return [row.recommended async for row in book_recommendations_query(book_id, limit)]
+
+
+# The scores of a book recommended with several purchased books are added up. The books already purchased can not be
+# excluded in SQL (the purchases are read from the cache), more rows are read than needed and they are removed after.
+def user_recommendations_query(user_id, purchased, limit):
+    rows = (BookRecommendation.objects.filter(book_id__in=purchased.ids[-SHOP_SOURCES:])
+            .exclude(recommended__owner_id=user_id)
+            .values_list('recommended_id', 'recommended__title', 'recommended__author', 'recommended__price')
+            .annotate(total=Sum('score')).order_by('-total', 'recommended_id'))
+    return rows[:limit * 4]
+
+
+RECOMMENDATIONS_VERSION_KEY = 'recommendations-version'
+
+
+# The version of the table is changed by each batch build, so the cached recommendations of every user are outdated
+def get_recommendations_version():
+    version = cache.get(RECOMMENDATIONS_VERSION_KEY)
+    if version is None:
+        cache.add(RECOMMENDATIONS_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(RECOMMENDATIONS_VERSION_KEY)
+    return version
+
+
+def invalidate_recommendations():
+    transaction.on_commit(lambda: cache.set(RECOMMENDATIONS_VERSION_KEY, time.time_ns(), None))
+
+
+def summarize(rows, purchased, limit):
+    books = [{'id': book_id, 'title': title, 'author': author, 'price': price}
+             for book_id, title, author, price, total in rows if book_id not in purchased]
+    return books[:limit]
+
+
+def user_cache_key(user_id):
+    return 'recommended:%s:%s:%s' % (user_id, get_purchased_version(user_id), get_recommendations_version())
+
+
+# This def returns the books recommended to a user in the shop: the books purchased with the last books purchased by
+# the user, which the user neither purchased nor sells. They are cached until the purchases of the user change.
+def get_user_recommendations(user_id, purchased, limit=5):
+    if not len(purchased):
+        return []
+    key = user_cache_key(user_id)
+    books = cache.get(key)
+    if books is None:
+        books = summarize(user_recommendations_query(user_id, purchased, limit), purchased, limit)
+        cache.set(key, books, RECOMMENDATIONS_CACHE_TIMEOUT)
+    return books
+
+
+# The same def for the async views
+async def aget_user_recommendations(user_id, purchased, limit=5):
+    if not len(purchased):
+        return []
+    key = user_cache_key(user_id)
+    books = cache.get(key)
+    if books is None:
+        books = summarize([row async for row in user_recommendations_query(user_id, purchased, limit)], purchased,
+                          limit)
+        cache.set(key, books, RECOMMENDATIONS_CACHE_TIMEOUT)
+    return books
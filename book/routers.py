@@ -0,0 +1,94 @@
+import contextvars
+import random
+import time
+
+from django.conf import settings
+
+# The cookie that keeps the reads of a user on the primary database after a write, it holds the end of the window
+STICKY_COOKIE = 'primary_until'
+
+# The models read from a replica: the books and the search index. The other models read by the lists fill caches
+# (facets, purchases, wallets, recommendations) kept for a version: a replica that is late would store the old data
+# under the new version.
+REPLICA_MODELS = {'book.book', 'book.bookterm'}
+
+# The routing state of the current request, set by the ReplicaMiddleware. A context variable is used instead of a
+# thread local so the state follows the request in the async views.
+routing_state = contextvars.ContextVar('routing_state', default=None)
+
+
+class RoutingState:
+    def __init__(self, pinned):
+        # The reads stay on the primary database when the user wrote a few seconds ago
+        self.pinned = pinned
+        self.replica = None
+        self.wrote = False
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+# This router sends the reads of the book lists and of the search to a read replica, and everything else to the
+# default (primary) database:
+# - only the views with a read_replica attribute read from a replica, one replica per request so the pages of a list
+#   are read from the same copy of the data,
+# - only the books and the search index are read from the replica (REPLICA_MODELS), the sessions and the users are
+#   always read from the primary so a user who just logged in is never logged out by a replica that is late,
+# - every write goes to the primary, and the reads of a request that wrote too,
+# - after a write, the reads of the user stay on the primary for REPLICA_STICKY_SECONDS (see ReplicaMiddleware), so a
+#   buyer always sees the book they bought in their purchased books.
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if state is None or state.replica is None or state.pinned or state.wrote:
+            return None
+        if model._meta.label_lower not in REPLICA_MODELS:
+            return None
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    # A replica holds the same rows as the primary
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+# This middleware sets the routing state of each request: the replica read by the view when it reads from a replica,
+# and the sticky window of the user. A request that writes to the database starts (or extends) the window with a
+# cookie. Nothing changes when there is no replica.
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not get_replicas():
+            return self.get_response(request)
+        try:
+            pinned = float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        state = RoutingState(pinned)
+        token = routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        if state.wrote:
+            window = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+            response.set_cookie(STICKY_COOKIE, '%.3f' % (time.time() + window), max_age=window, httponly=True,
+                                samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = routing_state.get()
+        view_class = getattr(view_func, 'view_class', None)
+        if state is not None and getattr(view_class, 'read_replica', False):
+            state.replica = random.choice(get_replicas())
@@ -0,0 +1,150 @@
+import datetime
+import itertools
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Exists, F, FloatField, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .expressions import case
+from .models import Book, BookDailySales, Purchase, SellerDailySales, SellerSales
+from .versions import bump_sales_version
+
+
+# This def records sales made in the transaction of a purchase (buy_book, checkout). Each sale is a (book id, seller
+# id, price) tuple. The sale records are inserted with one bulk insert, and each rollup table (and the lifetime sales
+# of the sellers) is updated with two queries whatever the number of sales:
+# - the missing rows (of the day) are inserted with zero sales ("INSERT ... ON CONFLICT DO NOTHING"),
+# - every row is incremented with a single "UPDATE ... SET sales = sales + CASE ... END".
+# The rows are created before they are incremented, so two concurrent purchases never lose a sale. The purchase counts
+# of the books are incremented the same way, with one more update.
+def record_sales(buyer_id, sales, when=None):
+    when = when or timezone.now()
+    day = timezone.localdate(when)
+    Purchase.objects.bulk_create([Purchase(book_id=book_id, buyer_id=buyer_id, seller_id=seller_id, price=price,
+                                           purchased_at=when) for book_id, seller_id, price in sales])
+    by_seller, by_book, sellers = defaultdict(lambda: [0, 0.0]), defaultdict(lambda: [0, 0.0]), {}
+    for book_id, seller_id, price in sales:
+        sellers[book_id] = seller_id
+        for totals in (by_seller[seller_id], by_book[book_id]):
+            totals[0] += 1
+            totals[1] += price
+    add_to_rollup(SellerDailySales, 'seller_id', by_seller,
+                  [SellerDailySales(seller_id=seller_id, day=day) for seller_id in by_seller], day=day)
+    add_to_rollup(BookDailySales, 'book_id', by_book,
+                  [BookDailySales(book_id=book_id, seller_id=sellers[book_id], day=day) for book_id in by_book],
+                  day=day)
+    add_to_rollup(SellerSales, 'seller_id', by_seller, [SellerSales(seller_id=seller_id) for seller_id in by_seller])
+    purchases = case('id', {book_id: count for book_id, (count, _) in by_book.items()}, IntegerField())
+    Book.objects.filter(pk__in=list(by_book)).update(purchase_count=F('purchase_count') + purchases)
+    bump_sales_version()
+
+
+def add_to_rollup(model, key, totals, rows, **lookups):
+    model.objects.bulk_create(rows, ignore_conflicts=True)
+    column = model._meta.get_field(key).column
+    sales = case(column, {value: count for value, (count, _) in totals.items()}, IntegerField())
+    revenue = case(column, {value: amount for value, (_, amount) in totals.items()}, FloatField())
+    model.objects.filter(**{key + '__in': list(totals)}, **lookups).update(sales=F('sales') + sales,
+                                                                            revenue=F('revenue') + revenue)
+
+
+# This def returns the analytics of a seller over the last given days, read from the rollups only: the sales and the
+# revenue of each day (the days without sales included), the totals, the books sorted by revenue, and the lifetime
+# sales of the seller.
+def seller_analytics(seller_id, days=30, limit=20):
+    until = timezone.localdate()
+    since = until - datetime.timedelta(days=days - 1)
+    rows = SellerDailySales.objects.filter(seller_id=seller_id, day__gte=since).values_list('day', 'sales', 'revenue')
+    daily = {day: (sales, revenue) for day, sales, revenue in rows}
+    per_day = [(day, *daily.get(day, (0, 0.0))) for day in (since + datetime.timedelta(days=n) for n in range(days))]
+    books = (BookDailySales.objects.filter(seller_id=seller_id, day__gte=since)
+             .values_list('book_id', 'book__title').annotate(sales=Sum('sales'), revenue=Sum('revenue'))
+             .order_by('-revenue', '-sales', 'book_id')[:limit])
+    lifetime = SellerSales.objects.filter(seller_id=seller_id).values_list('sales', 'revenue').first() or (0, 0.0)
+    return {
+        'since': since,
+        'until': until,
+        'per_day': [(day, sales, round(revenue, 2)) for day, sales, revenue in per_day],
+        'sales': sum(sales for sales, _ in daily.values()),
+        'revenue': round(sum(revenue for _, revenue in daily.values()), 2),
+        'books': [(book_id, title, sales, round(revenue, 2)) for book_id, title, sales, revenue in books],
+        'lifetime_sales': lifetime[0],
+        'lifetime_revenue': round(lifetime[1], 2),
+    }
+
+
+# This def creates the sale records of the purchases made before they were recorded (the rows of the purchasers table
+# without a sale). The price and the time of these sales are unknown: the current price of the book is used, and the
+# publication date of the book as the time of the sale. It returns the number of sales created.
+def backfill_purchases(batch_size=5000):
+    through = Book.purchasers.through
+    missing = (through.objects.filter(~Exists(Purchase.objects.filter(book_id=OuterRef('book_id'),
+                                                                      buyer_id=OuterRef('user_id'))))
+               .values_list('id', 'book_id', 'user_id', 'book__owner_id', 'book__price', 'book__publication_date'))
+    last_id, count = 0, 0
+    # The purchasers are read in batches of ids, so the memory used does not depend on the number of purchases
+    while rows := list(missing.filter(id__gt=last_id).order_by('id')[:batch_size]):
+        with transaction.atomic():
+            Purchase.objects.bulk_create([
+                Purchase(book_id=book_id, buyer_id=buyer_id, seller_id=seller_id, price=price, purchased_at=date)
+                for _, book_id, buyer_id, seller_id, price, date in rows])
+        last_id, count = rows[-1][0], count + len(rows)
+    return count
+
+
+# This def rebuilds both rollup tables from the sale records, in one transaction, with one GROUP BY query per table.
+# It returns the number of rows of each table.
+def rebuild_rollups(batch_size=5000):
+    day = TruncDate('purchased_at')
+    by_seller = (Purchase.objects.annotate(day=day).values_list('seller_id', 'day')
+                 .annotate(sales=Count('id'), revenue=Sum('price')).order_by())
+    by_book = (Purchase.objects.filter(book__isnull=False).annotate(day=day).values_list('book_id', 'seller_id', 'day')
+               .annotate(sales=Count('id'), revenue=Sum('price')).order_by())
+    with transaction.atomic():
+        SellerDailySales.objects.all().delete()
+        BookDailySales.objects.all().delete()
+        sellers = insert_batches(SellerDailySales, ('seller_id', 'day', 'sales', 'revenue'), by_seller, batch_size)
+        books = insert_batches(BookDailySales, ('book_id', 'seller_id', 'day', 'sales', 'revenue'), by_book,
+                               batch_size)
+    return sellers, books
+
+
+def insert_batches(model, fields, rows, batch_size):
+    rows = rows.iterator(chunk_size=batch_size)
+    count = 0
+    while batch := list(itertools.islice(rows, batch_size)):
+        model.objects.bulk_create([model(**dict(zip(fields, row))) for row in batch])
+        count += len(batch)
+    return count
+
+
+# The number of purchasers of each book, read from the purchasers table
+def actual_purchase_count():
+    purchasers = (Book.purchasers.through.objects.filter(book_id=OuterRef('pk')).order_by()
+                  .values('book_id').annotate(count=Count('id')).values('count'))
+    return Coalesce(Subquery(purchasers), 0)
+
+
+# This def returns the ids of the books whose purchase count is not their number of purchasers (purchases inserted
+# without buy_book or checkout, purchasers removed, a count changed by hand...), with the stored and the actual count.
+def drifted_purchase_counts():
+    books = Book.objects.annotate(actual=actual_purchase_count()).exclude(purchase_count=F('actual'))
+    return list(books.order_by('id').values_list('id', 'purchase_count', 'actual'))
+
+
+# This def sets the purchase count of the given books to their number of purchasers. The count is read in the update
+# itself, so a purchase made meanwhile is not lost.
+def repair_purchase_counts(book_ids, batch_size=5000):
+    book_ids = list(book_ids)
+    for offset in range(0, len(book_ids), batch_size):
+        Book.objects.filter(pk__in=book_ids[offset:offset + batch_size]).update(purchase_count=actual_purchase_count())
+    if book_ids:
+        bump_sales_version()
+
+
+# The lifetime sales of each seller, read from the sale records
+def actual_seller_sales():
+    rows = Purchase.objects.values_list('seller_id').annotate(sales=Count('id'), revenue=Sum('price')).order_by()
+    return {seller_id: (sales, revenue) for seller_id, sales, revenue in rows}
@@ -0,0 +1,173 @@
+import math
+import re
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F, IntegerField
+
+from .expressions import case
+from .models import Book, BookTerm, BookTermCount
+
+# The weight of a term depends on the field where it has been found: a match in the title is worth more than a match
+# in the description.
+FIELD_WEIGHTS = {'title': 3, 'author': 2, 'description': 1}
+
+# These words are found in almost every book, they would make huge posting lists without helping the ranking.
+STOP_WORDS = frozenset("""
+a an and are as at be but by for from has have he her his i in is it its of on or she that the their this to was
+were will with you your
+""".split())
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_TERM_LENGTH = BookTerm._meta.get_field('term').max_length
+
+
+# This def splits a text in normalized terms. The same def is used to index books and to read the search queries, so
+# both of them always agree on what a term is.
+def tokenize(text):
+    terms = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if len(token) > 1 and token not in STOP_WORDS:
+            terms.append(token[:MAX_TERM_LENGTH])
+    return terms
+
+
+# This def returns the weighted terms of a book, ready to be saved as postings.
+def book_terms(book):
+    weights = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in tokenize(str(getattr(book, field))):
+            weights[term] += weight
+    return weights
+
+
+# This def adds the given numbers of books (negative to remove books) to the counts of the terms. Like the sales
+# rollups, the missing terms are inserted with a zero count ("INSERT ... ON CONFLICT DO NOTHING"), then the counts are
+# changed with a single "UPDATE ... SET count = count + CASE term WHEN ... END" per batch of terms, so concurrent
+# changes are never lost.
+def change_term_counts(deltas, batch_size=500):
+    deltas = [(term, delta) for term, delta in deltas.items() if delta]
+    for start in range(0, len(deltas), batch_size):
+        batch = dict(deltas[start:start + batch_size])
+        BookTermCount.objects.bulk_create([BookTermCount(term=term) for term in batch], ignore_conflicts=True)
+        BookTermCount.objects.filter(term__in=list(batch)).update(
+            count=F('count') + case('term', batch, IntegerField()))
+
+
+# This def removes the given books from the counts of their terms, before their postings are deleted
+def uncount_books(book_ids):
+    terms = Counter(BookTerm.objects.filter(book_id__in=book_ids).values_list('term', flat=True))
+    change_term_counts({term: -count for term, count in terms.items()})
+
+
+# This def will replace the postings of a single book. It is called each time a book is created or edited, so the
+# index is always updated incrementally instead of being rebuilt. The counts of the terms only change for the terms
+# added to or removed from the book.
+def index_book(book):
+    weights = book_terms(book)
+    with transaction.atomic():
+        postings = BookTerm.objects.filter(book_id=book.id)
+        old = set(postings.values_list('term', flat=True))
+        postings.delete()
+        BookTerm.objects.bulk_create([BookTerm(term=term, book_id=book.id, weight=weight)
+                                      for term, weight in weights.items()])
+        change_term_counts({**{term: -1 for term in old - weights.keys()},
+                            **{term: 1 for term in weights.keys() - old}})
+
+
+# This def replaces the postings of many books at once, for example after a bulk_update.
+def reindex_books(books):
+    books = list(books)
+    with transaction.atomic():
+        uncount_books([book.id for book in books])
+        BookTerm.objects.filter(book_id__in=[book.id for book in books]).delete()
+        index_books(books)
+
+
+# This def rebuilds the postings of many books at once. It is used for books inserted without the save signals, for
+# example with bulk_create. The books must not have postings yet.
+def index_books(books, batch_size=1000):
+    postings, counts = [], Counter()
+    with transaction.atomic():
+        for book in books:
+            weights = book_terms(book)
+            counts.update(weights.keys())
+            postings += [BookTerm(term=term, book_id=book.id, weight=weight) for term, weight in weights.items()]
+            if len(postings) >= batch_size:
+                BookTerm.objects.bulk_create(postings)
+                postings = []
+        BookTerm.objects.bulk_create(postings)
+        change_term_counts(counts)
+
+
+# A posting list longer than this is considered as a common term. Common terms are never read entirely: only their
+# MAX_POSTINGS heaviest postings are read, in the order of the (term, weight, book) index.
+MAX_POSTINGS = 2000
+MAX_QUERY_TERMS = 10
+
+
+# This def ranks the books matching a query. The score of a book is the sum, for each term of the query, of the weight
+# of the term in the book multiplied by the inverse document frequency of the term (rare terms matter more), computed
+# from the number of books of the term (BookTermCount).
+# The cost of a query is bounded whatever the size of the catalog: each term reads at most MAX_POSTINGS rows of the
+# (term, weight, book) index, the scores are merged in memory and the filters of the 'books' queryset are applied to the
+# best candidates with primary key lookups. When a common term was cut and the filters leave less than 'limit' books,
+# the search is driven from the filtered books instead: if the filters keep at most MAX_POSTINGS books, their ids are
+# read on the indexes of the filters, and their postings of the query terms are read on the (term, book) index. A
+# filtered search on a common term still finds the matching books outside of its heaviest postings, and never reads
+# more than MAX_POSTINGS books and postings per term. When the filters keep more books, only the heaviest postings
+# are used.
+# The ranking is exact for rare terms; for common terms, a book outside of their heaviest postings does not get their
+# contribution. The books are returned ordered by score with a 'score' attribute.
+def search_books(query, books=None, limit=100):
+    terms = sorted(set(tokenize(query)))[:MAX_QUERY_TERMS]
+    if books is None:
+        books = Book.objects.all()
+    postings = read_postings(terms, BookTerm.objects.all())
+    if not any(postings.values()):
+        return []
+    # The highest id is used as the size of the catalog. It is only an estimation, but it can be read from the primary
+    # key index while a COUNT(*) would scan the whole table.
+    total = Book.objects.order_by('-id').values_list('id', flat=True).first() or 1
+    counts = dict(BookTermCount.objects.filter(term__in=[term for term, rows in postings.items() if rows])
+                  .values_list('term', 'count'))
+    results = rank_books(postings, counts, total, books, limit)
+    cut = any(len(rows) == MAX_POSTINGS for rows in postings.values())
+    if len(results) < limit and cut and books.query.has_filters():
+        book_ids = list(books.order_by().values_list('id', flat=True)[:MAX_POSTINGS + 1])
+        if len(book_ids) <= MAX_POSTINGS:
+            candidates = BookTerm.objects.filter(book_id__in=book_ids)
+            results = rank_books(read_postings(terms, candidates), counts, total, books, limit)
+    return results
+
+
+# This def reads the heaviest (book id, weight) postings of each term among the given postings
+def read_postings(terms, candidates):
+    return {term: list(candidates.filter(term=term).order_by('-weight', '-book_id')
+                       .values_list('book_id', 'weight')[:MAX_POSTINGS]) for term in terms}
+
+
+# This def scores the books of the postings, and returns the best ones among the given books
+def rank_books(postings, counts, total, books, limit):
+    scores = Counter()
+    for term, rows in postings.items():
+        if rows:
+            # The count can only be lower than the postings read when the counts have not been built yet
+            idf = math.log(1 + total / max(counts.get(term, 0), len(rows)))
+            for book_id, weight in rows:
+                scores[book_id] += weight * idf
+
+    ranked = sorted(scores, key=lambda book_id: (-scores[book_id], book_id))
+    results = []
+    chunk = max(limit * 2, 100)
+    for offset in range(0, len(ranked), chunk):
+        ids = ranked[offset:offset + chunk]
+        found = books.in_bulk(ids)
+        for book_id in ids:
+            if book_id in found:
+                book = found[book_id]
+                book.score = scores[book_id]
+                results.append(book)
+                if len(results) == limit:
+                    return results
+    return results
@@ -0,0 +1,101 @@
+from collections import Counter
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .facets import change_facets, facet_key
+from .fragments import bump_version
+from .models import Book
+from .purchase import book_purchased
+from .purchased import invalidate_purchased_books
+from .recommendations import add_purchases
+from .search import index_book, uncount_books
+from .versions import bump_catalog_version
+
+
+# Each time a book is created or edited (CreateBookForm.create_book, EditBookForm.update_book, the admin...), its
+# postings in the search index are replaced. Deleted books lose their postings through the cascade of the foreign key,
+# their terms are counted out before.
+@receiver(post_save, sender=Book)
+def update_search_index(sender, instance, **kwargs):
+    index_book(instance)
+
+
+@receiver(pre_delete, sender=Book)
+def remove_from_search_index(sender, instance, **kwargs):
+    uncount_books([instance.pk])
+
+
+# Each time a book is saved or deleted, the cached html of its cards and the version of the catalog are outdated.
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def update_book_version(sender, instance, **kwargs):
+    bump_version(instance.pk)
+    bump_catalog_version()
+
+
+# Each time purchasers are added to or removed from a book, or books to or from a user, the cached purchases of the
+# users concerned are invalidated. A cleared relation does not give the removed users, they are read before the clear.
+@receiver(m2m_changed, sender=Book.purchasers.through)
+def update_purchased_books(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_purchased_books(instance.pk)
+    elif action in ('post_add', 'post_remove'):
+        invalidate_purchased_books(*pk_set)
+    elif action == 'pre_clear':
+        invalidate_purchased_books(*instance.purchasers.values_list('id', flat=True))
+
+
+# The purchases made by buy_book and checkout are not made with purchasers.add, they send book_purchased instead
+@receiver(book_purchased)
+def forget_purchased_books(sender, user_id, **kwargs):
+    invalidate_purchased_books(user_id)
+
+
+# A deleted book is removed from the purchases of its purchasers by the cascade, without any m2m_changed signal, so
+# their cached purchases are invalidated here. Otherwise a new book reusing the id would look already bought.
+@receiver(pre_delete, sender=Book)
+def forget_deleted_book(sender, instance, **kwargs):
+    invalidate_purchased_books(*instance.purchasers.values_list('id', flat=True))
+
+
+# The facet counts follow the books. The facet of an edited book (EditBookForm.update_book can change its gender and
+# its price) is read from the database before the save, and the book is moved from the old facet to the new one.
+@receiver(pre_save, sender=Book)
+def read_old_facet(sender, instance, **kwargs):
+    instance._old_facet = None
+    if not instance._state.adding:
+        old = Book.objects.filter(pk=instance.pk).values_list('gender', 'price').first()
+        instance._old_facet = facet_key(*old) if old else None
+
+
+@receiver(post_save, sender=Book)
+def update_facets(sender, instance, **kwargs):
+    deltas = Counter({facet_key(instance.gender, instance.price): 1})
+    if instance._old_facet is not None:
+        deltas[instance._old_facet] -= 1
+    change_facets(deltas)
+
+
+@receiver(post_delete, sender=Book)
+def remove_from_facets(sender, instance, **kwargs):
+    change_facets({facet_key(instance.gender, instance.price): -1})
+
+
+# Each purchase (buy_book and checkout, purchasers.add from either side) is added to the co-purchase recommendations,
+# once it is committed.
+@receiver(m2m_changed, sender=Book.purchasers.through)
+def update_recommendations(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        add_purchases(instance.pk, pk_set)
+    else:
+        for user_id in pk_set:
+            add_purchases(user_id, [instance.pk])
+
+
+@receiver(book_purchased)
+def add_purchase_recommendations(sender, user_id, book_ids, **kwargs):
+    add_purchases(user_id, book_ids)
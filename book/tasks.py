@@ -0,0 +1,44 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMultiAlternatives
+from django.template import loader
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from .jobs import task
+from .recommendations import copurchase_pairs, count_pairs, trim_recommendations
+
+
+# The emails are rendered by the request and sent by the worker, the response does not wait for the email backend
+@task('send_email')
+def send_email(subject, body, to, from_email=None, html_body=None):
+    message = EmailMultiAlternatives(subject, body, from_email, to)
+    if html_body:
+        message.attach_alternative(html_body, 'text/html')
+    message.send()
+
+
+# The password reset email is made by the worker, with the context of PasswordResetForm.save: the token is made when
+# the email is sent, it is never stored in the queue. A user who can no longer reset their password gets no email.
+@task('send_password_reset')
+def send_password_reset(user_id, domain, site_name, protocol, subject_template_name, email_template_name,
+                        html_email_template_name=None, from_email=None):
+    user = User.objects.filter(pk=user_id, is_active=True).first()
+    email = getattr(user, User.get_email_field_name(), None)
+    if user is None or not email or not user.has_usable_password():
+        return
+    context = {'email': email, 'domain': domain, 'site_name': site_name, 'protocol': protocol, 'user': user,
+               'uid': urlsafe_base64_encode(force_bytes(user.pk)), 'token': default_token_generator.make_token(user)}
+    subject = ''.join(loader.render_to_string(subject_template_name, context).splitlines())
+    body = loader.render_to_string(email_template_name, context)
+    html_body = loader.render_to_string(html_email_template_name, context) if html_email_template_name else None
+    send_email(subject, body, [email], from_email, html_body)
+
+
+# The co-purchases of new purchases are added to the recommendations (see add_purchases), then the books that went past
+# their number of recommendations are trimmed
+@task('count_copurchases')
+def count_copurchases(book_ids, others):
+    pairs = copurchase_pairs(book_ids, others)
+    count_pairs(pairs)
+    trim_recommendations({left for left, _ in pairs})
@@ -0,0 +1,15 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html_join
+
+from book.assets import bundle_fonts
+
+register = template.Library()
+
+
+# This tag preloads the fonts of a bundle, so the browser downloads them with the stylesheet instead of after it
+# Example: {% preload_fonts 'book/bundles/shop.css' %}
+@register.simple_tag
+def preload_fonts(bundle):
+    return format_html_join('\n', '<link rel="preload" href="{}" as="font" type="font/woff2" crossorigin>',
+                            ((static(path),) for path in bundle_fonts(bundle)))
@@ -1,11 +1,56 @@
-from django.test import TestCase
+import datetime
+import gzip
+import io
+import itertools
+import json
+import os
+import pickle
+import re
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Count, F, Sum
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from django.urls import reverse, reverse_lazy
+from django.urls import reverse
+
+from django.contrib.auth.models import AnonymousUser, User
 
-from django.contrib.auth.models import User
+from accounts import urls as accounts_urls
 
-from .models import Book, Wallet
-from .forms import CreateBookForm
+from . import urls as book_urls, views
+from .facets import count_catalog
+from .jobs import TASKS, claim_jobs, clean_jobs, enqueue, job_metrics, run_due_jobs, task
+from .models import (Book, BookDailySales, BookFacet, BookRecommendation, BookTerm, BookTermCount, Job, Purchase,
+                     SellerDailySales, SellerSales, Wallet, WalletCredit)
+from .identity import IdentityMap, get_request_book
+from .forms import CreateBookForm, EditBookForm, ShopFilterForm
+from .export import export_lines, export_queryset
+from .pagination import KeysetPaginator
+from .assets import BUNDLES, FONTS, BundleFinder, minify_css
+from .cart import CART_MAX_BOOKS, add_to_cart
+from .purchase import PurchaseResult, buy_book, checkout
+from .purchased import PurchasedBooks, get_purchased_books
+from .copurchases import co_purchases, np
+from .recommendations import get_recommendations, trim_recommendations
+from .routers import STICKY_COOKIE, ReplicaRouter, RoutingState, routing_state
+from .sales import record_sales, seller_analytics
+from .throttling import ThrottleMiddleware, take_tokens
+from .search import index_books, reindex_books, search_books
+from .timing import TimingMiddleware
+from .views import filter_shop, shop_books
+from .wallets import compact_wallets, credit_wallets, debit_wallet, get_wallet
 
 
 # This class contains a set of tests that will interact directly with the database
@@ -130,4 +175,2039 @@ class TestViewsLogged(TestCase):
 
         # user = User.objects.get(username="User1")
         # book = form.create_book(user)
-        # self.assertNotEqual(book, None)
\ No newline at end of file
+        # self.assertNotEqual(book, None)
+
+# This class contains a set of tests that will verify that the shop is built with a constant number of queries,
+# whatever the size of the catalog is.
+class TestShopQueries(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="Buyer")
+        self.user.set_password("test123")
+        self.user.save()
+        self.seller = User.objects.create(username="Seller")
+        Wallet.objects.create(balance=10.0, owner=self.user)
+        Wallet.objects.create(balance=10.0, owner=self.seller)
+        self.client.login(username="Buyer", password="test123")
+
+    def create_books(self, owner, count):
+        books = [Book(title="Book%d" % i, author="Bot", publication_date=timezone.now(), description="A book",
+                      gender="Cool", price=1.0, num_pages=10, owner=owner) for i in range(count)]
+        return Book.objects.bulk_create(books)
+
+    def test_shop_purchased_flags(self):
+        bought, not_bought = self.create_books(self.seller, 2)
+        own = self.create_books(self.user, 1)[0]
+        bought.purchasers.add(self.user)
+        response = self.client.get(reverse('book:shop'))
+        flags = {book.id: book.purchased for book in response.context['books']}
+        self.assertEqual(flags, {bought.id: True, not_bought.id: False})
+        self.assertNotIn(own.id, flags)
+        self.assertContains(response, "Already bought", count=1)
+
+    def test_shop_constant_query_count(self):
+        self.create_books(self.seller, 2)
+        cache.clear()
+        # session, user, books, wallet, purchased books and facets
+        with self.assertNumQueries(6):
+            self.client.get(reverse('book:shop'))
+        for book in self.create_books(self.seller, 50):
+            book.purchasers.add(self.user)
+        cache.clear()
+        # and the recommendations of a user who purchased books
+        with self.assertNumQueries(7):
+            self.client.get(reverse('book:shop'))
+
+
+# This class contains a set of tests that will verify the keyset pagination of the listing views
+class TestKeysetPagination(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="Buyer")
+        self.user.set_password("test123")
+        self.user.save()
+        self.seller = User.objects.create(username="Seller")
+        Wallet.objects.create(balance=10.0, owner=self.user)
+        self.client.login(username="Buyer", password="test123")
+        now = timezone.now()
+        # Half of the books share the same publication date to make sure the id is used to break the ties
+        Book.objects.bulk_create([Book(title="Book%d" % i, author="Bot", description="A book", gender="Cool",
+                                       publication_date=now + timezone.timedelta(seconds=i // 2), price=1.0,
+                                       num_pages=10, owner=self.seller) for i in range(45)])
+
+    def browse(self, url, cursor=None):
+        response = self.client.get(url, {'cursor': cursor} if cursor else {})
+        return response, [book.title for book in response.context['books']]
+
+    def test_pages_cover_the_whole_shop(self):
+        url = reverse('book:shop')
+        seen = []
+        response, titles = self.browse(url)
+        self.assertFalse(response.context['page_obj'].has_previous())
+        while True:
+            seen += titles
+            page = response.context['page_obj']
+            if not page.has_next():
+                break
+            response, titles = self.browse(url, page.next_cursor)
+        self.assertEqual(seen, ["Book%d" % i for i in range(45)])
+
+    def test_previous_page(self):
+        url = reverse('book:shop')
+        first, first_titles = self.browse(url)
+        second, _ = self.browse(url, first.context['page_obj'].next_cursor)
+        previous, previous_titles = self.browse(url, second.context['page_obj'].previous_cursor)
+        self.assertEqual(previous_titles, first_titles)
+        self.assertFalse(previous.context['page_obj'].has_previous())
+        self.assertContains(second, 'PREVIOUS')
+        self.assertContains(second, 'NEXT')
+
+    def test_cursor_is_stable_when_books_change(self):
+        url = reverse('book:shop')
+        first, _ = self.browse(url)
+        Book.objects.filter(title__in=["Book0", "Book25"]).delete()
+        Book.objects.create(title="Early", author="Bot", description="A book", gender="Cool", price=1.0,
+                            publication_date=timezone.now() - timezone.timedelta(days=1), num_pages=10,
+                            owner=self.seller)
+        _, titles = self.browse(url, first.context['page_obj'].next_cursor)
+        self.assertEqual(titles, ["Book%d" % i for i in range(20, 41) if i != 25])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('book:shop'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_deep_page_query_count(self):
+        url = reverse('book:shop')
+        response, _ = self.browse(url)
+        response, _ = self.browse(url, response.context['page_obj'].next_cursor)
+        # session, user and books, the wallet and the purchased books are already cached
+        with self.assertNumQueries(3):
+            self.browse(url, response.context['page_obj'].next_cursor)
+
+    def test_owned_books_pagination(self):
+        self.client.logout()
+        self.seller.set_password("test123")
+        self.seller.save()
+        self.client.login(username="Seller", password="test123")
+        response = self.client.get(reverse('book:ownedBooks'))
+        self.assertEqual(len(response.context['library']), 20)
+        self.assertTrue(response.context['page_obj'].has_next())
+
+
+# This class contains a set of tests that will verify the search engine and its inverted index
+class TestSearch(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="Seller")
+        self.dragon = CreateBookForm(data={"title": "The Dragon King", "author": "Martin", "gender": "Fantasy",
+                                           "description": "A story about a kingdom", "num_pages": 300,
+                                           "price": 12.0}).create_book(self.user)
+        self.kingdom = CreateBookForm(data={"title": "Kingdom of Ash", "author": "Dragon Lee", "gender": "Fantasy",
+                                            "description": "Ashes everywhere", "num_pages": 200,
+                                            "price": 30.0}).create_book(self.user)
+        self.cooking = CreateBookForm(data={"title": "Cooking", "author": "Chef", "gender": "Food",
+                                            "description": "Recipes with dragon fruit", "num_pages": 100,
+                                            "price": 5.0}).create_book(self.user)
+
+    def test_ranking(self):
+        results = search_books("dragon")
+        self.assertEqual(results, [self.dragon, self.kingdom, self.cooking])
+        self.assertGreater(results[0].score, results[1].score)
+
+    def test_filters(self):
+        self.assertEqual(search_books("dragon", Book.objects.filter(gender="Food")), [self.cooking])
+        self.assertEqual(search_books("dragon", Book.objects.filter(price__gte=10, price__lte=20)), [self.dragon])
+        self.assertEqual(search_books("the of"), [])
+
+    def test_edit_updates_index(self):
+        EditBookForm(data={"title": "Dune", "author": "Herbert", "gender": "SF", "description": "Sand",
+                           "num_pages": 10, "price": 1.0}).update_book(self.dragon)
+        self.assertEqual(search_books("dune"), [self.dragon])
+        self.assertNotIn(self.dragon, search_books("dragon"))
+
+    def test_delete_removes_postings(self):
+        self.user.set_password("test123")
+        self.user.save()
+        self.client.login(username="Seller", password="test123")
+        self.client.post(reverse('book:delete', args=(self.cooking.id,)), {'delete': 'YES'})
+        self.assertFalse(BookTerm.objects.filter(book_id=self.cooking.id).exists())
+        self.assertEqual(search_books("dragon"), [self.dragon, self.kingdom])
+        self.assertEqual(self.term_counts(), self.actual_term_counts())
+
+    def term_counts(self):
+        return dict(BookTermCount.objects.exclude(count=0).values_list('term', 'count'))
+
+    def actual_term_counts(self):
+        return dict(BookTerm.objects.values_list('term').annotate(count=Count('id')).order_by())
+
+    # The counts of the terms follow the creations, the edits, the deletions and the reindexing of the books
+    def test_term_counts(self):
+        self.assertEqual(self.term_counts()['dragon'], 3)
+        self.assertEqual(self.term_counts(), self.actual_term_counts())
+        EditBookForm(data={"title": "Dune", "author": "Herbert", "gender": "SF", "description": "Sand",
+                           "num_pages": 10, "price": 1.0}).update_book(self.dragon)
+        self.assertEqual(self.term_counts()['dragon'], 2)
+        self.assertEqual(self.term_counts(), self.actual_term_counts())
+        Book.objects.filter(pk=self.kingdom.pk).update(title="Dune")
+        reindex_books(Book.objects.filter(pk=self.kingdom.pk))
+        self.assertEqual(self.term_counts(), self.actual_term_counts())
+        Book.objects.filter(pk=self.cooking.pk).delete()
+        self.assertEqual(self.term_counts(), self.actual_term_counts())
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(self.term_counts(), self.actual_term_counts())
+
+    # Only the heaviest postings of a common term are read, among the books kept by the filters
+    def test_filtered_common_term(self):
+        Book.objects.bulk_create([Book(title="Dragon %d" % i, author="Bot", description="Dragon", gender="Fantasy",
+                                       price=50.0, num_pages=1, owner=self.user, publication_date=timezone.now())
+                                  for i in range(10)])
+        index_books(Book.objects.filter(title__startswith="Dragon "))
+        with unittest.mock.patch('book.search.MAX_POSTINGS', 5):
+            self.assertEqual(search_books("dragon", Book.objects.filter(gender="Food")), [self.cooking])
+            self.assertEqual(search_books("dragon", Book.objects.filter(gender="Fantasy", price__lt=40)),
+                             [self.dragon, self.kingdom])
+            self.assertEqual(len(search_books("dragon")), 5)
+            # The filters keep more than MAX_POSTINGS books: the postings are not read again
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(len(search_books("dragon", Book.objects.filter(gender="Fantasy"))), 5)
+            self.assertEqual(sum('"book_bookterm"' in query['sql'] for query in queries.captured_queries), 1)
+
+    # The frequency of a term is the number of books of the term, not the number of postings read
+    def test_idf_uses_term_counts(self):
+        with unittest.mock.patch('book.search.MAX_POSTINGS', 1):
+            score = search_books("dragon")[0].score
+        self.assertEqual(search_books("dragon")[0].score, score)
+
+    def test_search_view(self):
+        response = self.client.get(reverse('book:search'), {'q': 'kingdom', 'gender': 'fantasy', 'max_price': 20})
+        self.assertTemplateUsed(response, 'book/search.html')
+        self.assertEqual(list(response.context['books']), [self.dragon])
+
+
+# This class contains a set of tests that will verify every outcome of the purchase service
+class TestPurchase(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create(username="Buyer")
+        self.seller = User.objects.create(username="Seller")
+        Wallet.objects.create(balance=10.0, owner=self.buyer)
+        Wallet.objects.create(balance=5.0, owner=self.seller)
+        self.book = Book.objects.create(title="BookOne", author="Bot1", publication_date=timezone.now(),
+                                        description="A book", gender="Cool", price=7.5, num_pages=500,
+                                        owner=self.seller)
+
+    # The credits of the sellers are added to their wallets first
+    def balances(self):
+        compact_wallets()
+        return (Wallet.objects.get(owner=self.buyer).balance, Wallet.objects.get(owner=self.seller).balance)
+
+    def test_success(self):
+        self.assertEqual(buy_book(self.buyer, self.book.id), PurchaseResult.SUCCESS)
+        self.assertEqual(self.balances(), (2.5, 12.5))
+        self.assertIn(self.buyer, self.book.purchasers.all())
+
+    def test_already_owned(self):
+        buy_book(self.buyer, self.book.id)
+        self.assertEqual(buy_book(self.buyer, self.book.id), PurchaseResult.ALREADY_OWNED)
+        self.assertEqual(self.balances(), (2.5, 12.5))
+
+    def test_insufficient_funds(self):
+        self.assertEqual(buy_book(self.seller, Book.objects.create(
+            title="Expensive", author="Bot", publication_date=timezone.now(), description="A book", gender="Cool",
+            price=50, num_pages=1, owner=self.buyer).id), PurchaseResult.INSUFFICIENT_FUNDS)
+        self.assertEqual(self.balances(), (10.0, 5.0))
+        self.assertFalse(Book.objects.get(title="Expensive").purchasers.exists())
+
+    def test_own_book(self):
+        self.assertEqual(buy_book(self.seller, self.book.id), PurchaseResult.OWN_BOOK)
+        self.assertEqual(buy_book(self.seller, 0), PurchaseResult.NOT_FOUND)
+
+    # The integrity errors are told apart once the purchase is rolled back
+    def test_integrity_errors(self):
+        # The book was deleted by its owner while it was bought. SQLite only checks the foreign keys when the test
+        # transaction commits, the error of the purchaser insert is raised by the mock.
+        book = Book.objects.get(pk=self.book.id)
+        Book.objects.filter(pk=self.book.id).delete()
+        with unittest.mock.patch('book.purchase.record_sales', side_effect=IntegrityError('FOREIGN KEY')):
+            self.assertEqual(buy_book(self.buyer, book.id, book=book), PurchaseResult.NOT_FOUND)
+        self.assertEqual(self.balances(), (10.0, 5.0))
+        # Any other error is not hidden
+        book = Book.objects.create(title="Other", author="Bot", publication_date=timezone.now(), description="A book",
+                                   gender="Cool", price=1.0, num_pages=1, owner=self.seller)
+        with unittest.mock.patch('book.purchase.record_sales', side_effect=IntegrityError('rollup')):
+            with self.assertRaises(IntegrityError):
+                buy_book(self.buyer, book.id)
+            with self.assertRaises(IntegrityError):
+                checkout(self.buyer, [book.id])
+        self.assertEqual(self.balances(), (10.0, 5.0))
+
+    def test_purchase_queries(self):
+        # book, savepoint, purchaser insert, debit, credit of the seller (two queries), sale record, seller and book
+        # rollups and lifetime sales of the seller (two queries each), purchase count, previous purchases
+        # (recommendations) and savepoint release
+        cache.clear()
+        with self.assertNumQueries(16):
+            buy_book(self.buyer, self.book.id)
+        # The previous purchases are not read when the purchases of the buyer are cached
+        book = Book.objects.create(title="BookTwo", author="Bot2", publication_date=timezone.now(),
+                                   description="A book", gender="Cool", price=1.0, num_pages=5, owner=self.buyer)
+        get_purchased_books(self.seller.id)
+        with self.assertNumQueries(15):
+            buy_book(self.seller, book.id)
+
+    def test_buy_view_errors(self):
+        self.buyer.set_password("test123")
+        self.buyer.save()
+        self.client.login(username="Buyer", password="test123")
+        url = reverse('book:buyBook', args=(self.book.id,))
+        Wallet.objects.filter(owner=self.buyer).update(balance=1.0)
+        response = self.client.post(url, {'yes': 'YES'})
+        self.assertContains(response, "You do not have enough money in your wallet.", status_code=409)
+        Wallet.objects.filter(owner=self.buyer).update(balance=10.0)
+        self.assertRedirects(self.client.post(url, {'yes': 'YES'}), reverse('book:shop'))
+        response = self.client.post(url, {'yes': 'YES'})
+        self.assertContains(response, "You already bought this book.", status_code=409)
+        # The 'no' input does not buy anything
+        self.assertRedirects(self.client.post(url, {'no': 'NO'}), reverse('book:shop'))
+
+    def test_buy_view(self):
+        self.buyer.set_password("test123")
+        self.buyer.save()
+        self.client.login(username="Buyer", password="test123")
+        response = self.client.post(reverse('book:buyBook', args=(self.book.id,)), {'yes': 'YES'})
+        self.assertRedirects(response, reverse('book:shop'))
+        self.assertEqual(self.balances(), (2.5, 12.5))
+
+
+# This test will make hundreds of buyers purchase the same book at the same time, and verify that no money has been
+# created or lost.
+class TestConcurrentPurchase(TransactionTestCase):
+    buyers = 200
+    threads = 16
+
+    # The in-memory SQLite database used by default for tests locks whole tables and can not wait for a lock
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("concurrent writes need a database file or a database server")
+
+    def test_balances_are_conserved(self):
+        seller = User.objects.create(username="Seller")
+        Wallet.objects.create(balance=0.0, owner=seller)
+        User.objects.bulk_create([User(username="Buyer%d" % i) for i in range(self.buyers)])
+        buyers = list(User.objects.filter(username__startswith="Buyer"))
+        # Some buyers can not afford the book
+        Wallet.objects.bulk_create([Wallet(owner=buyer, balance=4.0 if i % 5 else 1.0)
+                                    for i, buyer in enumerate(buyers)])
+        book = Book.objects.create(title="Popular", author="Bot", publication_date=timezone.now(),
+                                   description="A book", gender="Cool", price=2.0, num_pages=1, owner=seller)
+        results = []
+        # Each buyer tries twice to buy the book
+        queue = [buyer for buyer in buyers for _ in range(2)]
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        if not queue:
+                            return
+                        buyer = queue.pop()
+                    result = buy_book(buyer, book.id)
+                    with lock:
+                        results.append(result)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        sold = results.count(PurchaseResult.SUCCESS)
+        self.assertEqual(sold, self.buyers * 4 // 5)
+        self.assertEqual(results.count(PurchaseResult.INSUFFICIENT_FUNDS), self.buyers * 2 // 5)
+        self.assertEqual(results.count(PurchaseResult.ALREADY_OWNED), self.buyers * 4 // 5)
+        self.assertEqual(book.purchasers.count(), sold)
+        self.assertEqual(get_wallet(seller.id).balance, sold * 2.0)
+        compact_wallets()
+        self.assertEqual(Wallet.objects.get(owner=seller).balance, sold * 2.0)
+        total = sum(Wallet.objects.values_list('balance', flat=True))
+        self.assertEqual(total, self.buyers * 4 // 5 * 4.0 + self.buyers // 5 * 1.0)
+
+
+# This class contains a set of tests that will verify the cart and the checkout of a whole cart in one transaction
+class TestCheckout(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create(username="Buyer")
+        self.buyer.set_password("test123")
+        self.buyer.save()
+        self.sellers = [User.objects.create(username="Seller%d" % i) for i in range(3)]
+        Wallet.objects.create(balance=100.0, owner=self.buyer)
+        for seller in self.sellers[:2]:
+            Wallet.objects.create(balance=5.0, owner=seller)
+        self.books = [Book.objects.create(title="Book%d" % i, author="Bot", publication_date=timezone.now(),
+                                          description="A book", gender="Cool", price=2.5, num_pages=10,
+                                          owner=self.sellers[i % 3]) for i in range(30)]
+
+    def balances(self):
+        compact_wallets()
+        return dict(Wallet.objects.values_list('owner__username', 'balance'))
+
+    def test_success(self):
+        result, book_ids = checkout(self.buyer, [book.id for book in self.books[:4]])
+        self.assertEqual(result, PurchaseResult.SUCCESS)
+        self.assertEqual(book_ids, [book.id for book in self.books[:4]])
+        # The third seller had no wallet, one is created by the compaction
+        self.assertEqual(self.balances(), {"Buyer": 90.0, "Seller0": 10.0, "Seller1": 7.5, "Seller2": 2.5})
+        self.assertEqual(set(Book.objects.filter(purchasers=self.buyer)), set(self.books[:4]))
+        self.assertEqual(len(get_purchased_books(self.buyer.id)), 4)
+
+    def test_whole_cart_is_validated(self):
+        buy_book(self.buyer, self.books[1].id)
+        own = Book.objects.create(title="Own", author="Bot", publication_date=timezone.now(), description="A book",
+                                  gender="Cool", price=1, num_pages=10, owner=self.buyer)
+        balances = self.balances()
+        cart = [self.books[0].id, self.books[1].id, self.books[2].id]
+        self.assertEqual(checkout(self.buyer, cart), (PurchaseResult.ALREADY_OWNED, [self.books[1].id]))
+        self.assertEqual(checkout(self.buyer, cart + [own.id]), (PurchaseResult.OWN_BOOK, [own.id]))
+        self.assertEqual(checkout(self.buyer, [self.books[0].id, 0]), (PurchaseResult.NOT_FOUND, [0]))
+        self.assertEqual(checkout(self.buyer, []), (PurchaseResult.EMPTY_CART, []))
+        Wallet.objects.filter(owner=self.buyer).update(balance=4)
+        self.assertEqual(checkout(self.buyer, [self.books[0].id, self.books[2].id]),
+                         (PurchaseResult.INSUFFICIENT_FUNDS, []))
+        # Nothing has been bought nor paid
+        self.assertEqual(Book.objects.filter(purchasers=self.buyer).count(), 1)
+        balances["Buyer"] = 4
+        self.assertEqual(self.balances(), balances)
+
+    def test_constant_query_count(self):
+        # books, purchases among them, savepoint, purchaser rows, debit, sale records, seller and book rollups,
+        # lifetime sales and credits of the sellers (two queries each), purchase counts, previous purchases
+        # (recommendations) and savepoint release, for one book or for twenty books of several sellers. The second
+        # checkout also enqueues the counting of the co-purchases.
+        with self.assertNumQueries(17):
+            checkout(self.buyer, [self.books[0].id])
+        with self.assertNumQueries(18):
+            checkout(self.buyer, [book.id for book in self.books[1:21] if book.owner != self.sellers[2]])
+
+    def test_views(self):
+        self.client.login(username="Buyer", password="test123")
+        for book in self.books[:3]:
+            self.client.post(reverse('book:cartBook', args=[book.id]))
+        self.client.post(reverse('book:cartBook', args=[self.books[0].id]))
+        self.client.post(reverse('book:cartBook', args=[self.books[1].id]), {'remove': "REMOVE"})
+        response = self.client.get(reverse('book:cart'))
+        self.assertEqual(response.context['books'], [self.books[0], self.books[2]])
+        self.assertEqual(response.context['total'], 5.0)
+        self.assertContains(response, "BUY EVERYTHING")
+
+        response = self.client.post(reverse('book:checkout'))
+        self.assertRedirects(response, reverse('book:purchasedBooks'))
+        self.assertEqual(self.balances()["Buyer"], 95.0)
+        self.assertEqual(self.client.get(reverse('book:cart')).context['books'], [])
+
+        # A failed checkout shows the cart again with the reason
+        self.client.post(reverse('book:cartBook', args=[self.books[0].id]))
+        self.client.post(reverse('book:cartBook', args=[self.books[3].id]))
+        response = self.client.post(reverse('book:checkout'))
+        self.assertEqual(response.status_code, 409)
+        self.assertContains(response, "You already bought some of these books.", status_code=409)
+        self.assertEqual(response.context['failed'], [self.books[0].id])
+
+    def test_views_need_login(self):
+        self.assertRedirects(self.client.get(reverse('book:cart')), reverse('book:shop'))
+        self.assertRedirects(self.client.post(reverse('book:checkout')), reverse('book:shop'))
+        self.assertRedirects(self.client.post(reverse('book:cartBook', args=[self.books[0].id])),
+                             reverse('book:shop'))
+
+    def test_cart_is_bounded(self):
+        request = RequestFactory().get('/')
+        request.session = {}
+        for book_id in range(CART_MAX_BOOKS):
+            self.assertTrue(add_to_cart(request, book_id))
+        self.assertFalse(add_to_cart(request, CART_MAX_BOOKS))
+        self.assertTrue(add_to_cart(request, 0))
+
+
+# This class contains a set of tests that will verify that the wallet is loaded once and then read from the cache
+class TestWalletCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create(username="Buyer")
+        self.buyer.set_password("test123")
+        self.buyer.save()
+        self.seller = User.objects.create(username="Seller")
+        Wallet.objects.create(balance=10.0, owner=self.buyer)
+        Wallet.objects.create(balance=5.0, owner=self.seller)
+        self.book = Book.objects.create(title="BookOne", author="Bot1", publication_date=timezone.now(),
+                                        description="A book", gender="Cool", price=7.5, num_pages=500,
+                                        owner=self.seller)
+        self.client.login(username="Buyer", password="test123")
+
+    def test_wallet_is_cached(self):
+        for name in ('book:shop', 'book:ownedBooks', 'book:purchasedBooks'):
+            self.client.get(reverse(name))
+        # session, user and books
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('book:ownedBooks'))
+        self.assertContains(response, "YOUR WALLET: 10.0 €")
+
+    def test_purchase_invalidates_wallets(self):
+        self.assertEqual(get_wallet(self.seller.id).balance, 5.0)
+        self.client.get(reverse('book:shop'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('book:buyBook', args=(self.book.id,)), {'yes': 'YES'})
+        self.assertContains(self.client.get(reverse('book:shop')), "YOUR WALLET: 2.5 €")
+        self.assertEqual(get_wallet(self.seller.id).balance, 12.5)
+
+    def test_user_without_wallet(self):
+        Wallet.objects.filter(owner=self.buyer).delete()
+        self.client.get(reverse('book:shop'))
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('book:shop'))
+        self.assertNotContains(response, "YOUR WALLET")
+
+
+# This class contains a set of tests that will verify the cached sets of purchased books
+class TestPurchasedBooks(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create(username="Buyer")
+        self.seller = User.objects.create(username="Seller")
+        Wallet.objects.create(balance=100.0, owner=self.buyer)
+        Wallet.objects.create(balance=0.0, owner=self.seller)
+        self.books = Book.objects.bulk_create([Book(title="Book%d" % i, author="Bot", description="A book",
+                                                    gender="Cool", publication_date=timezone.now(), price=1.0,
+                                                    num_pages=10, owner=self.seller) for i in range(5)])
+
+    def test_membership(self):
+        purchased = PurchasedBooks([9, 3, 2 ** 40, 7])
+        self.assertEqual(purchased.ids.typecode, 'q')
+        self.assertIn(7, purchased)
+        self.assertIn(2 ** 40, purchased)
+        self.assertNotIn(8, purchased)
+        self.assertNotIn(2 ** 41, purchased)
+        self.assertNotIn(1, PurchasedBooks())
+
+    def test_memory_is_bounded(self):
+        purchased = PurchasedBooks(range(1, 10001))
+        self.assertEqual(purchased.size(), 4 * 10000)
+        self.assertLess(len(pickle.dumps(purchased)), purchased.size() + 200)
+
+    def test_purchase_bumps_version(self):
+        self.assertNotIn(self.books[0].id, get_purchased_books(self.buyer.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            buy_book(self.buyer, self.books[0].id)
+        with self.assertNumQueries(1):
+            self.assertIn(self.books[0].id, get_purchased_books(self.buyer.id))
+        with self.assertNumQueries(0):
+            self.assertIn(self.books[0].id, get_purchased_books(self.buyer.id))
+
+    def test_add_and_remove_bump_version(self):
+        get_purchased_books(self.buyer.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[1].purchasers.add(self.buyer)
+        self.assertIn(self.books[1].id, get_purchased_books(self.buyer.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buyer.related_secondary_manual_roats.remove(self.books[1])
+        self.assertNotIn(self.books[1].id, get_purchased_books(self.buyer.id))
+        self.books[2].purchasers.add(self.buyer)
+        get_purchased_books(self.buyer.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[2].purchasers.clear()
+        self.assertEqual(len(get_purchased_books(self.buyer.id)), 0)
+
+    def test_deleted_book(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            buy_book(self.buyer, self.books[3].id)
+        self.assertIn(self.books[3].id, get_purchased_books(self.buyer.id))
+        book_id = self.books[3].id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[3].delete()
+        self.assertNotIn(book_id, get_purchased_books(self.buyer.id))
+
+
+# This class contains a set of tests that will verify the cached html of the book cards
+class TestBookCards(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(username="Seller")
+        self.seller.set_password("test123")
+        self.seller.save()
+        self.buyer = User.objects.create(username="Buyer")
+        self.buyer.set_password("test123")
+        self.buyer.save()
+        Wallet.objects.create(balance=100.0, owner=self.buyer)
+        self.book = Book.objects.create(title="<Book>", author="Bot", publication_date=timezone.now(),
+                                        description="A & B", gender="Cool", price=1.0, num_pages=10,
+                                        owner=self.seller)
+        self.book.purchasers.add(self.buyer)
+
+    def test_cached_render_is_identical(self):
+        self.client.login(username="Buyer", password="test123")
+        cold = self.client.get(reverse('book:shop')).content
+        warm = self.client.get(reverse('book:shop')).content
+        self.assertEqual(cold, warm)
+        self.assertIn(b'<h2 class="title">&lt;Book&gt;</h2>', warm)
+        self.assertIn(b'<p>A &amp; B</p>', warm)
+
+    def test_footer_is_rendered_per_viewer(self):
+        self.client.login(username="Buyer", password="test123")
+        self.assertContains(self.client.get(reverse('book:shop')), "Already bought")
+        other = User.objects.create(username="Other")
+        self.client.force_login(other)
+        response = self.client.get(reverse('book:shop'))
+        self.assertNotContains(response, "Already bought")
+        self.assertContains(response, reverse('book:buyBook', args=(self.book.id,)))
+
+    def test_saved_book_is_rendered_again(self):
+        self.client.login(username="Seller", password="test123")
+        self.client.get(reverse('book:ownedBooks'))
+        with self.captureOnCommitCallbacks(execute=True):
+            EditBookForm(data={"title": "Renamed", "author": "Bot", "gender": "Cool", "description": "A & B",
+                               "num_pages": 10, "price": 1.0}).update_book(self.book)
+        response = self.client.get(reverse('book:ownedBooks'))
+        self.assertContains(response, "Renamed")
+        self.assertNotContains(response, "&lt;Book&gt;")
+
+
+# This class contains a set of tests that will verify the import of books from files
+class TestImportBooks(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create(username="Seller")
+        self.other = User.objects.create(username="Other")
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def run_import(self, path, *args):
+        output = io.StringIO()
+        call_command('import_books', path, *args, stdout=output)
+        return output.getvalue()
+
+    def test_csv_import(self):
+        path = self.write('books.csv', "title,author,description,gender,num_pages,price,owner\n"
+                                       "Dune,Herbert,Sand and spice,SF,600,9.5,\n"
+                                       "Emma,Austen,A novel,Romance,300,-2,\n"
+                                       "Ubik,Dick,Reality,SF,200,4,Other\n"
+                                       "Lost,Nobody,Nothing,SF,1,1,Ghost\n"
+                                       "Solaris,Lem,An ocean,SF,abc,3,\n")
+        output = self.run_import(path, '--owner', 'Seller', '--batch-size', '2')
+        self.assertIn("Done: 5 rows", output)
+        self.assertEqual(set(Book.objects.values_list('title', 'owner__username')),
+                         {("Dune", "Seller"), ("Ubik", "Other")})
+        self.assertEqual(search_books("spice"), [Book.objects.get(title="Dune")])
+        with open(path + '.errors.jsonl', encoding='utf-8') as file:
+            errors = [json.loads(line) for line in file]
+        self.assertEqual([error['line'] for error in errors], [3, 6, 5])
+        self.assertIn('num_pages', errors[1]['errors'])
+        self.assertIn('owner', errors[2]['errors'])
+
+    def test_jsonl_modes(self):
+        rows = [{"title": "Dune", "author": "Herbert", "description": "Sand", "gender": "SF", "num_pages": 600,
+                 "price": 9.5},
+                {"title": "Dune", "author": "Herbert", "description": "Spice", "gender": "SF", "num_pages": 600,
+                 "price": 12}]
+        path = self.write('books.jsonl', "\n".join(json.dumps(row) for row in rows) + "\nnot json\n")
+        self.run_import(path, '--owner', 'Seller')
+        self.assertEqual(Book.objects.filter(title="Dune").count(), 2)
+
+        Book.objects.all().delete()
+        self.run_import(path, '--owner', 'Seller', '--mode', 'skip')
+        self.assertEqual(list(Book.objects.values_list('description', flat=True)), ["Sand"])
+        self.run_import(path, '--owner', 'Seller', '--mode', 'skip')
+        self.assertEqual(Book.objects.count(), 1)
+
+        output = self.run_import(path, '--owner', 'Seller', '--mode', 'update')
+        self.assertIn("0 inserted, 1 updated, 1 skipped, 1 errors", output)
+        self.assertEqual(list(Book.objects.values_list('description', 'price')), [("Spice", 12.0)])
+        self.assertEqual(search_books("spice"), [Book.objects.get()])
+        self.assertEqual(search_books("sand"), [])
+
+    def test_missing_fields(self):
+        # A JSONL row without a price and a CSV row without the last columns are errors, the other rows are imported
+        rows = [{"title": "Dune", "author": "Herbert", "description": "Sand", "gender": "SF", "num_pages": 600},
+                {"title": "Ubik", "author": "Dick", "description": "Reality", "gender": "SF", "num_pages": 200,
+                 "price": 4}]
+        path = self.write('books.jsonl', "\n".join(json.dumps(row) for row in rows) + "\n")
+        self.assertIn("1 inserted", self.run_import(path, '--owner', 'Seller'))
+        path = self.write('books.csv', "title,author,description,gender,num_pages,price\n"
+                                       "Emma,Austen,A novel,Romance\n"
+                                       "Solaris,Lem,An ocean,SF,300,3\n")
+        self.assertIn("1 inserted", self.run_import(path, '--owner', 'Seller'))
+        self.assertEqual(set(Book.objects.values_list('title', flat=True)), {"Ubik", "Solaris"})
+        with open(path + '.errors.jsonl', encoding='utf-8') as file:
+            errors = [json.loads(line)['errors'] for line in file]
+        self.assertEqual(len(errors), 1)
+        self.assertIn('num_pages', errors[0])
+        self.assertIn('price', errors[0])
+
+    def test_no_error_file(self):
+        path = self.write('books.csv', "title,author,description,gender,num_pages,price\n"
+                                       "Dune,Herbert,Sand and spice,SF,600,9.5\n")
+        self.run_import(path, '--owner', 'Seller')
+        self.assertFalse(os.path.exists(path + '.errors.jsonl'))
+
+    def test_stdin_is_not_closed(self):
+        stdin = io.StringIO("title,author,description,gender,num_pages,price\nDune,Herbert,Sand,SF,600,9.5\n")
+        with unittest.mock.patch('sys.stdin', stdin):
+            self.run_import('-', '--owner', 'Seller', '--errors', os.path.join(self.directory.name, 'errors.jsonl'))
+        self.assertFalse(stdin.closed)
+        self.assertEqual(Book.objects.count(), 1)
+
+    # Without the ids of the inserted rows (MySQL), only the books of the import are read back
+    def test_read_back_without_returned_ids(self):
+        bulk_create = Book.objects.bulk_create
+
+        # Another request of the same owner inserts a book during the import
+        def concurrent_bulk_create(books):
+            Book.objects.create(title="Other", author="Writer", publication_date=timezone.now(), description="Other",
+                                gender="SF", num_pages=1, price=1, owner=self.seller)
+            # The ids of the inserted rows are not returned
+            created = bulk_create(books)
+            for book in created:
+                book.id = None
+            return created
+
+        path = self.write('books.csv', "title,author,description,gender,num_pages,price\n"
+                                       "Dune,Herbert,Sand and spice,SF,600,9.5\n")
+        with unittest.mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False), \
+                unittest.mock.patch.object(Book.objects, 'bulk_create', side_effect=concurrent_bulk_create):
+            self.run_import(path, '--owner', 'Seller')
+        self.assertEqual(search_books("spice"), [Book.objects.get(title="Dune")])
+        # The book of the other request was counted by its own save, not a second time by the import
+        self.assertEqual(BookFacet.objects.filter(gender="SF").aggregate(Sum('count'))['count__sum'], 2)
+
+
+# This class contains a set of tests that will verify the streamed exports of books
+class TestExport(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create(username="Seller")
+        self.buyer = User.objects.create(username="Buyer")
+        self.buyer.set_password("test123")
+        self.buyer.save()
+        self.books = Book.objects.bulk_create([Book(title="Book%d" % i, author="Bot, Jr.", description="A book",
+                                                    gender="Cool", publication_date=timezone.now(), price=1.5,
+                                                    num_pages=10, owner=self.seller) for i in range(5)])
+        self.books = list(Book.objects.order_by('id'))
+        self.books[1].purchasers.add(self.buyer)
+        self.books[3].purchasers.add(self.buyer)
+
+    def test_lines_are_read_by_chunks(self):
+        lines = export_lines(export_queryset('shop', self.buyer), 'csv', chunk_size=2)
+        # The header is sent before any query
+        with self.assertNumQueries(0):
+            self.assertEqual(next(lines), "id,title,author,description,gender,num_pages,price,publication_date,"
+                                          "owner\r\n")
+        with self.assertNumQueries(3):
+            rows = list(lines)
+        self.assertEqual(len(rows), 5)
+        self.assertIn('"Bot, Jr."', rows[0])
+
+    def test_purchased_jsonl_view(self):
+        self.client.login(username="Buyer", password="test123")
+        response = self.client.get(reverse('book:export', args=('purchased', 'jsonl')))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['title'] for row in rows], ["Book1", "Book3"])
+        self.assertEqual(rows[0]['owner'], "Seller")
+        self.assertEqual(rows[0]['publication_date'][:23], self.books[1].publication_date.isoformat()[:23])
+
+    def test_export_needs_login(self):
+        self.assertEqual(self.client.get(reverse('book:export', args=('owned', 'csv'))).status_code, 302)
+        self.assertEqual(self.client.get(reverse('book:export', args=('shop', 'csv'))).status_code, 200)
+        self.client.login(username="Buyer", password="test123")
+        self.assertEqual(self.client.get(reverse('book:export', args=('shop', 'xml'))).status_code, 404)
+
+    def test_export_command(self):
+        output = io.StringIO()
+        call_command('export_books', 'owned', '--user', 'Seller', '--chunk-size', '2', stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), 6)
+
+
+# This class contains a set of tests that will verify the json api and its conditional responses
+class TestApi(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(username="Seller")
+        self.buyer = User.objects.create(username="Buyer")
+        self.buyer.set_password("test123")
+        self.buyer.save()
+        Wallet.objects.create(balance=10.0, owner=self.buyer)
+        Wallet.objects.create(balance=0.0, owner=self.seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book = Book.objects.create(title="BookOne", author="Bot", publication_date=timezone.now(),
+                                            description="A book", gender="Cool", price=2.5, num_pages=10,
+                                            owner=self.seller)
+
+    def test_shop_not_modified(self):
+        url = reverse('book:apiShop')
+        response = self.client.get(url)
+        self.assertEqual(response.json()['results'][0]['title'], "BookOne")
+        self.assertIn('Last-Modified', response)
+        # A visitor gets the 304 without any query
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [])
+
+    def test_shop_follows_purchases(self):
+        self.client.login(username="Buyer", password="test123")
+        url = reverse('book:apiShop')
+        response = self.client.get(url)
+        self.assertFalse(response.json()['results'][0]['purchased'])
+        self.assertNotIn('Last-Modified', response)
+        # session and user
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            buy_book(self.buyer, self.book.id)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['results'][0]['purchased'])
+
+    def test_book_not_modified(self):
+        url = reverse('book:apiBook', args=(self.book.id,))
+        response = self.client.get(url)
+        self.assertEqual(response.json()['price'], 2.5)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.book.price = 3.5
+        self.book.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.json()['price'], 3.5)
+        self.assertEqual(self.client.get(reverse('book:apiBook', args=(0,))).status_code, 404)
+
+    def test_wallet_and_libraries(self):
+        self.assertEqual(self.client.get(reverse('book:apiWallet')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('book:apiPurchasedBooks')).status_code, 403)
+        self.client.login(username="Buyer", password="test123")
+        wallet = self.client.get(reverse('book:apiWallet'))
+        purchased = self.client.get(reverse('book:apiPurchasedBooks'))
+        self.assertEqual(wallet.json(), {'balance': 10.0})
+        self.assertEqual(purchased.json()['results'], [])
+        self.assertEqual(self.client.get(reverse('book:apiWallet'), HTTP_IF_NONE_MATCH=wallet['ETag']).status_code,
+                         304)
+        with self.captureOnCommitCallbacks(execute=True):
+            buy_book(self.buyer, self.book.id)
+        wallet = self.client.get(reverse('book:apiWallet'), HTTP_IF_NONE_MATCH=wallet['ETag'])
+        purchased = self.client.get(reverse('book:apiPurchasedBooks'), HTTP_IF_NONE_MATCH=purchased['ETag'])
+        self.assertEqual(wallet.json(), {'balance': 7.5})
+        self.assertEqual([book['id'] for book in purchased.json()['results']], [self.book.id])
+        self.assertEqual(self.client.get(reverse('book:apiOwnedBooks')).json()['results'], [])
+
+
+# This class contains a set of tests that will verify the synthetic catalog and the benchmark of the views
+class TestBenchViews(TestCase):
+    def setUp(self):
+        cache.clear()
+        call_command('seed_catalog', '--users', '5', '--books', '60', '--purchases', '100', stdout=io.StringIO())
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_seed_is_deterministic(self):
+        self.assertEqual(User.objects.filter(username__startswith='seed-user-').count(), 5)
+        self.assertEqual(Wallet.objects.count(), 5)
+        self.assertEqual(Book.objects.count(), 60)
+        self.assertFalse(Book.objects.filter(purchasers=F('owner')).exists())
+        titles = list(Book.objects.order_by('id').values_list('title', flat=True))
+        with self.assertRaises(CommandError):
+            call_command('seed_catalog', stdout=io.StringIO())
+        User.objects.filter(username__startswith='seed-user-').delete()
+        call_command('seed_catalog', '--users', '5', '--books', '60', '--purchases', '100', stdout=io.StringIO())
+        self.assertEqual(list(Book.objects.order_by('id').values_list('title', flat=True)), titles)
+
+    def test_every_url_is_measured(self):
+        path = os.path.join(self.directory.name, 'report.json')
+        call_command('bench_views', '--iterations', '2', '--warmup', '1', '--report', path, stdout=io.StringIO())
+        with open(path) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(report['failures'], [])
+        self.assertEqual(len(report['views']), len(book_urls.urlpatterns) + len(accounts_urls.urlpatterns))
+        shop = report['views']['book:shop']
+        self.assertEqual(shop['status'], 200)
+        self.assertLessEqual(shop['p50_ms'], shop['p95_ms'])
+        self.assertGreater(shop['queries'], 0)
+        self.assertGreater(shop['peak_kb'], 0)
+
+    def test_budget_is_enforced(self):
+        path = os.path.join(self.directory.name, 'budgets.json')
+        with open(path, 'w') as budgets_file:
+            json.dump({'book:shop': {'max_queries': 0}}, budgets_file)
+        with self.assertRaisesMessage(CommandError, 'book:shop: queries'):
+            call_command('bench_views', '--iterations', '1', '--warmup', '0', '--budgets', path,
+                         '--report', os.path.join(self.directory.name, 'report.json'), stdout=io.StringIO())
+
+
+# This class contains a set of tests that will verify the timing middleware
+class TestTimingMiddleware(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(username="Seller")
+        Book.objects.create(title="BookOne", author="Bot", publication_date=timezone.now(), description="A book",
+                            gender="Cool", price=2.5, num_pages=10, owner=self.seller)
+
+    def timings(self, response):
+        return {metric.split(';')[0]: metric for metric in response['Server-Timing'].split(', ')}
+
+    def test_server_timing(self):
+        with self.assertLogs('book.timing', 'INFO') as logs:
+            response = self.client.get(reverse('book:shop'))
+        timings = self.timings(response)
+        self.assertEqual(list(timings), ['sql', 'template', 'view', 'total'])
+        # Only the books and the facets are read for a visitor
+        self.assertIn('desc="2 queries"', timings['sql'])
+        record = logs.records[0]
+        self.assertEqual((record.path, record.status, record.queries), ('/shop/', 200, 2))
+        self.assertGreater(record.template_ms, 0)
+        self.assertAlmostEqual(record.sql_ms + record.template_ms + record.view_ms, record.total_ms, delta=0.05)
+
+    def test_sampled_profiles(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(REQUEST_PROFILE_RATE=1.0, REQUEST_PROFILE_DIR=directory):
+                self.client_class().get(reverse('book:shop'))
+            self.assertEqual(len([name for name in os.listdir(directory) if name.endswith('-GET-shop.prof')]), 1)
+            with self.settings(REQUEST_PROFILE_RATE=0.0, REQUEST_PROFILE_DIR=directory):
+                self.client_class().get(reverse('book:shop'))
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+
+# This class contains a set of tests that will verify that the async views give the same pages as the sync views
+class TestAsyncViews(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create(username="Buyer")
+        self.seller = User.objects.create(username="Seller")
+        Wallet.objects.create(balance=10.0, owner=self.buyer)
+        Wallet.objects.create(balance=5.0, owner=self.seller)
+        self.books = Book.objects.bulk_create([Book(title="Book%d" % i, author="Bot", publication_date=timezone.now(),
+                                                    description="A book", gender="Cool", price=1.5, num_pages=10,
+                                                    owner=self.seller if i % 3 else self.buyer) for i in range(45)])
+        self.books = list(Book.objects.order_by('id'))
+        self.books[1].purchasers.add(self.buyer)
+
+    def request(self, factory, user, path, **data):
+        request = factory.post(path, data) if data else factory.get(path)
+        request.user = user
+        return request
+
+    def test_same_pages(self):
+        for name, sync_view, async_view in (('shop', views.ShopView, views.AsyncShopView),
+                                            ('ownedBooks', views.OwnedBooksView, views.AsyncOwnedBooksView),
+                                            ('purchasedBooks', views.PurchasedBooksView,
+                                             views.AsyncPurchasedBooksView)):
+            for user in (self.buyer, AnonymousUser()):
+                path = reverse('book:%s' % name)
+                expected = sync_view.as_view()(self.request(RequestFactory(), user, path))
+                response = async_to_sync(async_view.as_view())(self.request(AsyncRequestFactory(), user, path))
+                if hasattr(expected, 'render'):
+                    expected.render()
+                self.assertEqual(response.status_code, expected.status_code)
+                # The csrf tokens of the cart forms are masked differently on each render
+                self.assertEqual(self.without_csrf(response.content), self.without_csrf(expected.content))
+
+    def without_csrf(self, content):
+        return re.sub(rb'name="csrfmiddlewaretoken" value="[^"]*"', b'', content)
+
+    def test_next_page(self):
+        path = reverse('book:shop')
+        page = views.ShopView.as_view()(self.request(RequestFactory(), self.buyer, path)).context_data['page_obj']
+        path += '?cursor=' + page.next_cursor
+        response = async_to_sync(views.AsyncShopView.as_view())(self.request(AsyncRequestFactory(), self.buyer, path))
+        on_sale = [book.title for book in self.books if book.owner_id == self.seller.id]
+        self.assertContains(response, '>%s<' % on_sale[20])
+        self.assertNotContains(response, '>%s<' % on_sale[19])
+
+    def test_shop_queries(self):
+        request = self.request(AsyncRequestFactory(), self.buyer, reverse('book:shop'))
+        # books, purchased books, facets, recommendations and wallet, like the sync view
+        with self.assertNumQueries(5):
+            response = async_to_sync(views.AsyncShopView.as_view())(request)
+        self.assertContains(response, "YOUR WALLET: 10.0")
+        self.assertContains(response, "Already bought", count=1)
+
+    async def test_buy(self):
+        book = self.books[2]
+        view = views.AsyncBuyBookView.as_view()
+        response = await view(self.request(AsyncRequestFactory(), self.buyer, '/shop/%d' % book.id), num=book.id)
+        self.assertContains(response, book.title)
+        response = await view(self.request(AsyncRequestFactory(), AnonymousUser(), '/shop/%d' % book.id), num=book.id)
+        self.assertEqual(response.status_code, 302)
+        response = await view(self.request(AsyncRequestFactory(), self.buyer, '/shop/%d' % book.id, yes='YES'),
+                              num=book.id)
+        self.assertEqual(response['Location'], reverse('book:shop'))
+        self.assertEqual(await Wallet.objects.filter(owner=self.buyer).values_list('balance', flat=True).aget(), 8.5)
+        # A failed purchase shows the book again with the reason
+        response = await view(self.request(AsyncRequestFactory(), self.buyer, '/shop/%d' % book.id, yes='YES'),
+                              num=book.id)
+        self.assertContains(response, "You already bought this book.", status_code=409)
+
+    def test_timing_middleware(self):
+        async def view(request):
+            return HttpResponse(str(await Book.objects.acount()))
+
+        # The query is run in another thread than the middleware
+        middleware = TimingMiddleware(view)
+        response = async_to_sync(middleware)(AsyncRequestFactory().get('/'))
+        self.assertEqual(response.content, b"45")
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+
+# This class contains a set of tests that will verify the filters and the sort orders of the shop
+class TestShopFilters(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create(username="Buyer")
+        self.seller = User.objects.create(username="Seller")
+        self.books = Book.objects.bulk_create([
+            Book(title="Book%02d" % (29 - i), author="Bot%d" % (i % 2), publication_date=timezone.now(),
+                 description="A book", gender="Fantasy" if i % 3 else "Horror", price=float(i % 7), num_pages=10,
+                 owner=self.seller) for i in range(30)])
+        self.books = list(Book.objects.order_by('id'))
+
+    def titles(self, **params):
+        titles, cursor = [], None
+        while True:
+            request = RequestFactory().get(reverse('book:shop'), dict(params, cursor=cursor) if cursor else params)
+            request.user = self.buyer
+            response = views.ShopView.as_view()(request)
+            titles += [book.title for book in response.context_data['books']]
+            cursor = response.context_data['page_obj'].next_cursor
+            if not cursor:
+                return titles
+
+    def test_filters_and_sorts(self):
+        key = {'date': lambda book: (book.publication_date, book.id),
+               '-date': lambda book: (book.publication_date, book.id),
+               'price': lambda book: (book.price, book.id),
+               '-price': lambda book: (book.price, book.id),
+               'title': lambda book: (book.title, book.id),
+               'bestsellers': lambda book: (-book.purchase_count, -book.id)}
+        Book.objects.filter(pk__in=[book.pk for book in self.books[::4]]).update(purchase_count=3)
+        Book.objects.filter(pk__in=[book.pk for book in self.books[::5]]).update(purchase_count=F('purchase_count') + 1)
+        self.books = list(Book.objects.order_by('id'))
+        for sort in ShopFilterForm.SORTS:
+            books = [book for book in self.books if book.gender == "Fantasy" and 2 <= book.price <= 5]
+            expected = [book.title for book in sorted(books, key=key[sort], reverse=sort.startswith('-'))]
+            self.assertEqual(self.titles(gender="Fantasy", min_price=2, max_price=5, sort=sort), expected)
+        self.assertEqual(self.titles(author="Bot1", sort="title")[:2], ["Book00", "Book02"])
+
+    def test_invalid_filters_are_ignored(self):
+        self.assertEqual(len(self.titles(min_price="cheap", sort="color")), 30)
+
+    def test_pagination_keeps_the_filters(self):
+        response = self.client.get(reverse('book:shop'), {'sort': '-price'})
+        self.assertContains(response, '?sort=-price&cursor=')
+
+    def test_every_combination_uses_an_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('The query plans are read from the SQLite EXPLAIN QUERY PLAN.')
+        filters = {'gender': "Fantasy", 'author': "Bot1", 'min_price': 2, 'max_price': 5}
+        for sort in ShopFilterForm.SORTS:
+            for count in range(len(filters) + 1):
+                for names in itertools.combinations(filters, count):
+                    form = ShopFilterForm(dict({name: filters[name] for name in names}, sort=sort))
+                    books, ordering = filter_shop(shop_books(self.buyer), form)
+                    paginator = KeysetPaginator(books, 20, ordering)
+                    first_page = paginator.page_query()[0]
+                    next_page = paginator.page_query(paginator.encode_cursor('n', paginator.get_key(self.books[0])))[0]
+                    for queryset in (first_page, next_page):
+                        plan = queryset.explain()
+                        # "SCAN book_book" without an index is a full table scan
+                        self.assertNotRegex(plan, r'SCAN book_book(?! USING (COVERING )?INDEX)', (names, sort, plan))
+                        self.assertIn('INDEX', plan, (names, sort, plan))
+
+
+# This class contains a set of tests that will verify the facet counts of the shop
+class TestFacets(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(username="Seller")
+        self.seller.set_password("test123")
+        self.seller.save()
+
+    def create_book(self, gender, price):
+        return Book.objects.create(title="Book", author="Bot", publication_date=timezone.now(), description="A book",
+                                   gender=gender, price=price, num_pages=10, owner=self.seller)
+
+    def facets(self):
+        return {(facet.gender, facet.price_bucket): facet.count for facet in BookFacet.objects.all() if facet.count}
+
+    def test_create_edit_delete(self):
+        book = self.create_book("Fantasy", 7.5)
+        self.create_book("Fantasy", 8)
+        self.create_book("Horror", 150)
+        self.assertEqual(self.facets(), {("Fantasy", 1): 2, ("Horror", 5): 1})
+        self.assertEqual(self.facets(), count_catalog())
+
+        # The form gives strings, like the edit view
+        form = EditBookForm(data={'title': "Book", 'author': "Bot", 'description': "A book", 'gender': "Horror",
+                                  'num_pages': "10", 'price': "3.5"})
+        self.assertTrue(form.is_valid())
+        form.update_book(Book.objects.get(pk=book.pk))
+        self.assertEqual(self.facets(), {("Fantasy", 1): 1, ("Horror", 0): 1, ("Horror", 5): 1})
+
+        Book.objects.get(pk=book.pk).delete()
+        self.assertEqual(self.facets(), {("Fantasy", 1): 1, ("Horror", 5): 1})
+        self.assertEqual(self.facets(), count_catalog())
+
+    def test_shop_facets(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_book("Fantasy", 7.5)
+            self.create_book("Horror", 150)
+            self.create_book("Horror", 120)
+        response = self.client.get(reverse('book:shop'))
+        self.assertEqual(response.context['facets'], {'genders': [("Horror", 2), ("Fantasy", 1)],
+                                                      'prices': [("5 - 10 €", 1), ("100 € and more", 2)]})
+        self.assertContains(response, "Horror (2)")
+        # The facets are read once per version of the catalog, the next shop pages do not count them
+        with self.assertNumQueries(1):
+            self.client.get(reverse('book:shop'))
+
+    def test_rebuild_repairs_drift(self):
+        self.create_book("Fantasy", 7.5)
+        Book.objects.bulk_create([Book(title="Bulk", author="Bot", publication_date=timezone.now(),
+                                       description="A book", gender="Poetry", price=1, num_pages=10,
+                                       owner=self.seller)])
+        BookFacet.objects.filter(gender="Fantasy").update(count=5)
+        output = io.StringIO()
+        call_command('rebuild_facets', '--dry-run', stdout=output)
+        self.assertIn("2 facets have drifted.", output.getvalue())
+        self.assertEqual(self.facets(), {("Fantasy", 1): 5})
+        call_command('rebuild_facets', stdout=io.StringIO())
+        self.assertEqual(self.facets(), {("Fantasy", 1): 1, ("Poetry", 0): 1})
+
+    def test_import_updates_facets(self):
+        self.create_book("Fantasy", 7.5)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'books.jsonl')
+            with open(path, 'w') as books_file:
+                books_file.write(json.dumps({'title': "Book", 'author': "Bot", 'description': "A book",
+                                             'gender': "Horror", 'num_pages': 10, 'price': 30}) + '\n')
+                books_file.write(json.dumps({'title': "New", 'author': "Bot", 'description': "A book",
+                                             'gender': "Poetry", 'num_pages': 10, 'price': 2}) + '\n')
+            call_command('import_books', path, '--owner', 'Seller', '--mode', 'update', stdout=io.StringIO())
+        self.assertEqual(self.facets(), {("Horror", 3): 1, ("Poetry", 0): 1})
+        self.assertEqual(self.facets(), count_catalog())
+
+
+# This class contains a set of tests that will verify the co-purchase recommendations: the batch build, the updates
+# made by each purchase and the pages that show them
+class TestRecommendations(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(username="Seller")
+        self.users = [User.objects.create(username="User%d" % i) for i in range(4)]
+        for user in self.users:
+            Wallet.objects.create(balance=100.0, owner=user)
+        self.books = [Book.objects.create(title="Book%d" % i, author="Bot", publication_date=timezone.now(),
+                                          description="A book", gender="Cool", price=1.5, num_pages=10,
+                                          owner=self.seller) for i in range(5)]
+
+    def recommendations(self):
+        return {(row.book_id, row.recommended_id): row.score for row in BookRecommendation.objects.all()}
+
+    # The co-purchases are counted by the job queue
+    def purchase(self, user, *books):
+        with self.captureOnCommitCallbacks(execute=True):
+            for book in books:
+                self.assertEqual(buy_book(user, book.id), PurchaseResult.SUCCESS)
+        run_due_jobs()
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_co_purchases(self):
+        # Users 1 and 2 bought books 10 and 20, user 2 also bought book 30, user 3 only bought book 10
+        left, right, scores = co_purchases([1, 1, 2, 2, 2, 3], [10, 20, 10, 20, 30, 10], k=1)
+        self.assertEqual(list(zip(left.tolist(), right.tolist(), scores.tolist())),
+                         [(10, 20, 2), (20, 10, 2), (30, 10, 1)])
+        # The baskets bigger than max_basket are left out
+        left, right, scores = co_purchases([1, 1, 2, 2, 2, 3], [10, 20, 10, 20, 30, 10], k=5, max_basket=2)
+        self.assertEqual(list(zip(left.tolist(), right.tolist(), scores.tolist())), [(10, 20, 1), (20, 10, 1)])
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_chunks_give_the_same_result(self):
+        users = [i % 7 for i in range(60)]
+        books = [(i * 13) % 17 for i in range(60)]
+        edges = sorted(set(zip(users, books)))
+        users, books = [user for user, _ in edges], [book for _, book in edges]
+        whole = co_purchases(users, books, k=3)
+        chunked = co_purchases(users, books, k=3, chunk_pairs=10)
+        for array, chunked_array in zip(whole, chunked):
+            self.assertEqual(array.tolist(), chunked_array.tolist())
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_build_command(self):
+        for user in self.users[:3]:
+            self.books[0].purchasers.add(user)
+            self.books[1].purchasers.add(user)
+        self.books[2].purchasers.add(self.users[0])
+        BookRecommendation.objects.all().delete()
+        output = io.StringIO()
+        call_command('build_recommendations', stdout=output)
+        self.assertIn("6 recommendations stored", output.getvalue())
+        self.assertEqual(self.recommendations(), {
+            (self.books[0].id, self.books[1].id): 3, (self.books[1].id, self.books[0].id): 3,
+            (self.books[0].id, self.books[2].id): 1, (self.books[2].id, self.books[0].id): 1,
+            (self.books[1].id, self.books[2].id): 1, (self.books[2].id, self.books[1].id): 1})
+
+    def test_purchase_updates_recommendations(self):
+        self.purchase(self.users[0], self.books[0], self.books[1])
+        self.assertEqual(self.recommendations(), {(self.books[0].id, self.books[1].id): 1,
+                                                  (self.books[1].id, self.books[0].id): 1})
+        self.purchase(self.users[1], self.books[1], self.books[0])
+        self.purchase(self.users[1], self.books[2])
+        self.assertEqual(self.recommendations(), {
+            (self.books[0].id, self.books[1].id): 2, (self.books[1].id, self.books[0].id): 2,
+            (self.books[0].id, self.books[2].id): 1, (self.books[2].id, self.books[0].id): 1,
+            (self.books[1].id, self.books[2].id): 1, (self.books[2].id, self.books[1].id): 1})
+        # Books added together from the side of the user are counted once
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[2].related_secondary_manual_roats.add(self.books[0], self.books[2])
+        run_due_jobs()
+        self.assertEqual(self.recommendations()[(self.books[0].id, self.books[2].id)], 2)
+        self.assertEqual(self.recommendations()[(self.books[2].id, self.books[0].id)], 2)
+        self.assertEqual([book.id for book in get_recommendations(self.books[0].id)],
+                         [self.books[1].id, self.books[2].id])
+
+    def test_failed_purchase_is_not_counted(self):
+        self.purchase(self.users[0], self.books[0])
+        Wallet.objects.filter(owner=self.users[0]).update(balance=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(buy_book(self.users[0], self.books[1].id), PurchaseResult.INSUFFICIENT_FUNDS)
+        self.assertEqual(run_due_jobs(), 0)
+        self.assertEqual(self.recommendations(), {})
+
+    # A failure of the counting is retried by the job queue, the purchase is not failed
+    def test_counting_failure(self):
+        with unittest.mock.patch('book.tasks.count_pairs', side_effect=DatabaseError('timeout')), \
+                self.assertLogs('book.jobs', 'WARNING'):
+            self.purchase(self.users[0], self.books[0], self.books[1])
+        self.assertEqual(self.recommendations(), {})
+        self.assertTrue(self.books[1].purchasers.filter(pk=self.users[0].pk).exists())
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(run_due_jobs(), 1)
+        self.assertEqual(self.recommendations(), {(self.books[0].id, self.books[1].id): 1,
+                                                  (self.books[1].id, self.books[0].id): 1})
+
+    # The books keep their best RECOMMENDATIONS_PER_BOOK rows
+    def test_trim(self):
+        self.purchase(self.users[0], *self.books[:3])
+        self.purchase(self.users[1], self.books[0], self.books[2])
+        with unittest.mock.patch('book.tasks.trim_recommendations',
+                                 lambda book_ids: trim_recommendations(book_ids, k=1)):
+            self.purchase(self.users[2], self.books[3], self.books[2])
+        # Only the books of the last purchase are trimmed
+        books = [book.id for book in self.books]
+        self.assertEqual(self.recommendations(), {
+            (books[0], books[1]): 1, (books[0], books[2]): 2, (books[1], books[0]): 1, (books[1], books[2]): 1,
+            (books[2], books[0]): 2, (books[3], books[2]): 1})
+
+    def test_buy_page(self):
+        self.purchase(self.users[0], self.books[0], self.books[1])
+        self.client.force_login(self.users[1])
+        response = self.client.get(reverse('book:buyBook', args=[self.books[0].id]))
+        self.assertEqual(response.context['recommended'], [self.books[1]])
+        self.assertContains(response, "ALSO BOUGHT")
+        response = async_to_sync(views.AsyncBuyBookView.as_view())(self.async_request(self.users[1]),
+                                                                   num=self.books[0].id)
+        self.assertContains(response, "Book1 - Bot")
+
+    def async_request(self, user, path='/'):
+        request = AsyncRequestFactory().get(path)
+        request.user = user
+        request.session = self.client.session
+        return request
+
+    def test_shop(self):
+        self.purchase(self.users[0], self.books[0], self.books[1], self.books[2])
+        self.purchase(self.users[1], self.books[0])
+        self.client.force_login(self.users[1])
+        response = self.client.get(reverse('book:shop'))
+        self.assertEqual([book['id'] for book in response.context['recommended']], [self.books[1].id, self.books[2].id])
+        self.assertContains(response, "RECOMMENDED FOR YOU")
+        # The recommendations are cached until the user purchases another book
+        with self.assertNumQueries(3):
+            self.client.get(reverse('book:shop'))
+        self.purchase(self.users[1], self.books[1])
+        response = self.client.get(reverse('book:shop'))
+        self.assertEqual([book['id'] for book in response.context['recommended']], [self.books[2].id])
+        response = async_to_sync(views.AsyncShopView.as_view())(self.async_request(self.users[1], '/shop/'))
+        self.assertContains(response, "Book2 - Bot")
+        # A user without purchases gets no recommendations
+        self.client.force_login(self.users[3])
+        self.assertNotContains(self.client.get(reverse('book:shop')), "RECOMMENDED FOR YOU")
+
+
+# This class contains a set of tests that will verify the sale records, their daily rollups and the sales analytics
+class TestSales(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create(username="Seller")
+        self.seller.set_password("test123")
+        self.seller.save()
+        self.other_seller = User.objects.create(username="OtherSeller")
+        self.buyers = [User.objects.create(username="Buyer%d" % i) for i in range(3)]
+        for buyer in self.buyers:
+            Wallet.objects.create(balance=100.0, owner=buyer)
+        self.books = [Book.objects.create(title="Book%d" % i, author="Bot", publication_date=timezone.now(),
+                                          description="A book", gender="Cool", price=10.0 + i, num_pages=10,
+                                          owner=self.seller if i < 3 else self.other_seller) for i in range(4)]
+
+    def rollups(self):
+        return (set(SellerDailySales.objects.values_list('seller__username', 'day', 'sales', 'revenue')),
+                set(BookDailySales.objects.values_list('book__title', 'seller__username', 'day', 'sales', 'revenue')))
+
+    def test_purchases_are_recorded(self):
+        buy_book(self.buyers[0], self.books[0].id)
+        checkout(self.buyers[1], [self.books[0].id, self.books[1].id, self.books[3].id])
+        # A price changed after a sale does not change the sale
+        Book.objects.filter(pk=self.books[0].pk).update(price=99)
+        buy_book(self.buyers[2], self.books[0].id)
+        today = timezone.localdate()
+        self.assertEqual(sorted(Purchase.objects.filter(book=self.books[0]).values_list('price', flat=True)),
+                         [10.0, 10.0, 99.0])
+        self.assertEqual(self.rollups(), (
+            {("Seller", today, 4, 130.0), ("OtherSeller", today, 1, 13.0)},
+            {("Book0", "Seller", today, 3, 119.0), ("Book1", "Seller", today, 1, 11.0),
+             ("Book3", "OtherSeller", today, 1, 13.0)}))
+
+    def test_failed_purchase_is_not_recorded(self):
+        Wallet.objects.filter(owner=self.buyers[0]).update(balance=1)
+        self.assertEqual(buy_book(self.buyers[0], self.books[0].id), PurchaseResult.INSUFFICIENT_FUNDS)
+        self.assertEqual(checkout(self.buyers[0], [self.books[0].id, self.books[1].id])[0],
+                         PurchaseResult.INSUFFICIENT_FUNDS)
+        self.assertFalse(Purchase.objects.exists())
+        self.assertEqual(self.rollups(), (set(), set()))
+
+    def test_analytics(self):
+        today = timezone.localdate()
+        record_sales(self.buyers[0].id, [(self.books[0].id, self.seller.id, 10.0)],
+                     timezone.now() - timezone.timedelta(days=2))
+        record_sales(self.buyers[1].id, [(self.books[1].id, self.seller.id, 11.0),
+                                         (self.books[0].id, self.seller.id, 10.0)])
+        # A sale older than the period is left out
+        record_sales(self.buyers[2].id, [(self.books[2].id, self.seller.id, 12.0)],
+                     timezone.now() - timezone.timedelta(days=40))
+        analytics = seller_analytics(self.seller.id, days=7)
+        self.assertEqual(analytics['sales'], 3)
+        self.assertEqual(analytics['revenue'], 31.0)
+        self.assertEqual(len(analytics['per_day']), 7)
+        self.assertEqual(analytics['per_day'][-1], (today, 2, 21.0))
+        self.assertEqual(analytics['per_day'][-3], (today - timezone.timedelta(days=2), 1, 10.0))
+        self.assertEqual(analytics['books'], [(self.books[0].id, "Book0", 2, 20.0),
+                                              (self.books[1].id, "Book1", 1, 11.0)])
+        self.assertEqual(seller_analytics(self.seller.id, days=90)['sales'], 4)
+
+    def test_view(self):
+        buy_book(self.buyers[0], self.books[0].id)
+        self.assertRedirects(self.client.get(reverse('book:sales')), reverse('book:index'))
+        self.client.login(username="Seller", password="test123")
+        # session, user, daily sales of the seller, lifetime sales of the seller and sales of the books
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('book:sales'), {'days': 7})
+        self.assertContains(response, "1 SALES, 10.0 €")
+        self.assertContains(response, "1 SALES, 10.0 € SINCE YOUR FIRST SALE")
+        self.assertContains(response, "<td>Book0</td>")
+        self.assertEqual(response.context['days'], 7)
+        # An invalid period falls back to 30 days
+        self.assertEqual(self.client.get(reverse('book:sales'), {'days': 3}).context['days'], 30)
+
+    def test_backfill(self):
+        buy_book(self.buyers[0], self.books[0].id)
+        checkout(self.buyers[1], [self.books[1].id, self.books[3].id])
+        expected = self.rollups()
+        # Purchases inserted without buy_book have no sale record
+        self.books[2].purchasers.add(self.buyers[2])
+        SellerDailySales.objects.update(sales=0)
+        BookDailySales.objects.all().delete()
+        output = io.StringIO()
+        call_command('backfill_sales', stdout=output)
+        self.assertIn("2 seller days and 3 book days rebuilt", output.getvalue())
+        self.assertEqual(self.rollups(), expected)
+        call_command('backfill_sales', '--purchases', stdout=output)
+        self.assertIn("1 sale records created", output.getvalue())
+        self.assertEqual(Purchase.objects.get(book=self.books[2]).purchased_at, self.books[2].publication_date)
+        self.assertEqual(seller_analytics(self.seller.id)['sales'], 3)
+
+
+# This class contains a set of tests that will verify the purchase counts of the books, the lifetime sales of the
+# sellers and the bestsellers
+class TestPurchaseCounts(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sellers = [User.objects.create(username="Seller%d" % i) for i in range(2)]
+        self.buyers = [User.objects.create(username="Buyer%d" % i) for i in range(3)]
+        for buyer in self.buyers:
+            Wallet.objects.create(balance=100.0, owner=buyer)
+        self.books = [Book.objects.create(title="Book%d" % i, author="Bot", publication_date=timezone.now(),
+                                          description="A book", gender="Cool" if i % 2 else "Sad", price=10.0 + i,
+                                          num_pages=10, owner=self.sellers[i % 2]) for i in range(4)]
+
+    def counts(self):
+        return dict(Book.objects.values_list('title', 'purchase_count'))
+
+    def seller_sales(self):
+        return set(SellerSales.objects.values_list('seller__username', 'sales', 'revenue'))
+
+    def test_purchases_are_counted(self):
+        buy_book(self.buyers[0], self.books[0].id)
+        checkout(self.buyers[1], [self.books[0].id, self.books[1].id, self.books[3].id])
+        # A failed purchase is not counted
+        Wallet.objects.filter(owner=self.buyers[2]).update(balance=1)
+        buy_book(self.buyers[2], self.books[0].id)
+        self.assertEqual(self.counts(), {"Book0": 2, "Book1": 1, "Book2": 0, "Book3": 1})
+        self.assertEqual(self.seller_sales(), {("Seller0", 2, 20.0), ("Seller1", 2, 24.0)})
+
+    def test_edit_keeps_the_count(self):
+        book = Book.objects.get(pk=self.books[0].pk)
+        buy_book(self.buyers[0], book.id)
+        form = EditBookForm(data={'title': "Edited", 'author': "Bot", 'description': "A book", 'gender': "Sad",
+                                  'num_pages': 10, 'price': 10.0})
+        self.assertTrue(form.is_valid())
+        form.update_book(book)
+        self.assertEqual(self.counts()["Edited"], 1)
+
+    def test_reconcile(self):
+        buy_book(self.buyers[0], self.books[0].id)
+        checkout(self.buyers[1], [self.books[0].id, self.books[1].id])
+        expected, expected_sales = self.counts(), self.seller_sales()
+        # Purchases inserted without buy_book and counters changed by hand drift
+        self.books[2].purchasers.add(self.buyers[2])
+        Book.objects.filter(pk=self.books[0].pk).update(purchase_count=7)
+        SellerSales.objects.filter(seller=self.sellers[1]).delete()
+        output = io.StringIO()
+        call_command('reconcile_purchase_counts', '--dry-run', stdout=output)
+        self.assertIn("2 books and 1 sellers have drifted.", output.getvalue())
+        self.assertEqual(self.counts()["Book0"], 7)
+        call_command('reconcile_purchase_counts', stdout=output)
+        self.assertIn("2 books and 1 sellers have been repaired.", output.getvalue())
+        self.assertEqual(self.counts(), dict(expected, Book2=1))
+        # The purchase of Book2 has no sale record, the lifetime sales are read from the sale records
+        self.assertEqual(self.seller_sales(), expected_sales)
+        call_command('reconcile_purchase_counts', stdout=output)
+        self.assertIn("0 books and 0 sellers have drifted.", output.getvalue())
+
+    def test_bestsellers_api(self):
+        url = reverse('book:apiBestsellers')
+        for buyer in self.buyers:
+            checkout(buyer, [self.books[1].id, self.books[2].id])
+        checkout(self.buyers[0], [self.books[3].id])
+        # Equal counts are sorted by the newest book first, the books never purchased are left out
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual([(book['title'], book['purchase_count']) for book in response.json()['results']],
+                         [("Book2", 3), ("Book1", 3), ("Book3", 1)])
+        self.assertEqual([book['title'] for book in self.client.get(url, {'limit': 1}).json()['results']], ["Book2"])
+        self.assertEqual([book['title'] for book in self.client.get(url, {'gender': "Cool"}).json()['results']],
+                         ["Book1", "Book3"])
+        self.assertEqual(self.client.get(url, {'limit': 1000}).status_code, 400)
+        # A purchase changes the order, the previous version is not served anymore
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            buy_book(self.buyers[1], self.books[3].id)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_shop_bestsellers_follow_purchases(self):
+        url = reverse('book:apiShop')
+        response = self.client.get(url, {'sort': 'bestsellers'})
+        self.assertEqual(self.client.get(url, {'sort': 'date'}, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            buy_book(self.buyers[0], self.books[0].id)
+        response = self.client.get(url, {'sort': 'bestsellers'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['title'], "Book0")
+
+    def test_bestsellers_use_an_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('The query plans are read from the SQLite EXPLAIN QUERY PLAN.')
+        for books in (Book.objects.all(), Book.objects.filter(gender="Cool")):
+            plan = books.filter(purchase_count__gt=0).order_by('-purchase_count', '-id')[:10].explain()
+            self.assertIn('purchases_id_idx', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+# This class contains a set of tests that will verify the bundled and hashed static files, and how they are served
+class TestStaticAssets(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.static_root = os.path.join(directory.name, 'static')
+        # The font files, found by the FileSystemFinder
+        fonts = os.path.join(directory.name, 'fonts')
+        os.makedirs(os.path.join(fonts, 'book', 'fonts'))
+        for _, _, path in FONTS:
+            with open(os.path.join(fonts, path), 'wb') as font:
+                font.write(b'wOF2 font')
+        self.fonts = fonts
+        storages = dict(settings.STORAGES, staticfiles={'BACKEND': 'book.assets.CompressedManifestStaticFilesStorage'})
+        overridden = override_settings(STATIC_ROOT=self.static_root, STATICFILES_DIRS=[fonts], STORAGES=storages,
+                                       SERVE_STATIC=True)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        call_command('collectstatic', '--noinput', verbosity=0)
+        with open(os.path.join(self.static_root, 'staticfiles.json'), encoding='utf-8') as manifest:
+            self.manifest = json.load(manifest)['paths']
+
+    def read(self, name):
+        with open(os.path.join(self.static_root, name), 'rb') as static_file:
+            return static_file.read()
+
+    def test_minify_css(self):
+        css = "/* title */\nh1 ,h2 {\n    color : white;\n    margin: 0 auto;\n}\na :hover > b {}"
+        self.assertEqual(minify_css(css), "h1,h2{color :white;margin:0 auto}a :hover>b{}")
+
+    def test_manifest(self):
+        for bundle in BUNDLES:
+            self.assertRegex(self.manifest[bundle], r'^book/bundles/\w+\.[0-9a-f]{12}\.css$')
+            content = self.read(self.manifest[bundle])
+            self.assertEqual(gzip.decompress(self.read(self.manifest[bundle] + '.gz')), content)
+            self.assertNotIn(b'/*', content)
+            self.assertNotIn(b'\n', content)
+        # The url of each font is rewritten with its hashed name, a bundle only declares the fonts of its css files
+        content = self.read(self.manifest['book/bundles/shop.css']).decode()
+        for _, _, path in FONTS:
+            self.assertIn('url("../fonts/%s")' % os.path.basename(self.manifest[path]), content)
+        self.assertIn("font-display:swap", content)
+        content = self.read(self.manifest['book/bundles/login.css']).decode()
+        self.assertIn("font-family:'Comfortaa'", content)
+        self.assertNotIn("font-family:'Oswald'", content)
+
+    def test_missing_font(self):
+        os.remove(os.path.join(self.fonts, 'book/fonts/oswald-300.woff2'))
+        self.assertEqual([error.id for error in BundleFinder().check()], ['book.W001'])
+        # The bundle refers to a font that is not there, collectstatic fails instead of shipping it
+        with self.assertRaises(ValueError):
+            call_command('collectstatic', '--noinput', '--clear', verbosity=0, stderr=io.StringIO())
+
+    def test_templates_use_the_bundles(self):
+        response = self.client.get(reverse('book:shop'))
+        self.assertContains(response, '<link rel="stylesheet" href="%s%s">' % (
+            settings.STATIC_URL, self.manifest['book/bundles/shop.css']))
+        response = self.client.get(reverse('accounts:login'))
+        self.assertContains(response, '%s%s' % (settings.STATIC_URL, self.manifest['book/bundles/login.css']))
+        # The fonts of the bundle are preloaded from our static files, nothing is loaded from Google Fonts
+        self.assertContains(response, '<link rel="preload" href="%s%s" as="font" type="font/woff2" crossorigin>' % (
+            settings.STATIC_URL, self.manifest['book/fonts/comfortaa-700.woff2']))
+        self.assertNotContains(response, 'oswald')
+        self.assertNotContains(response, 'googleapis')
+
+    def test_served_with_cache_headers(self):
+        url = '%s%s' % (settings.STATIC_URL, self.manifest['book/bundles/shop.css'])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)),
+                         self.read(self.manifest['book/bundles/shop.css']))
+        # The name without hash can change, it is revalidated
+        response = self.client.get('%sbook/bundles/shop.css' % settings.STATIC_URL)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get('%sbook/missing.css' % settings.STATIC_URL).status_code, 404)
+
+
+# This class contains a set of tests that will verify the routing of the reads to the replicas, without a replica
+# database: the reads that would go to the replica are never made
+@override_settings(DATABASE_REPLICAS=['replica'])
+class TestReplicaRouter(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create(username="Seller")
+        self.buyer = User.objects.create(username="Buyer")
+        self.buyer.set_password("test123")
+        self.buyer.save()
+        Wallet.objects.create(balance=10.0, owner=self.buyer)
+        self.book = Book.objects.create(title="BookOne", author="Bot", publication_date=timezone.now(),
+                                        description="A book", gender="Cool", price=2.5, num_pages=10, owner=self.seller)
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Book))
+        state = RoutingState(pinned=False)
+        state.replica = 'replica'
+        token = routing_state.set(state)
+        try:
+            self.assertEqual(router.db_for_read(Book), 'replica')
+            # The sessions, the users and the models kept in the caches are read from the primary
+            self.assertIsNone(router.db_for_read(User))
+            self.assertIsNone(router.db_for_read(Wallet))
+            state.pinned = True
+            self.assertIsNone(router.db_for_read(Book))
+            state.pinned = False
+            self.assertEqual(router.db_for_write(Book), 'default')
+            self.assertTrue(state.wrote)
+            # The request reads what it wrote
+            self.assertIsNone(router.db_for_read(Book))
+        finally:
+            routing_state.reset(token)
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        self.client.login(username="Buyer", password="test123")
+        response = self.client.post(reverse('book:buyBook', args=(self.book.id,)), {'yes': 'YES'})
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'], 10)
+        # The purchased books are read from the primary, the replica is not even opened
+        self.assertContains(self.client.get(reverse('book:purchasedBooks')), "BookOne")
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_cookie_without_replica(self):
+        self.client.login(username="Buyer", password="test123")
+        response = self.client.post(reverse('book:buyBook', args=(self.book.id,)), {'yes': 'YES'})
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+
+# This class contains a set of tests that will verify the routing with a real replica: it runs with the two SQLite
+# databases of books/settings_replica.py. Nothing replicates the primary, so each read shows the database it went to.
+@unittest.skipUnless('replica' in settings.DATABASES, 'Needs a replica database (books/settings_replica.py).')
+@override_settings(DATABASE_REPLICAS=['replica'])
+class TestReplicaDatabases(TestCase):
+    databases = {'default', 'replica'} if 'replica' in settings.DATABASES else {'default'}
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(username="Seller")
+        self.buyer = User.objects.create(username="Buyer")
+        self.buyer.set_password("test123")
+        self.buyer.save()
+        Wallet.objects.create(balance=10.0, owner=self.buyer)
+        self.book = Book.objects.create(title="BookOne", author="Bot", publication_date=timezone.now(),
+                                        description="A book", gender="Cool", price=2.5, num_pages=10, owner=self.seller)
+
+    # The replica catches up with the primary
+    def replicate(self):
+        User.objects.using('replica').bulk_create(User.objects.all())
+        Book.objects.using('replica').bulk_create(Book.objects.all())
+
+    def test_lists_are_read_from_the_replica(self):
+        self.assertNotContains(self.client.get(reverse('book:shop')), "BookOne")
+        self.replicate()
+        self.assertContains(self.client.get(reverse('book:shop')), "BookOne")
+        # The pages that write are served by the primary
+        self.assertEqual(self.client.get(reverse('book:apiBook', args=(self.book.id,))).json()['title'], "BookOne")
+
+    def test_read_your_writes(self):
+        self.replicate()
+        self.client.login(username="Buyer", password="test123")
+        self.client.post(reverse('book:buyBook', args=(self.book.id,)), {'yes': 'YES'})
+        # The purchase is not replicated yet, the buyer sees it on the primary
+        self.assertContains(self.client.get(reverse('book:purchasedBooks')), "BookOne")
+        self.client.cookies.pop(STICKY_COOKIE)
+        self.assertNotContains(self.client.get(reverse('book:purchasedBooks')), "BookOne")
+
+
+# The tasks of the job tests: the calls are recorded, and a task fails as many times as told
+calls = []
+
+
+@task('test_record', max_attempts=2)
+def record_call(value, failures=0):
+    calls.append(value)
+    Wallet.objects.create(owner_id=User.objects.get(username='Worker').id, balance=value)
+    if calls.count(value) <= failures:
+        raise RuntimeError('Failure %d' % calls.count(value))
+
+
+# This class contains a set of tests that will verify the job queue: the idempotent enqueue, the retries, the failed
+# jobs and the metrics
+class TestJobs(TestCase):
+    def setUp(self):
+        calls.clear()
+        self.user = User.objects.create(username='Worker')
+
+    def due(self):
+        Job.objects.update(run_at=timezone.now())
+
+    def test_enqueue(self):
+        with self.assertRaises(ValueError):
+            enqueue('unknown')
+        with self.assertNumQueries(1):
+            enqueue('test_record', key='once', value=1)
+        enqueue('test_record', key='once', value=2)
+        enqueue('test_record', value=3)
+        enqueue('test_record', value=4, delay=60)
+        self.assertEqual(Job.objects.count(), 3)
+        self.assertEqual(run_due_jobs(), 2)
+        self.assertEqual(calls, [1, 3])
+        self.assertEqual(sorted(Job.objects.values_list('status', flat=True)), ['done', 'done', 'queued'])
+
+    def test_claim(self):
+        for value in range(3):
+            enqueue('test_record', value=value)
+        jobs = claim_jobs(2)
+        self.assertEqual([job.kwargs['value'] for job in jobs], [0, 1])
+        self.assertEqual({(job.status, job.attempts) for job in jobs}, {('running', 1)})
+        self.assertEqual([job.kwargs['value'] for job in claim_jobs(2)], [2])
+        self.assertEqual(claim_jobs(2), [])
+
+    def test_retry_then_fail(self):
+        enqueue('test_record', value=5, failures=1)
+        enqueue('test_record', value=6, failures=2)
+        with self.assertLogs('book.jobs', 'WARNING') as logs:
+            self.assertEqual(run_due_jobs(), 2)
+        self.assertIn('Job %d (test_record) failed, attempt 1 of 2' % Job.objects.get(kwargs__value=5).pk,
+                      logs.output[0])
+        job = Job.objects.get(kwargs__value=5)
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('RuntimeError: Failure 1', job.last_error)
+        self.assertGreater(job.run_at, timezone.now() + datetime.timedelta(seconds=5))
+        # The changes of a failed attempt are rolled back
+        self.assertFalse(Wallet.objects.exists())
+        self.assertEqual(run_due_jobs(), 0)
+        self.due()
+        with self.assertLogs('book.jobs', 'ERROR'):
+            self.assertEqual(run_due_jobs(), 2)
+        self.assertEqual(Job.objects.get(kwargs__value=5).status, 'done')
+        job = Job.objects.get(kwargs__value=6)
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertEqual(list(Wallet.objects.values_list('balance', flat=True)), [5.0])
+        self.assertEqual(calls, [5, 6, 5, 6])
+
+    def test_lost_and_old_jobs(self):
+        enqueue('test_record', value=7)
+        enqueue('test_record', value=8)
+        claim_jobs(2)
+        long_ago = timezone.now() - datetime.timedelta(days=30)
+        Job.objects.update(started_at=long_ago)
+        Job.objects.filter(kwargs__value=8).update(attempts=2)
+        clean_jobs()
+        self.assertEqual(dict(Job.objects.values_list('kwargs__value', 'status')), {7: 'queued', 8: 'failed'})
+        Job.objects.filter(kwargs__value=8).update(finished_at=long_ago)
+        clean_jobs()
+        self.assertEqual(list(Job.objects.values_list('kwargs__value', flat=True)), [7])
+
+    def test_metrics(self):
+        enqueue('test_record', value=9)
+        enqueue('test_record', value=10, delay=60)
+        metrics = job_metrics()
+        self.assertEqual((metrics['queued'], metrics['due'], metrics['done']), (2, 1, 0))
+        self.assertEqual(metrics['latency_ms'], {'p50': None, 'p95': None, 'max': None})
+        run_due_jobs()
+        metrics = job_metrics()
+        self.assertEqual((metrics['queued'], metrics['due'], metrics['done']), (1, 0, 1))
+        self.assertGreaterEqual(metrics['duration_ms']['max'], 0)
+
+        self.user.set_password('test123')
+        self.user.save()
+        self.client.login(username='Worker', password='test123')
+        self.assertEqual(self.client.get(reverse('book:apiJobs')).status_code, 403)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.client.get(reverse('book:apiJobs')).json()['done'], 1)
+
+    def test_tasks_are_registered(self):
+        self.assertIn('send_email', TASKS)
+        self.assertIn('send_password_reset', TASKS)
+
+
+# This class contains a set of tests that will verify the rate limits and the concurrency limits of the expensive views
+@override_settings(THROTTLE_ENABLED=True, THROTTLE_CLIENT_HEADER=None, THROTTLES={
+    'auth': {'views': ['accounts:login'], 'methods': ['POST'], 'rate': 0.01, 'burst': 1},
+    'shop': {'views': ['book:shop', 'book:apiShop'], 'rate': 0.01, 'burst': 2, 'route_rate': 0.01, 'route_burst': 3,
+             'concurrency': 1},
+    'purchase': {'views': ['book:buyBook'], 'rate': 0.01, 'burst': 5},
+})
+class TestThrottling(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def get(self, url, address='10.0.0.1', **extra):
+        return self.client.get(url, REMOTE_ADDR=address, **extra)
+
+    def test_token_buckets(self):
+        self.assertEqual(take_tokens([('bucket', 1, 2)], 100.0), 0)
+        self.assertEqual(take_tokens([('bucket', 1, 2)], 100.0), 0)
+        self.assertAlmostEqual(take_tokens([('bucket', 1, 2)], 100.25), 0.75)
+        # The bucket gets back a token per second, never more than the burst
+        self.assertEqual(take_tokens([('bucket', 1, 2)], 101.0), 0)
+        self.assertEqual(take_tokens([('bucket', 1, 2)], 1000.0), 0)
+        self.assertEqual(take_tokens([('bucket', 1, 2)], 1000.0), 0)
+        self.assertGreater(take_tokens([('bucket', 1, 2)], 1000.0), 0)
+        # Nothing is taken when one of the buckets is empty
+        self.assertGreater(take_tokens([('other', 1, 5), ('bucket', 1, 2)], 1000.0), 0)
+        self.assertEqual(cache.get('other'), None)
+
+    def test_client_and_route_buckets(self):
+        self.assertEqual(self.get(reverse('book:shop')).status_code, 200)
+        self.assertEqual(self.get(reverse('book:shop')).status_code, 200)
+        response = self.get(reverse('book:shop'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '100')
+        # Another client has its own bucket, but the whole shop has only 3 tokens
+        self.assertEqual(self.get(reverse('book:shop'), '10.0.0.2').status_code, 200)
+        self.assertEqual(self.get(reverse('book:shop'), '10.0.0.3').status_code, 429)
+        # The views out of the classes are not limited
+        self.assertEqual(self.get(reverse('book:index')).status_code, 200)
+
+    def test_api_and_methods(self):
+        for _ in range(3):
+            response = self.get(reverse('book:apiShop'))
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('retry in', response.json()['detail'])
+        # Only the posts of the login hash a password
+        for _ in range(3):
+            self.assertEqual(self.get(reverse('accounts:login')).status_code, 200)
+        self.assertEqual(self.client.post(reverse('accounts:login'), REMOTE_ADDR='10.0.0.1').status_code, 200)
+        self.assertEqual(self.client.post(reverse('accounts:login'), REMOTE_ADDR='10.0.0.1').status_code, 429)
+
+    @override_settings(THROTTLE_CLIENT_HEADER='HTTP_X_FORWARDED_FOR')
+    def test_client_header(self):
+        # The addresses sent by the client before the one added by the proxy do not give new buckets
+        for forged in ('1.1.1.1', '2.2.2.2'):
+            self.get(reverse('book:shop'), HTTP_X_FORWARDED_FOR='%s, 10.1.1.1' % forged)
+        self.assertEqual(self.get(reverse('book:shop'), HTTP_X_FORWARDED_FOR='3.3.3.3, 10.1.1.1').status_code, 429)
+        self.assertEqual(self.get(reverse('book:shop'), HTTP_X_FORWARDED_FOR='10.1.1.2').status_code, 200)
+
+    # Behind two proxies, the client is the address added by the first one
+    @override_settings(THROTTLE_CLIENT_HEADER='HTTP_X_FORWARDED_FOR', THROTTLE_PROXY_COUNT=2)
+    def test_proxy_count(self):
+        for forged in ('1.1.1.1', '2.2.2.2'):
+            self.get(reverse('book:shop'), HTTP_X_FORWARDED_FOR='%s, 10.1.1.1, 10.0.0.1' % forged)
+        self.assertEqual(self.get(reverse('book:shop'), HTTP_X_FORWARDED_FOR='10.1.1.1, 10.0.0.1').status_code, 429)
+        self.assertEqual(self.get(reverse('book:shop'), HTTP_X_FORWARDED_FOR='10.1.1.2, 10.0.0.1').status_code, 200)
+
+    def test_connected_user(self):
+        User.objects.create_user(username='Reader', password='test123')
+        self.client.login(username='Reader', password='test123')
+        for _ in range(2):
+            self.get(reverse('book:shop'), '10.0.0.1')
+        # The bucket belongs to the user, whatever the address
+        self.assertEqual(self.get(reverse('book:shop'), '10.0.0.2').status_code, 429)
+
+    # A shop request is served while another one arrives: the second one is refused at once, a purchase is served
+    def test_concurrency_and_priority(self):
+        seller = User.objects.create(username='Seller')
+        book = Book.objects.create(title='BookOne', author='Bot', publication_date=timezone.now(), description='A book',
+                                   gender='Cool', price=2.5, num_pages=10, owner=seller)
+        inner = []
+
+        def get_response(request):
+            if request.path == reverse('book:shop') and not inner:
+                for path in (reverse('book:shop'), reverse('book:buyBook', args=(book.id,))):
+                    nested = self.factory.get(path, REMOTE_ADDR='10.0.0.9')
+                    nested.user = AnonymousUser()
+                    inner.append(middleware(nested))
+            return HttpResponse('OK')
+
+        middleware = ThrottleMiddleware(get_response)
+        request = self.factory.get(reverse('book:shop'), REMOTE_ADDR='10.0.0.1')
+        request.user = AnonymousUser()
+        self.assertEqual(middleware(request).status_code, 200)
+        self.assertEqual([response.status_code for response in inner], [503, 200])
+        self.assertEqual(inner[0]['Retry-After'], '1')
+        # The slot is given back after the response
+        request = self.factory.get(reverse('book:shop'), REMOTE_ADDR='10.0.0.2')
+        request.user = AnonymousUser()
+        self.assertEqual(middleware(request).status_code, 200)
+
+    @override_settings(THROTTLE_ENABLED=False)
+    def test_disabled(self):
+        for _ in range(5):
+            self.assertEqual(self.get(reverse('book:shop')).status_code, 200)
+
+
+# This class contains a set of tests that will verify the identity map of the requests, and that the views of a book
+# load it once, without its owner. Each request of the views first reads the session and the connected user (2 queries).
+class TestIdentityMap(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(username='Seller', password='test123')
+        self.buyer = User.objects.create_user(username='Buyer', password='test123')
+        Wallet.objects.create(balance=0.0, owner=self.seller)
+        Wallet.objects.create(balance=100.0, owner=self.buyer)
+        self.book = Book.objects.create(title='Book', author='Bot', publication_date=timezone.now(),
+                                        description='A book', gender='Cool', price=2.5, num_pages=10, owner=self.seller)
+        self.client.force_login(self.seller)
+
+    def test_same_instance(self):
+        request = RequestFactory().get('/')
+        with self.assertNumQueries(1):
+            book = get_request_book(request, str(self.book.id))
+            self.assertIs(get_request_book(request, self.book.id), book)
+        # A missing book is kept too, an invalid id is not looked for
+        with self.assertNumQueries(1):
+            self.assertIsNone(get_request_book(request, 0))
+            self.assertIsNone(get_request_book(request, 0))
+            self.assertIsNone(get_request_book(request, 'x'))
+        identity_map = IdentityMap()
+        self.assertEqual(identity_map.get(Wallet, 1, lambda: 'wallet'), 'wallet')
+        self.assertEqual(identity_map.get(Wallet, 1, lambda: 'other'), 'wallet')
+
+    def test_edit_queries(self):
+        url = reverse('book:edit', args=(self.book.id,))
+        # The book
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.context['book'], self.book)
+        # The book, its previous facet (gender and price), then the update of the book and of its search terms
+        # (savepoint, previous terms, delete, insert, counts of the terms added and removed (two queries), release)
+        data = {'title': 'Other', 'author': 'Bot', 'description': 'A book', 'gender': 'Cool', 'num_pages': 10,
+                'price': 3, 'edit': 'Edit'}
+        with self.assertNumQueries(12):
+            self.assertRedirects(self.client.post(url, data), reverse('book:ownedBooks'),
+                                 fetch_redirect_response=False)
+        self.assertEqual(Book.objects.get(pk=self.book.id).title, 'Other')
+        # Only the book is read when the edit is cancelled
+        with self.assertNumQueries(3):
+            self.client.post(url, {key: value for key, value in data.items() if key != 'edit'})
+
+    def test_delete_queries(self):
+        url = reverse('book:delete', args=(self.book.id,))
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(3):
+            self.client.post(url, {'cancel': 'Cancel'})
+        # The book, its purchasers and its terms (with the counts of the terms, two queries) for the signals, then the
+        # deletion of the book and of its rows
+        with self.assertNumQueries(14):
+            self.assertRedirects(self.client.post(url, {'delete': 'Delete'}), reverse('book:ownedBooks'),
+                                 fetch_redirect_response=False)
+        self.assertFalse(Book.objects.filter(pk=self.book.id).exists())
+
+    def test_buy_queries(self):
+        self.client.force_login(self.buyer)
+        url = reverse('book:buyBook', args=(self.book.id,))
+        # The book and its recommendations
+        with self.assertNumQueries(4):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        # The book is not read again by buy_book
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, {'yes': 'YES'})
+        self.assertEqual(sum('FROM "book_book" ' in query['sql'] for query in queries.captured_queries), 1)
+        self.assertTrue(Purchase.objects.filter(book=self.book, buyer=self.buyer).exists())
+
+    def test_owner_not_loaded(self):
+        for url in [reverse('book:edit', args=(self.book.id,)), reverse('book:delete', args=(self.book.id,))]:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            # Only the connected user is read from the users
+            self.assertEqual(sum('FROM "auth_user"' in query['sql'] for query in queries.captured_queries), 1)
+
+    def test_not_owner_and_missing_book(self):
+        self.client.force_login(self.buyer)
+        self.assertRedirects(self.client.get(reverse('book:edit', args=(self.book.id,))), reverse('book:index'))
+        self.assertRedirects(self.client.get(reverse('book:edit', args=(0,))), reverse('book:index'))
+        self.assertRedirects(self.client.get(reverse('book:delete', args=(self.book.id,))),
+                             reverse('book:ownedBooks'))
+        self.assertEqual(self.client.get(reverse('book:delete', args=(0,))).status_code, 404)
+        self.assertEqual(self.client.get(reverse('book:buyBook', args=(0,))).status_code, 404)
+
+
+# This class contains a set of tests that will verify the sharded credits of the sellers: the balances summed when they
+# are read, the debits that count the credits and the compaction of the credits into the wallets
+class TestWalletCredits(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(username="Seller")
+        self.buyer = User.objects.create(username="Buyer")
+        Wallet.objects.create(balance=5.0, owner=self.seller)
+        Wallet.objects.create(balance=100.0, owner=self.buyer)
+
+    def balance(self, user):
+        cache.clear()
+        return get_wallet(user.id).balance
+
+    @override_settings(WALLET_CREDIT_SHARDS=4)
+    def test_credits_are_sharded(self):
+        for _ in range(40):
+            credit_wallets({self.seller.id: 2.5})
+        shards = dict(WalletCredit.objects.filter(owner=self.seller).values_list('shard', 'amount'))
+        self.assertTrue(1 < len(shards) <= 4)
+        self.assertEqual(sum(shards.values()), 100.0)
+        self.assertEqual(Wallet.objects.get(owner=self.seller).balance, 5.0)
+        self.assertEqual(self.balance(self.seller), 105.0)
+        # The credits written with another number of shards are still counted
+        with override_settings(WALLET_CREDIT_SHARDS=1):
+            credit_wallets({self.seller.id: 1.0, self.buyer.id: 2.0})
+        self.assertEqual(self.balance(self.seller), 106.0)
+        self.assertEqual(self.balance(self.buyer), 102.0)
+
+    def test_credit_queries(self):
+        # The missing shards, then the credits of every seller
+        with self.assertNumQueries(2):
+            credit_wallets({self.seller.id: 1.0, self.buyer.id: 2.0})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.balance(self.seller), 6.0)
+
+    def test_debit_counts_the_credits(self):
+        credit_wallets({self.seller.id: 10.0})
+        # The wallet alone is too low, the credits make up for it
+        self.assertTrue(debit_wallet(self.seller.id, 12.0))
+        self.assertEqual(Wallet.objects.get(owner=self.seller).balance, -7.0)
+        self.assertFalse(debit_wallet(self.seller.id, 3.5))
+        self.assertTrue(debit_wallet(self.seller.id, 3.0))
+        self.assertEqual(self.balance(self.seller), 0.0)
+        self.assertFalse(debit_wallet(User.objects.create(username="Poor").id, 1.0))
+        compact_wallets()
+        self.assertEqual(Wallet.objects.get(owner=self.seller).balance, 0.0)
+
+    def test_seller_buys_with_credits(self):
+        book = Book.objects.create(title="Book", author="Bot", publication_date=timezone.now(), description="A book",
+                                   gender="Cool", price=8.0, num_pages=10, owner=self.buyer)
+        credit_wallets({self.seller.id: 4.0})
+        self.assertEqual(buy_book(self.seller, book.id), PurchaseResult.SUCCESS)
+        self.assertEqual(self.balance(self.seller), 1.0)
+        self.assertEqual(self.balance(self.buyer), 108.0)
+
+    def test_compaction(self):
+        # The new sellers have no wallet yet
+        sellers = [User.objects.create(username="Seller%d" % i) for i in range(3)] + [self.seller]
+        for i, seller in enumerate(sellers):
+            for _ in range(i + 1):
+                credit_wallets({seller.id: 2.5})
+        self.assertEqual(compact_wallets(batch_size=2), (4, 25.0))
+        self.assertEqual(dict(Wallet.objects.values_list('owner__username', 'balance')),
+                         {"Buyer": 100.0, "Seller": 15.0, "Seller0": 2.5, "Seller1": 5.0, "Seller2": 7.5})
+        # The shards are kept, empty, for the next sales
+        self.assertEqual(set(WalletCredit.objects.values_list('amount', flat=True)), {0.0})
+        self.assertEqual(compact_wallets(), (0, 0.0))
+        self.assertEqual(self.balance(self.seller), 15.0)
+        credit_wallets({self.seller.id: 1.5})
+        output = io.StringIO()
+        call_command('compact_wallets', stdout=output)
+        self.assertIn('1 sellers compacted, 1.50 added', output.getvalue())
+        self.assertEqual(Wallet.objects.get(owner=self.seller).balance, 16.5)
+
+
+# This class contains a set of tests that will check that the catch up migration gives an owner to the existing books
+class TestCatchUpMigration(TransactionTestCase):
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.leaf = self.executor.loader.graph.leaf_nodes('book')
+        self.executor.migrate([('book', '0001_initial')])
+        # The production databases have the books table of the first migration, without the owner column
+        Book = self.executor.loader.project_state(('book', '0002_catch_up_model_state')).apps.get_model('book', 'Book')
+        OldBook = self.executor.loader.project_state(('book', '0001_initial')).apps.get_model('book', 'Book')
+        with connection.schema_editor() as editor:
+            editor.delete_model(Book)
+            editor.create_model(OldBook)
+        OldBook.objects.create(title="Old", author="Bot", publication_date=timezone.now(), num_pages=5)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.leaf)
+
+    def migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('book', '0002_catch_up_model_state')])
+
+    def test_add_owner(self):
+        with self.assertRaisesMessage(RuntimeError, 'The existing books need an owner'):
+            self.migrate()
+        User.objects.create_user(username="First", password="test123")
+        admin = User.objects.create_superuser(username="Admin", password="test123")
+        self.migrate()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT owner_id, description, gender, price FROM book_book')
+            self.assertEqual(cursor.fetchall(), [(admin.id, '', '', 0.0)])
+            columns = connection.introspection.get_table_description(cursor, 'book_book')
+        self.assertFalse(next(column for column in columns if column.name == 'owner_id').null_ok)
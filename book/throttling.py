@@ -0,0 +1,112 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.urls import Resolver404, resolve
+
+
+# This def takes a token from each given bucket, (key, rate, burst): a bucket holds at most burst tokens and gets back
+# rate tokens per second. The buckets are kept in the cache, shared by the processes, and are read and written with
+# one round trip each. Nothing is taken when a bucket is empty, and the number of seconds to wait for a token is
+# returned (0 when the tokens were taken). Two requests read at the same time can take the same token: the limits are
+# approximate, they are only meant to stop the floods.
+def take_tokens(buckets, now):
+    stored = cache.get_many([key for key, _, _ in buckets])
+    updated, wait = {}, 0.0
+    for key, rate, burst in buckets:
+        tokens, last = stored.get(key, (burst, now))
+        tokens = min(burst, tokens + max(now - last, 0) * rate)
+        if tokens < 1:
+            wait = max(wait, (1 - tokens) / rate)
+        updated[key] = (tokens - 1, now)
+    if not wait:
+        # A bucket that is not used again for this time is full, it can leave the cache
+        cache.set_many(updated, max(math.ceil(burst / rate) for _, rate, burst in buckets) + 1)
+    return wait
+
+
+# This middleware protects the expensive views (the shop, the password hashing of the login and of the signup) from the
+# floods. The views are grouped in classes (THROTTLES setting), and each class can have:
+# - a token bucket per client (the connected user, or the address of an anonymous client): rate and burst,
+# - a token bucket for the whole class, all the clients together: route_rate and route_burst,
+# - a maximum number of its requests served at the same time by this process: concurrency.
+# A request over a bucket gets a 429, a request over the concurrency gets a 503, both at once, with a Retry-After
+# header. The concurrency of the shop is kept below the number of threads of the server, so a flood of the shop always
+# leaves threads for the purchases, which have no concurrency limit and no bucket for the whole class.
+# Nothing is limited when THROTTLE_ENABLED is not set.
+class ThrottleMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        if not getattr(settings, 'THROTTLE_ENABLED', False):
+            return self.get_response(request)
+        view_name, name, throttle = self.match(request)
+        if throttle is None:
+            return self.get_response(request)
+        semaphore = self.semaphore(name, throttle.get('concurrency'))
+        # The concurrency is checked first: it costs no round trip to the cache
+        if semaphore is not None and not semaphore.acquire(blocking=False):
+            return self.reject(view_name, 503, 1, 'The server is busy, retry in %d seconds.')
+        try:
+            wait = take_tokens(self.buckets(request, name, throttle), time.time())
+            if wait:
+                return self.reject(view_name, 429, wait, 'Too many requests, retry in %d seconds.')
+            return self.get_response(request)
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    # This def returns the name of the view requested, and the name and the settings of its class
+    def match(self, request):
+        try:
+            view_name = resolve(request.path_info).view_name
+        except Resolver404:
+            return None, None, None
+        for name, throttle in getattr(settings, 'THROTTLES', {}).items():
+            if view_name in throttle['views'] and request.method in throttle.get('methods', [request.method]):
+                return view_name, name, throttle
+        return view_name, None, None
+
+    def buckets(self, request, name, throttle):
+        buckets = [('throttle:%s:%s' % (name, self.client(request)), throttle['rate'], throttle['burst'])]
+        if throttle.get('route_rate'):
+            buckets.append(('throttle:%s' % name, throttle['route_rate'], throttle['route_burst']))
+        return buckets
+
+    # A client is the connected user, or the address of an anonymous client. Behind a proxy, the address is read from
+    # the header set by the proxy (THROTTLE_CLIENT_HEADER). Each proxy appends the address it received the request from
+    # to the list, and the client can send any list it likes: the client is the address added by the first of our
+    # proxies, the THROTTLE_PROXY_COUNT-th address from the right. A client can not get a new bucket for each request
+    # by sending a new first address.
+    def client(self, request):
+        if request.user.is_authenticated:
+            return 'user-%d' % request.user.id
+        header = getattr(settings, 'THROTTLE_CLIENT_HEADER', None)
+        if not header:
+            return 'address-%s' % request.META.get('REMOTE_ADDR', '')
+        addresses = [address.strip() for address in request.META.get(header, '').split(',')]
+        proxies = getattr(settings, 'THROTTLE_PROXY_COUNT', 1)
+        return 'address-%s' % addresses[-min(proxies, len(addresses))]
+
+    def semaphore(self, name, concurrency):
+        if not concurrency:
+            return None
+        with self.lock:
+            if (name, concurrency) not in self.semaphores:
+                self.semaphores[name, concurrency] = threading.BoundedSemaphore(concurrency)
+            return self.semaphores[name, concurrency]
+
+    def reject(self, view_name, status, wait, message):
+        retry_after = max(math.ceil(wait), 1)
+        if view_name.startswith('book:api'):
+            response = JsonResponse({'detail': message % retry_after}, status=status)
+        else:
+            response = HttpResponse(message % retry_after, status=status, content_type='text/plain')
+        response['Retry-After'] = retry_after
+        return response
@@ -0,0 +1,176 @@
+import cProfile
+import contextlib
+import contextvars
+import logging
+import os
+import random
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger(__name__)
+
+# The timings of the request being handled, None outside of a request
+current_timer = contextvars.ContextVar('current_timer', default=None)
+
+
+# This class adds up where the time of a request goes: in the sql queries, in the templates, and in the rest of the
+# code (the view and the middlewares). The three parts do not overlap: the queries made while a template is rendered
+# (lazy querysets) are counted as sql, not as template.
+class RequestTimer:
+    __slots__ = ('start', 'queries', 'sql', 'template', 'template_sql', 'depth')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql = self.template = self.template_sql = 0.0
+        self.depth = 0
+
+    def add_query(self, elapsed):
+        self.queries += 1
+        self.sql += elapsed
+        if self.depth:
+            self.template_sql += elapsed
+
+    def timings(self):
+        total = time.perf_counter() - self.start
+        template = self.template - self.template_sql
+        return {'total_ms': round(total * 1000, 2), 'sql_ms': round(self.sql * 1000, 2), 'queries': self.queries,
+                'template_ms': round(template * 1000, 2), 'view_ms': round((total - self.sql - template) * 1000, 2)}
+
+
+# This execute wrapper is installed once on each database connection. The connections belong to a thread, and under
+# ASGI the queries of the async ORM run in other threads than the event loop: the timer of the request is found in the
+# context, which is shared with these threads. Outside of a request it only costs a context lookup.
+def execute_wrapper(execute, sql, params, many, context):
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.add_query(time.perf_counter() - start)
+
+
+# The wrapper is put first, the wrappers added with "with connection.execute_wrapper()" are removed from the end
+def install_execute_wrapper(sender=None, connection=None, **kwargs):
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, execute_wrapper)
+
+
+# This template wraps the templates of the django engine to time their rendering. Only the outer render is timed: a
+# template rendered while another one is rendered is already counted.
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        timer = current_timer.get()
+        if timer is None or timer.depth:
+            return super().render(context, request)
+        timer.depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timer.template += time.perf_counter() - start
+            timer.depth -= 1
+
+
+# This template backend is the django backend with timed templates (see TEMPLATES in the settings)
+class DjangoTemplates(django_backend.DjangoTemplates):
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
+
+
+# This middleware measures each request: number and duration of the sql queries, duration of the templates and of the
+# rest of the view. The result is sent in a Server-Timing header (shown by the network tab of the browsers) and in a
+# log line of the 'book.timing' logger. It must be the first middleware, so the queries of the other middlewares
+# (session, user) are counted.
+# With REQUEST_PROFILE_RATE, a fraction of the requests is run under cProfile and the profiles are written in
+# REQUEST_PROFILE_DIR, one .prof file per request (python -m pstats <file> to read them).
+# The queries made while a streamed response is sent, after the middleware returns, are not counted.
+class TimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.profile_rate = getattr(settings, 'REQUEST_PROFILE_RATE', 0.0)
+        self.profile_dir = getattr(settings, 'REQUEST_PROFILE_DIR', None) or os.path.join(settings.BASE_DIR,
+                                                                                          'profiles')
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # The connections opened from now on get the execute wrapper when they connect, the ones already opened now
+        connection_created.connect(install_execute_wrapper)
+        for connection in connections.all(initialized_only=True):
+            install_execute_wrapper(connection=connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.measure() as timer:
+            if self.profile_rate and random.random() < self.profile_rate:
+                response = self.profile(request)
+            else:
+                response = self.get_response(request)
+        return self.finish(request, response, timer)
+
+    async def __acall__(self, request):
+        with self.measure() as timer:
+            if self.profile_rate and random.random() < self.profile_rate:
+                response = await self.aprofile(request)
+            else:
+                response = await self.get_response(request)
+        return self.finish(request, response, timer)
+
+    @contextlib.contextmanager
+    def measure(self):
+        timer = RequestTimer()
+        token = current_timer.set(timer)
+        try:
+            yield timer
+        finally:
+            current_timer.reset(token)
+
+    def finish(self, request, response, timer):
+        timings = timer.timings()
+        response['Server-Timing'] = ('sql;dur=%(sql_ms)s;desc="%(queries)s queries", template;dur=%(template_ms)s, '
+                                     'view;dur=%(view_ms)s, total;dur=%(total_ms)s' % timings)
+        logger.info('%s %s %s total=%sms sql=%sms queries=%s template=%sms view=%sms', request.method, request.path,
+                    response.status_code, timings['total_ms'], timings['sql_ms'], timings['queries'],
+                    timings['template_ms'], timings['view_ms'],
+                    extra={'method': request.method, 'path': request.path, 'status': response.status_code, **timings})
+        return response
+
+    def profile(self, request):
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(self.get_response, request)
+        finally:
+            self.dump(request, profiler)
+
+    # The profiler sees everything that runs in the thread of the event loop, the other requests handled at the same
+    # time included. Only one profiler can run at a time, a request sampled while another one is profiled is not.
+    async def aprofile(self, request):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return await self.get_response(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            profiler.disable()
+            self.dump(request, profiler)
+
+    def dump(self, request, profiler):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = '%d-%s-%s.prof' % (time.time_ns(), request.method, re.sub(r'[^\w-]+', '_', request.path).strip('_'))
+        profiler.dump_stats(os.path.join(self.profile_dir, name[:200]))
@@ -1,6 +1,15 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Under ASGI, the book lists and the purchase confirmation are served by native async views
+if settings.ASYNC_VIEWS:
+    ShopView, BuyBookView = views.AsyncShopView, views.AsyncBuyBookView
+    OwnedBooksView, PurchasedBooksView = views.AsyncOwnedBooksView, views.AsyncPurchasedBooksView
+else:
+    ShopView, BuyBookView = views.ShopView, views.BuyBookView
+    OwnedBooksView, PurchasedBooksView = views.OwnedBooksView, views.PurchasedBooksView
+
 app_name = 'book'
 urlpatterns = [
     # The view for the main page where all books will be displayed
@@ -16,14 +25,38 @@ urlpatterns = [
     path('delete/<pk>/', views.DeleteConfirmView.as_view(), name='delete'),
 
     # The view to display books ready to be bought
-    path('shop/', views.ShopView.as_view(), name='shop'),
+    path('shop/', ShopView.as_view(), name='shop'),
+
+    # The view to search books on sale by title, author and description
+    path('search/', views.SearchView.as_view(), name='search'),
 
     # Book purchase confirmation will be displayed in this view.
-    path('shop/<int:num>', views.BuyBookView.as_view(), name='buyBook'),
+    path('shop/<int:num>', BuyBookView.as_view(), name='buyBook'),
+
+    # The cart of the connected user, the form that adds or removes a book, and the checkout of the whole cart.
+    path('cart/', views.CartView.as_view(), name='cart'),
+    path('cart/<int:num>', views.CartBookView.as_view(), name='cartBook'),
+    path('cart/checkout/', views.CheckoutView.as_view(), name='checkout'),
 
     # User-created books will be displayed in this view.
-    path('owned/', views.OwnedBooksView.as_view(), name='ownedBooks'),
+    path('owned/', OwnedBooksView.as_view(), name='ownedBooks'),
+
+    # The sales analytics of the books created by the user.
+    path('owned/sales/', views.SalesView.as_view(), name='sales'),
 
     # User-purchased books will be displayed in this view.
-    path('purchased/', views.PurchasedBooksView.as_view(), name='purchasedBooks'),
+    path('purchased/', PurchasedBooksView.as_view(), name='purchasedBooks'),
+
+    # The view that will stream the shop, the owned books or the purchased books as csv or json lines.
+    path('export/<str:scope>.<str:fmt>', views.ExportView.as_view(), name='export'),
+
+    # The read-only json api: the shop, the bestsellers, a single book, the wallet and the libraries of the connected
+    # user, and the metrics of the job queue.
+    path('api/shop/', views.ApiShopView.as_view(), name='apiShop'),
+    path('api/bestsellers/', views.ApiBestsellersView.as_view(), name='apiBestsellers'),
+    path('api/books/<int:pk>/', views.ApiBookView.as_view(), name='apiBook'),
+    path('api/wallet/', views.ApiWalletView.as_view(), name='apiWallet'),
+    path('api/owned/', views.ApiOwnedBooksView.as_view(), name='apiOwnedBooks'),
+    path('api/purchased/', views.ApiPurchasedBooksView.as_view(), name='apiPurchasedBooks'),
+    path('api/jobs/', views.ApiJobsView.as_view(), name='apiJobs'),
 ]
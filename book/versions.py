@@ -0,0 +1,38 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOG_VERSION_KEY = 'catalog-version'
+SALES_VERSION_KEY = 'sales-version'
+
+
+# The version of the catalog is the time, in nanoseconds, of the last change of a book. It is kept in the cache so the
+# API can tell if the catalog changed without querying the database. When the version is missing (first use or
+# evicted), the current time is used: the clients download the catalog once more, but never keep an outdated one.
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_catalog_version():
+    return get_version(CATALOG_VERSION_KEY)
+
+
+# This def must be called each time a book is created, edited or deleted. The version is changed once the transaction
+# is committed, otherwise a client could get the new version with the old catalog.
+def bump_catalog_version():
+    transaction.on_commit(lambda: cache.set(CATALOG_VERSION_KEY, time.time_ns(), None))
+
+
+# The version of the sales is changed by each purchase: the purchase counts of the books, and so the order of the
+# bestsellers, change without a change of the catalog.
+def get_sales_version():
+    return get_version(SALES_VERSION_KEY)
+
+
+def bump_sales_version():
+    transaction.on_commit(lambda: cache.set(SALES_VERSION_KEY, time.time_ns(), None))
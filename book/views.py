@@ -1,9 +1,76 @@
+import datetime
+
+from asgiref.sync import sync_to_async
 from django.views import generic
-from .models import Book, Wallet
+from .models import Book
 from django.shortcuts import render, HttpResponseRedirect, reverse, get_object_or_404, redirect
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.urls import reverse_lazy
-
-from .forms import EditBookForm, CreateBookForm, ConfirmationForm
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
+
+from .cart import add_to_cart, clear_cart, get_cart, remove_from_cart
+from .facets import aget_facets, get_facets
+from .export import EXPORT_FORMATS, EXPORT_SCOPES, export_lines, export_queryset
+from .forms import (BestsellersForm, EditBookForm, CreateBookForm, ConfirmationForm, SalesForm, SearchForm,
+                    ShopFilterForm)
+from .fragments import render_cards
+from .identity import aget_request_book, get_request_book
+from .jobs import job_metrics
+from .pagination import KeysetPaginationMixin, KeysetPaginator
+from .purchase import PurchaseResult, buy_book, checkout
+from .purchased import aget_purchased_books, get_purchased_books, get_version as get_purchased_version
+from .recommendations import (aget_recommendations, aget_user_recommendations, get_recommendations,
+                              get_user_recommendations)
+from .sales import seller_analytics
+from .search import search_books
+from .versions import get_catalog_version, get_sales_version
+from .wallets import aget_request_wallet, get_request_wallet
+
+
+# This def returns the books on sale for the given user: owned books are excluded directly in SQL.
+def shop_books(user):
+    return Book.objects.exclude(owner_id=user.id)
+
+
+# This def applies the filters of the shop form to the books and returns them with the keyset ordering of the chosen
+# sort. A filter with an invalid value is ignored. The gender and the author must match exactly, so every combination
+# of filters and sort order is read on one of the indexes of the Book model.
+def filter_shop(books, form):
+    form.is_valid()
+    data = form.cleaned_data
+    if data.get('gender'):
+        books = books.filter(gender=data['gender'])
+    if data.get('author'):
+        books = books.filter(author=data['author'])
+    if data.get('min_price') is not None:
+        books = books.filter(price__gte=data['min_price'])
+    if data.get('max_price') is not None:
+        books = books.filter(price__lte=data['max_price'])
+    return books, ShopFilterForm.SORTS[data.get('sort') or 'date']
+
+
+# The query string of a page without its cursor, so the pagination links keep the filters
+def query_without_cursor(request):
+    query = request.GET.copy()
+    query.pop('cursor', None)
+    return query
+
+
+# This def gives a 'purchased' flag to each displayed book in order to know if the user had already bought it. The
+# purchases of the user are read from the cache, so no query is made per book.
+def mark_purchased(books, user):
+    purchased = get_purchased_books(user.id) if user.is_authenticated else ()
+    for book in books:
+        book.purchased = book.id in purchased
+
+
+# The same def for the async views
+async def amark_purchased(books, user):
+    purchased = await aget_purchased_books(user.id) if user.is_authenticated else ()
+    for book in books:
+        book.purchased = book.id in purchased
 
 
 # The main page view. All books that are stored in the database will be returned as a queryset usable in the HTML code.
@@ -12,22 +79,21 @@ class LibraryBook(generic.TemplateView):
 
 
 # This view will display the books that the connected user have created and sold on the shop.
-class OwnedBooksView(generic.ListView):
+class OwnedBooksView(KeysetPaginationMixin, generic.ListView):
     # The choice to use the same template as purchased books view was made on purpose because they both have almost
     # the same layout
     template_name = 'book/books.html'
     model = Book
     context_object_name = 'library'
+    # The books are read from a read replica (see routers.py)
+    read_replica = True
 
     # This def will give extra context variables in addition to existing context variables to the template
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = 'BOOK MANAGER'
+        render_cards(context['library'], 'book/library_card.html')
         context['owned'] = True
-        try:
-            context['wallet'] = Wallet.objects.get(owner_id=self.request.user.id)
-        except(KeyError, Wallet.DoesNotExist):
-            return context
         return context
 
     def get_queryset(self):
@@ -42,22 +108,20 @@ class OwnedBooksView(generic.ListView):
 
 
 # This view will display the books purchased by the connected user in the shop.
-class PurchasedBooksView(generic.ListView):
+class PurchasedBooksView(KeysetPaginationMixin, generic.ListView):
     # The choice to use the same template as owned books view was made on purpose because they both have almost
     # the same layout
     template_name = 'book/books.html'
     model = Book
     context_object_name = 'library'
+    read_replica = True
 
     # This def will give extra context variables in addition to existing context variables to the template
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = 'PURCHASED BOOKS'
+        render_cards(context['library'], 'book/library_card.html')
         context['owned'] = False
-        try:
-            context['wallet'] = Wallet.objects.get(owner_id=self.request.user.id)
-        except(KeyError, Wallet.DoesNotExist):
-            return context
         return context
 
     def get_queryset(self):
@@ -71,47 +135,75 @@ class PurchasedBooksView(generic.ListView):
         return super().dispatch(request, *args, **kwargs)
 
 
-# This view have a form to edit book information in the database
-class EditBookView(generic.FormView):
+# This view will display the sales of the books of the connected user: the sales and the revenue of each day, and the
+# books that sold best, over the chosen period. Everything is read from the daily rollups, never from the sales.
+class SalesView(generic.TemplateView):
+    template_name = 'book/sales.html'
+
+    # This def will give extra context variables in addition to existing context variables to the template
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        form = SalesForm(self.request.GET)
+        days = (form.cleaned_data.get('days') if form.is_valid() else None) or 30
+        context['form'] = form
+        context['days'] = days
+        context.update(seller_analytics(self.request.user.id, days))
+        return context
+
+    # This function is called before the rendered page will be sent to the client in order to check if he is logged-in
+    # or not.
+    def dispatch(self, request, *args, **kwargs):
+        if not self.request.user.is_authenticated:
+            return HttpResponseRedirect(reverse('book:index'))
+        return super().dispatch(request, *args, **kwargs)
+
+
+# This mixin gives the views of a book of the connected user (edit, delete) the book of the url, loaded once per request
+# from the identity map: dispatch, get_context_data and form_valid all get the same instance. An anonymous user is
+# redirected to anonymous_url, and a user who does not own the book to not_owner_url. The owner is checked with the
+# owner_id of the book, the row of the owner is never loaded.
+class OwnedBookMixin:
+    book_url_kwarg = 'num'
+    anonymous_url = reverse_lazy('book:index')
+    not_owner_url = reverse_lazy('book:index')
+
+    def get_book(self):
+        return get_request_book(self.request, self.kwargs[self.book_url_kwarg])
+
+    # A book that does not exist is handled like the book of another user
+    def book_not_found(self):
+        return HttpResponseRedirect(self.not_owner_url)
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return HttpResponseRedirect(self.anonymous_url)
+        book = self.get_book()
+        if book is None:
+            return self.book_not_found()
+        if book.owner_id != request.user.id:
+            return HttpResponseRedirect(self.not_owner_url)
+        return super().dispatch(request, *args, **kwargs)
+
+
+# This view have a form to edit book information in the database. Only the creator of the book can edit it.
+class EditBookView(OwnedBookMixin, generic.FormView):
     template_name = 'book/edit.html'
     form_class = EditBookForm
     success_url = reverse_lazy('book:ownedBooks')
 
-    # A custom created def in order to retrieve a specific book related to the id given in the url
-    def get_book(self):
-        try:
-            num = self.kwargs['num']
-            book = Book.objects.get(pk=num)
-            return book
-        except(KeyError, Book.DoesNotExist):
-            return None
-
     # This def will give extra context variables in addition to existing context variables to the template
     def get_context_data(self, **kwargs):
-        try:
-            book = self.get_book()
-        except(KeyError, Book.DoesNotExist):
-            return HttpResponseRedirect(reverse('book:index'))
         context = super().get_context_data(**kwargs)
-        context['book'] = book
+        context['book'] = self.get_book()
         return context
 
     # This def will be called when the client will submit the form. it will update the book fields only if the 'edit'
     # submit input have been pressed. If the 'cancel' submit input have been pressed, the update book process will be skipped.
     def form_valid(self, form):
-        book = self.get_book()
         if 'edit' in self.request.POST:
-            form.update_book(book)
+            form.update_book(self.get_book())
         return super().form_valid(form)
 
-    # This function is called before the rendered page will be sent to the client in order to check if he is logged-in
-    # or not. It will also check if the book exists and if the connected user is the creator of the book
-    def dispatch(self, request, *args, **kwargs):
-        book = self.get_book()
-        if book is None or (not self.request.user.is_authenticated or book.owner.id != self.request.user.id):
-            return HttpResponseRedirect(reverse('book:index'))
-        return super().dispatch(request, *args, **kwargs)
-
 
 # This generic form view will create a book and add it to the database
 class CreateBookView(generic.FormView):
@@ -142,11 +234,21 @@ class CreateBookView(generic.FormView):
         return super().dispatch(request, *args, **kwargs)
 
 
-# This view have the purpose to confirm if the user wants to delete the book or not.
-class DeleteConfirmView(generic.DeleteView):
+# This view have the purpose to confirm if the user wants to delete the book or not. Only the creator of the book can
+# delete it, the other users are redirected to their own books.
+class DeleteConfirmView(OwnedBookMixin, generic.DeleteView):
     template_name = 'book/delete.html'
     model = Book
     success_url = reverse_lazy('book:ownedBooks')
+    book_url_kwarg = 'pk'
+    not_owner_url = reverse_lazy('book:ownedBooks')
+
+    def book_not_found(self):
+        raise Http404('No book found.')
+
+    # The book checked by dispatch is the one shown and deleted
+    def get_object(self, queryset=None):
+        return self.get_book()
 
     # This def will be called when the user will submit the form. If the client clicked on 'cancel' submit input,
     # he will be directly redirected to the ownedBooks view in order to avoid the book suppression performed in
@@ -156,45 +258,34 @@ class DeleteConfirmView(generic.DeleteView):
             return HttpResponseRedirect(reverse('book:ownedBooks'))
         return super().form_valid(form)
 
-    # This function is called before the page will be sent in order to verify if the user is authenticated and if
-    # the creator of the book matches with the connected user.
-    def dispatch(self, request, *args, **kwargs):
-        if not self.request.user.is_authenticated:
-            return HttpResponseRedirect(reverse('book:index'))
-        if self.get_object().owner.id is not request.user.id:
-            return HttpResponseRedirect(reverse('book:ownedBooks'))
-        return super().dispatch(request, *args, **kwargs)
-
 
 # This view will display the book on sale in the shop. The connected user can buy any book he wants only if he has
 # enough money in his wallet.
-class ShopView(generic.ListView):
+class ShopView(KeysetPaginationMixin, generic.ListView):
     template_name = 'book/shop.html'
     model = Book
     context_object_name = 'books'
+    read_replica = True
 
     # This def will give extra context variables in addition to existing context variables to the template
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
-        try:
-            context['wallet'] = Wallet.objects.get(owner_id=self.request.user.id)
-        except(KeyError, Wallet.DoesNotExist):
-            return context
+        mark_purchased(context['books'], self.request.user)
+        render_cards(context['books'], 'book/shop_card.html')
+        context['form'] = self.form
+        context['query'] = query_without_cursor(self.request)
+        context['facets'] = get_facets()
+        if self.request.user.is_authenticated:
+            context['recommended'] = get_user_recommendations(self.request.user.id,
+                                                              get_purchased_books(self.request.user.id))
         return context
 
-    # This get_queryset override def do a special data manipulation. It will create a dictionary in order to know
-    # for each book if he had already been purchased. Owned book will not be added to the dictionary.
+    # This get_queryset override def builds the whole shop in a single query, with the filters and the sort order
+    # given in the url.
     def get_queryset(self):
-        books = Book.objects.all()
-        toReturn = {}
-        for book in books:
-            purchased = False
-            for purchaser in book.purchasers.all():
-                if purchaser.id is self.request.user.id:
-                    purchased = True
-            if not book.owner.id == self.request.user.id:
-                toReturn[book] = purchased
-        return toReturn
+        self.form = ShopFilterForm(self.request.GET)
+        books, self.keyset_ordering = filter_shop(shop_books(self.request.user), self.form)
+        return books
 
 
 # This view is a transaction confirmation in order to make sure that the user wants to buy a book or no.
@@ -202,31 +293,61 @@ class BuyBookView(generic.FormView):
     template_name = 'book/buy.html'
     form_class = ConfirmationForm
     success_url = reverse_lazy('book:shop')
+    ERRORS = {
+        PurchaseResult.OWN_BOOK: 'You can not buy your own book.',
+        PurchaseResult.ALREADY_OWNED: 'You already bought this book.',
+        PurchaseResult.INSUFFICIENT_FUNDS: 'You do not have enough money in your wallet.',
+    }
+
+    # The book of the url, loaded once per request from the identity map
+    def get_book(self):
+        return get_request_book(self.request, self.kwargs['num'])
 
     # This def will be called after the user have submitted the form.
-    # If the client pressed the 'yes' submit input, verifications will be made in order to see if the connected user
-    # have enough money and if the connected user is not the one who sold the book.
-    # If all conditions have been satisfied, money will be retrieved from the user that purchased the book to the one
-    # who sold the book.
+    # If the client pressed the 'yes' submit input, the purchase is given to buy_book, which checks in the same
+    # transaction that the connected user have enough money and is not the one who sold the book, then moves the money
+    # from the user that purchased the book to the one who sold the book. When the purchase fails, the book is shown
+    # again with the reason.
     def form_valid(self, form):
         if 'yes' in self.request.POST:
-            book = Book.objects.get(pk=self.kwargs['num'])
-            if not book.purchasers.all().contains(self.request.user):
-                wallet = Wallet.objects.get(owner_id=self.request.user.id)
-                if wallet.balance >= book.price:
-                    wallet.balance -= book.price
-                    wallet.save()
-                    owner_wallet = Wallet.objects.get(owner_id=book.owner.id)
-                    owner_wallet.balance += book.price
-                    owner_wallet.save()
-                    book.purchasers.add(self.request.user)
-                    book.save()
+            result = buy_book(self.request.user, self.kwargs['num'], book=self.get_book())
+            if result == PurchaseResult.NOT_FOUND:
+                raise Http404('No book found.')
+            if result != PurchaseResult.SUCCESS:
+                return self.render_to_response(self.get_context_data(form=form, error=self.ERRORS[result]),
+                                               status=409)
         return super().form_valid(form)
 
     # This def will give extra context variables in addition to existing context variables to the template
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['book'] = Book.objects.get(pk=self.kwargs['num'])
+        context['book'] = self.get_book()
+        if context['book'] is None:
+            raise Http404('No book found.')
+        context['recommended'] = get_recommendations(context['book'].id)
+        return context
+
+    # This function is called before the page will be sent in order to verify if the user is authenticated
+    # Otherwise, it will redirect it to the shop page.
+    def dispatch(self, request, *args, **kwargs):
+        if not self.request.user.is_authenticated:
+            return HttpResponseRedirect(reverse('book:shop'))
+        return super().dispatch(request, *args, **kwargs)
+
+
+# This view will display the cart of the connected user with the total price, and a form to buy all of its books at
+# once. The books that are no longer on sale are not shown.
+class CartView(generic.TemplateView):
+    template_name = 'book/cart.html'
+
+    # This def will give extra context variables in addition to existing context variables to the template
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        cart = get_cart(self.request)
+        books = Book.objects.in_bulk(cart)
+        context['books'] = [books[book_id] for book_id in cart if book_id in books]
+        mark_purchased(context['books'], self.request.user)
+        context['total'] = round(sum(book.price for book in context['books']), 2)
         return context
 
     # This function is called before the page will be sent in order to verify if the user is authenticated
@@ -235,3 +356,374 @@ class BuyBookView(generic.FormView):
         if not self.request.user.is_authenticated:
             return HttpResponseRedirect(reverse('book:shop'))
         return super().dispatch(request, *args, **kwargs)
+
+
+# This view adds a book of the shop to the cart, or removes it when the 'remove' input is sent, then shows the cart
+class CartBookView(generic.View):
+    def post(self, request, num):
+        if not request.user.is_authenticated:
+            return HttpResponseRedirect(reverse('book:shop'))
+        if 'remove' in request.POST:
+            remove_from_cart(request, num)
+        else:
+            add_to_cart(request, num)
+        return HttpResponseRedirect(reverse('book:cart'))
+
+
+# This view buys every book of the cart at once with checkout, which validates the whole cart before anything is
+# written. When the checkout fails, the cart is shown again with the reason and the books concerned.
+class CheckoutView(CartView):
+    ERRORS = {
+        PurchaseResult.EMPTY_CART: 'Your cart is empty.',
+        PurchaseResult.NOT_FOUND: 'Some books are no longer on sale.',
+        PurchaseResult.OWN_BOOK: 'You can not buy your own books.',
+        PurchaseResult.ALREADY_OWNED: 'You already bought some of these books.',
+        PurchaseResult.INSUFFICIENT_FUNDS: 'You do not have enough money in your wallet.',
+    }
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponseRedirect(reverse('book:cart'))
+
+    def post(self, request, *args, **kwargs):
+        result, book_ids = checkout(request.user, get_cart(request))
+        if result == PurchaseResult.SUCCESS:
+            clear_cart(request)
+            return HttpResponseRedirect(reverse('book:purchasedBooks'))
+        # The books that are no longer on sale can not be shown, they are removed from the cart
+        if result == PurchaseResult.NOT_FOUND:
+            remove_from_cart(request, *book_ids)
+        return self.render_to_response(self.get_context_data(error=self.ERRORS[result], failed=book_ids), status=409)
+
+
+# This view will search the books on sale with the inverted index of search.py. Results are ranked by relevance and can
+# be filtered by gender and by price range.
+class SearchView(generic.ListView):
+    template_name = 'book/search.html'
+    context_object_name = 'books'
+    paginate_by = 20
+    read_replica = True
+
+    # This def will give extra context variables in addition to existing context variables to the template
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(**kwargs)
+        mark_purchased(context['books'], self.request.user)
+        context['form'] = self.form
+        context['query'] = self.request.GET.copy()
+        context['query'].pop('page', None)
+        return context
+
+    def get_queryset(self):
+        self.form = SearchForm(self.request.GET)
+        if not self.form.is_valid():
+            return []
+        books = shop_books(self.request.user)
+        if self.form.cleaned_data['gender']:
+            books = books.filter(gender__iexact=self.form.cleaned_data['gender'])
+        if self.form.cleaned_data['min_price'] is not None:
+            books = books.filter(price__gte=self.form.cleaned_data['min_price'])
+        if self.form.cleaned_data['max_price'] is not None:
+            books = books.filter(price__lte=self.form.cleaned_data['max_price'])
+        return search_books(self.form.cleaned_data['q'], books)
+
+
+# This view will stream an export of the books on sale, of the books owned or of the books purchased by the connected
+# user, in csv or in json lines. The response is sent while the books are read, chunk by chunk, so the memory used and
+# the time before the first byte do not depend on the number of books.
+class ExportView(generic.View):
+    chunk_size = 2000
+
+    def get(self, request, scope, fmt):
+        if scope not in EXPORT_SCOPES or fmt not in EXPORT_FORMATS:
+            raise Http404('Unknown export.')
+        lines = export_lines(export_queryset(scope, request.user), fmt, self.chunk_size)
+        response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[fmt])
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (scope, fmt)
+        return response
+
+    # This function is called before the export will be sent in order to check if the user is logged-in, only the
+    # shop can be exported by a visitor.
+    def dispatch(self, request, *args, **kwargs):
+        if kwargs['scope'] != 'shop' and not self.request.user.is_authenticated:
+            return HttpResponseRedirect(reverse('book:index'))
+        return super().dispatch(request, *args, **kwargs)
+
+
+# The json api. Every resource gives an ETag (and a Last-Modified date when it does not depend on the connected user)
+# computed from versions kept in the cache or from a single indexed column, so a client that already has the current
+# resource gets a '304 Not Modified' before the resource is read from the database or serialized.
+
+def serialize_book(book):
+    return {
+        'id': book.id,
+        'title': book.title,
+        'author': book.author,
+        'description': book.description,
+        'gender': book.gender,
+        'num_pages': book.num_pages,
+        'price': book.price,
+        'owner': book.owner_id,
+        'publication_date': book.publication_date,
+        'updated_at': book.updated_at,
+    }
+
+
+def version_to_date(version):
+    return datetime.datetime.fromtimestamp(version / 1e9, tz=datetime.timezone.utc)
+
+
+# The order of the bestsellers changes with each purchase, so their pages also depend on the version of the sales
+def shop_versions(request):
+    if request.GET.get('sort') == 'bestsellers':
+        return get_catalog_version(), get_sales_version()
+    return get_catalog_version(),
+
+
+def shop_etag(request, *args, **kwargs):
+    versions = '-'.join(str(version) for version in shop_versions(request))
+    if not request.user.is_authenticated:
+        return 'shop-%s' % versions
+    return 'shop-%s-%s-%s' % (versions, request.user.id, get_purchased_version(request.user.id))
+
+
+def shop_last_modified(request, *args, **kwargs):
+    if not request.user.is_authenticated:
+        return version_to_date(max(shop_versions(request)))
+    return None
+
+
+def bestsellers_etag(request, *args, **kwargs):
+    return 'bestsellers-%s-%s' % (get_catalog_version(), get_sales_version())
+
+
+def bestsellers_last_modified(request, *args, **kwargs):
+    return version_to_date(max(get_catalog_version(), get_sales_version()))
+
+
+def owned_etag(request, *args, **kwargs):
+    return 'owned-%s-%s' % (get_catalog_version(), request.user.id)
+
+
+def owned_last_modified(request, *args, **kwargs):
+    return version_to_date(get_catalog_version())
+
+
+def purchased_etag(request, *args, **kwargs):
+    return 'purchased-%s-%s-%s' % (get_catalog_version(), request.user.id, get_purchased_version(request.user.id))
+
+
+def wallet_etag(request, *args, **kwargs):
+    wallet = get_request_wallet(request)
+    return 'wallet-%s-%s' % (request.user.id, wallet.balance if wallet else None)
+
+
+# The update date of a book is read once per request, for the ETag and for the Last-Modified date
+def book_updated_at(request, pk, *args, **kwargs):
+    if not hasattr(request, '_book_updated_at'):
+        request._book_updated_at = Book.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    return request._book_updated_at
+
+
+def book_etag(request, pk, *args, **kwargs):
+    updated_at = book_updated_at(request, pk)
+    return 'book-%s-%s' % (pk, updated_at.timestamp()) if updated_at else None
+
+
+# This view is the base of the api views. It sends a 403 error in json to a visitor when the resource needs a
+# connected user.
+@method_decorator(vary_on_cookie, name='dispatch')
+class ApiView(generic.View):
+    login_required = True
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.login_required and not request.user.is_authenticated:
+            return JsonResponse({'detail': 'Authentication required.'}, status=403)
+        return super().dispatch(request, *args, **kwargs)
+
+
+# This api view is the base of the book lists, the subclasses give the books with get_queryset. The books are
+# paginated with the same cursors as the html views.
+class ApiBookListView(ApiView):
+    paginate_by = 20
+    keyset_ordering = ('publication_date', 'id')
+
+    def serialize(self, books):
+        return [serialize_book(book) for book in books]
+
+    def get(self, request, *args, **kwargs):
+        books = self.get_queryset()
+        page = KeysetPaginator(books, self.paginate_by, self.keyset_ordering).page(request.GET.get('cursor'))
+        return JsonResponse({'results': self.serialize(page.object_list), 'next': page.next_cursor,
+                             'previous': page.previous_cursor})
+
+
+@method_decorator(condition(etag_func=shop_etag, last_modified_func=shop_last_modified), name='get')
+class ApiShopView(ApiBookListView):
+    login_required = False
+
+    def get_queryset(self):
+        books, self.keyset_ordering = filter_shop(shop_books(self.request.user), ShopFilterForm(self.request.GET))
+        return books
+
+    def serialize(self, books):
+        mark_purchased(books, self.request.user)
+        return [dict(serialize_book(book), purchased=book.purchased) for book in books]
+
+
+@method_decorator(condition(etag_func=owned_etag, last_modified_func=owned_last_modified), name='get')
+class ApiOwnedBooksView(ApiBookListView):
+    def get_queryset(self):
+        return Book.objects.filter(owner_id=self.request.user.id)
+
+
+@method_decorator(condition(etag_func=purchased_etag), name='get')
+class ApiPurchasedBooksView(ApiBookListView):
+    def get_queryset(self):
+        return Book.objects.filter(purchasers__id=self.request.user.id)
+
+
+@method_decorator(condition(etag_func=book_etag, last_modified_func=book_updated_at), name='get')
+class ApiBookView(ApiView):
+    login_required = False
+
+    def get(self, request, pk):
+        return JsonResponse(serialize_book(get_object_or_404(Book, pk=pk)))
+
+
+# This api view returns the most purchased books, of every gender or of one gender, with their purchase count. The books
+# are read backwards on one of the (purchase_count, id) indexes, and the scan stops after the given number of books.
+@method_decorator(condition(etag_func=bestsellers_etag, last_modified_func=bestsellers_last_modified), name='get')
+class ApiBestsellersView(ApiView):
+    login_required = False
+    default_limit = 10
+
+    def get(self, request):
+        form = BestsellersForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'detail': form.errors}, status=400)
+        books = Book.objects.filter(purchase_count__gt=0)
+        if form.cleaned_data['gender']:
+            books = books.filter(gender=form.cleaned_data['gender'])
+        books = books.order_by('-purchase_count', '-id')[:form.cleaned_data['limit'] or self.default_limit]
+        return JsonResponse({'results': [dict(serialize_book(book), purchase_count=book.purchase_count)
+                                         for book in books]})
+
+
+@method_decorator(condition(etag_func=wallet_etag), name='get')
+class ApiWalletView(ApiView):
+    def get(self, request):
+        wallet = get_request_wallet(request)
+        return JsonResponse({'balance': wallet.balance if wallet else None})
+
+
+# This api view returns the metrics of the job queue (see jobs.job_metrics) for the monitoring, to the staff only
+class ApiJobsView(ApiView):
+    def get(self, request):
+        if not request.user.is_staff:
+            return JsonResponse({'detail': 'Staff only.'}, status=403)
+        return JsonResponse(job_metrics())
+
+
+# The async versions of the book lists and of the purchase confirmation, served instead of the sync views under ASGI
+# (see ASYNC_VIEWS in the settings). The books, the wallet and the purchases are read with the async ORM, so a request
+# does not hold a thread while it waits for the database.
+
+# Django 4.2 has no async api for the sessions: the session and the user are loaded with a single thread hop, then
+# request.user can be used by the async code and by the templates.
+async def aget_user(request):
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+# This view is the base of the async book lists, the subclasses give the books of the user with get_queryset. It gives
+# the same context as a ListView with the KeysetPaginationMixin, so the templates are the same as the sync views.
+class AsyncBookListView(KeysetPaginationMixin, generic.View):
+    template_name = 'book/books.html'
+    context_object_name = 'library'
+    card_template_name = 'book/library_card.html'
+    login_required = True
+    read_replica = True
+
+    async def get_context_data(self, user, books):
+        return {}
+
+    async def get(self, request, *args, **kwargs):
+        user = await aget_user(request)
+        if self.login_required and not user.is_authenticated:
+            return HttpResponseRedirect(reverse('book:index'))
+        paginator = KeysetPaginator(self.get_queryset(user), self.paginate_by, self.keyset_ordering)
+        page = await paginator.apage(request.GET.get(self.cursor_kwarg))
+        context = {'view': self, 'paginator': paginator, 'page_obj': page, 'is_paginated': page.has_other_pages(),
+                   'object_list': page.object_list, self.context_object_name: page.object_list}
+        context.update(await self.get_context_data(user, page.object_list))
+        render_cards(page.object_list, self.card_template_name)
+        # The wallet is shown by the templates, it must be loaded before they are rendered
+        await aget_request_wallet(request, user)
+        return render(request, self.template_name, context)
+
+
+class AsyncOwnedBooksView(AsyncBookListView):
+    def get_queryset(self, user):
+        return Book.objects.filter(owner_id=user.id)
+
+    async def get_context_data(self, user, books):
+        return {'title': 'BOOK MANAGER', 'owned': True}
+
+
+class AsyncPurchasedBooksView(AsyncBookListView):
+    def get_queryset(self, user):
+        return Book.objects.filter(purchasers__id=user.id)
+
+    async def get_context_data(self, user, books):
+        return {'title': 'PURCHASED BOOKS', 'owned': False}
+
+
+class AsyncShopView(AsyncBookListView):
+    template_name = 'book/shop.html'
+    context_object_name = 'books'
+    card_template_name = 'book/shop_card.html'
+    login_required = False
+
+    def get_queryset(self, user):
+        self.form = ShopFilterForm(self.request.GET)
+        books, self.keyset_ordering = filter_shop(shop_books(user), self.form)
+        return books
+
+    async def get_context_data(self, user, books):
+        await amark_purchased(books, user)
+        context = {'form': self.form, 'query': query_without_cursor(self.request), 'facets': await aget_facets()}
+        if user.is_authenticated:
+            context['recommended'] = await aget_user_recommendations(user.id, await aget_purchased_books(user.id))
+        return context
+
+
+class AsyncBuyBookView(generic.View):
+    template_name = 'book/buy.html'
+    success_url = reverse_lazy('book:shop')
+
+    async def get(self, request, num):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return HttpResponseRedirect(reverse('book:shop'))
+        return await self.render_book(request, num)
+
+    async def render_book(self, request, num, status=200, error=None):
+        book = await aget_request_book(request, num)
+        if book is None:
+            raise Http404('No book found.')
+        return render(request, self.template_name, {'view': self, 'form': ConfirmationForm(), 'book': book,
+                                                    'recommended': await aget_recommendations(book.id),
+                                                    'error': error}, status=status)
+
+    # The purchase is made in a transaction, which the async ORM can not do: buy_book is run in a thread. When the
+    # purchase fails, the book is shown again with the reason, like the sync view.
+    async def post(self, request, num):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return HttpResponseRedirect(reverse('book:shop'))
+        if 'yes' in request.POST:
+            result = await sync_to_async(buy_book)(user, num)
+            if result == PurchaseResult.NOT_FOUND:
+                raise Http404('No book found.')
+            if result != PurchaseResult.SUCCESS:
+                return await self.render_book(request, num, status=409, error=BuyBookView.ERRORS[result])
+        return HttpResponseRedirect(self.success_url)
@@ -0,0 +1,146 @@
+import functools
+import operator
+import random
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, FloatField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .expressions import case
+from .identity import get_identity_map
+from .models import Wallet, WalletCredit
+
+WALLET_CACHE_TIMEOUT = getattr(settings, 'WALLET_CACHE_TIMEOUT', 300)
+
+
+def wallet_cache_key(user_id):
+    return 'wallet:%s' % user_id
+
+
+# The number of shards the credits of a seller are spread over. It is read on each credit, so it can be changed
+# without losing the credits already written: the shards are summed whatever their number.
+def get_credit_shards():
+    return max(getattr(settings, 'WALLET_CREDIT_SHARDS', 8), 1)
+
+
+# This query reads the wallets with their balance plus the credits not added to them yet, in one query
+def wallets_with_credits():
+    credits = (WalletCredit.objects.filter(owner_id=OuterRef('owner_id')).order_by().values('owner_id')
+               .annotate(total=Sum('amount')).values('total'))
+    return Wallet.objects.annotate(credits=Coalesce(Subquery(credits), 0.0, output_field=FloatField()))
+
+
+# The balance of the wallets read by get_wallet includes the credits: the wallets are never saved, their balance is
+# only changed with updates.
+def add_credits(wallet):
+    if wallet:
+        wallet.balance += wallet.credits
+    return wallet
+
+
+# This def returns the wallet of a user from the cache, and only reads the database when the wallet is not cached yet.
+# A user without wallet is cached too (as False), so he does not query the database on each page either.
+def get_wallet(user_id):
+    key = wallet_cache_key(user_id)
+    wallet = cache.get(key)
+    if wallet is None:
+        wallet = add_credits(wallets_with_credits().filter(owner_id=user_id).first()) or False
+        cache.set(key, wallet, WALLET_CACHE_TIMEOUT)
+    return wallet or None
+
+
+# The same def for the async views, the wallet is read with the async ORM
+async def aget_wallet(user_id):
+    key = wallet_cache_key(user_id)
+    wallet = cache.get(key)
+    if wallet is None:
+        wallet = add_credits(await wallets_with_credits().filter(owner_id=user_id).afirst()) or False
+        cache.set(key, wallet, WALLET_CACHE_TIMEOUT)
+    return wallet or None
+
+
+# This def returns the wallet of the connected user. It is loaded at most once per request and is kept in the identity
+# map of the request for the other calls.
+def get_request_wallet(request):
+    if not request.user.is_authenticated:
+        return None
+    return get_identity_map(request).get(Wallet, request.user.id, lambda: get_wallet(request.user.id))
+
+
+# The async views load the wallet before the template is rendered, so the context processor finds it in the identity
+# map and does not query the database from the event loop.
+async def aget_request_wallet(request, user):
+    if not user.is_authenticated:
+        return None
+    return await get_identity_map(request).aget(Wallet, user.id, lambda: aget_wallet(user.id))
+
+
+# This def must be called each time the balance of a wallet is changed. The cache is only cleared once the transaction
+# is committed, otherwise another request could cache the old balance again before the new one is visible.
+def invalidate_wallets(*user_ids):
+    transaction.on_commit(lambda: cache.delete_many([wallet_cache_key(user_id) for user_id in user_ids]))
+
+
+# This def takes the given amount from the balance of a user, in the transaction of a purchase, and returns False when
+# the balance is too low. The amount is taken from the wallet with a conditional update ("... WHERE balance >=
+# amount"), the balance of the wallet can never go below the amount. When the wallet alone is too low, the credits of
+# the user are counted too: the wallet and then the credits are locked (in the order of compact_wallets), so a
+# compaction running at the same time is either committed or not started when they are read. The wallet can then go
+# below zero, the credits make up for it.
+def debit_wallet(user_id, amount):
+    if Wallet.objects.filter(owner_id=user_id, balance__gte=amount).update(balance=F('balance') - amount):
+        return True
+    wallet = Wallet.objects.select_for_update().filter(owner_id=user_id).values_list('id', 'balance').first()
+    credits = sum(WalletCredit.objects.select_for_update().filter(owner_id=user_id).values_list('amount', flat=True))
+    if wallet is None or wallet[1] + credits < amount:
+        return False
+    Wallet.objects.filter(pk=wallet[0]).update(balance=F('balance') - amount)
+    return True
+
+
+# This def adds the given amounts ({user id: amount}) to the balances of the sellers, in the transaction of a purchase,
+# with two queries whatever the number of sellers. The wallets are not written: each seller is credited on one of their
+# shards, chosen at random, so the purchases of a popular seller are spread over WALLET_CREDIT_SHARDS rows instead of
+# all waiting for the lock of the wallet row. Like the sales rollups, the missing shards are inserted with a zero
+# amount ("INSERT ... ON CONFLICT DO NOTHING") and then every shard is incremented with a single update.
+def credit_wallets(credits):
+    shards = {owner_id: random.randrange(get_credit_shards()) for owner_id in credits}
+    WalletCredit.objects.bulk_create([WalletCredit(owner_id=owner_id, shard=shard)
+                                      for owner_id, shard in shards.items()], ignore_conflicts=True)
+    rows = functools.reduce(operator.or_, [Q(owner_id=owner_id, shard=shard) for owner_id, shard in shards.items()])
+    WalletCredit.objects.filter(rows).update(amount=F('amount') + case('owner_id', credits, FloatField()))
+
+
+# This def adds the credits of the sellers to their wallets, and returns the number of sellers and the amount added.
+# The sellers are compacted by batches, one transaction each. The credits are read without lock, added to the wallets
+# (a seller without wallet gets one), then taken from the shards they were read from ("amount = amount - ..."): a sale
+# credited while its seller is compacted stays in its shard until the next compaction, nothing is lost or counted
+# twice. The wallets are locked before the shards, like in debit_wallet. The shards are kept for the next sales, and
+# the balances do not change: the cached wallets stay valid.
+def compact_wallets(batch_size=500):
+    sellers, total, last = 0, 0.0, None
+    while True:
+        with transaction.atomic():
+            pending = WalletCredit.objects.exclude(amount=0)
+            if last is not None:
+                pending = pending.filter(owner_id__gt=last)
+            owners = list(pending.order_by('owner_id').values_list('owner_id', flat=True).distinct()[:batch_size])
+            if not owners:
+                return sellers, total
+            rows = pending.filter(owner_id__in=owners).values_list('id', 'owner_id', 'amount')
+            amounts, credits = {}, defaultdict(float)
+            for credit_id, owner_id, amount in rows:
+                amounts[credit_id] = amount
+                credits[owner_id] += amount
+            existing = set(Wallet.objects.filter(owner_id__in=credits).values_list('owner_id', flat=True))
+            Wallet.objects.bulk_create([Wallet(owner_id=owner_id, balance=0.0) for owner_id in sorted(credits)
+                                        if owner_id not in existing])
+            Wallet.objects.filter(owner_id__in=credits).update(
+                balance=F('balance') + case('owner_id', credits, FloatField()))
+            WalletCredit.objects.filter(pk__in=amounts).update(amount=F('amount') - case('id', amounts, FloatField()))
+        sellers += len(credits)
+        total += sum(credits.values())
+        last = owners[-1]
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 import sys
 
@@ -43,11 +44,19 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Must stay first: it times the whole request, the other middlewares included
+    'book.timing.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Serves the collected static files when SERVE_STATIC is set, before the sessions are read
+    'book.assets.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Rejects the floods of the expensive views before they run, see THROTTLES
+    'book.throttling.ThrottleMiddleware',
+    # Sends the reads of the book lists to the read replicas, see DATABASE_REPLICAS
+    'book.routers.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -56,7 +65,8 @@ ROOT_URLCONF = 'books.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The django backend, with the rendering of the templates timed for the TimingMiddleware
+        'BACKEND': 'book.timing.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates']
         ,
         'APP_DIRS': True,
@@ -66,6 +76,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'book.context_processors.wallet',
             ],
         },
     },
@@ -73,6 +84,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'books.wsgi.application'
 
+# Serve the book lists and the purchase confirmation with the async views. It is enabled by books/asgi.py: under WSGI,
+# an async view would be run in a new event loop for each request.
+ASYNC_VIEWS = os.environ.get('BOOK_ASYNC_VIEWS') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
@@ -96,6 +111,96 @@ DATABASES = {
     }
 }
 
+# The read replicas of the default database (aliases of DATABASES). The book lists and the search read the books from
+# one of them, everything else uses the default database (see book/routers.py). Without replica, every query goes to
+# the default database. books/settings_replica.py tries the routing with two SQLite databases.
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['book.routers.ReplicaRouter']
+
+# Number of seconds the reads of a user stay on the default database after a write, it must be longer than the usual
+# replication lag
+REPLICA_STICKY_SECONDS = 10
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The local-memory cache is private to each process: a deployment running several processes must use a shared backend
+# (memcached, redis...) so that a wallet invalidated by one process is not still cached by the others.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        # The default limit of 300 entries is too low to keep the wallets, the purchases and the book cards
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+
+# Number of seconds a wallet stays in the cache when its balance does not change
+WALLET_CACHE_TIMEOUT = 300
+
+# Number of rows the credits of the sales of a seller are spread over (see book/wallets.py), so the purchases of a
+# popular seller do not all wait for the same row. The compact_wallets command adds them to the wallets.
+WALLET_CREDIT_SHARDS = 8
+
+# Number of seconds the purchased books of a user stay in the cache when they do not change
+PURCHASED_CACHE_TIMEOUT = 3600
+
+# Number of seconds the html of a book card stays in the cache
+BOOK_CARD_CACHE_TIMEOUT = 3600
+
+# Number of seconds the facet counts of a version of the catalog stay in the cache
+FACETS_CACHE_TIMEOUT = 3600
+
+# Fraction of the requests run under cProfile by the TimingMiddleware (0 disables the profiling), and the directory
+# where the profiles are written
+REQUEST_PROFILE_RATE = 0.0
+REQUEST_PROFILE_DIR = BASE_DIR / 'profiles'
+
+# Set the level of the 'book.timing' logger to INFO to log the timings of every request
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'book.timing': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+        # The failed jobs and the metrics of the queue, logged by the run_jobs worker
+        'book.jobs': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# The rate limits of the expensive views (see book/throttling.py), by class of views: a token bucket per client (rate
+# requests per second, up to burst at once), an optional bucket for all the clients together (route_rate and
+# route_burst), and the maximum number of requests of the class served at the same time by a process (concurrency).
+# The concurrency of the shop must stay below the number of threads of the server: the purchases have the priority,
+# they are never refused because the server is busy. The limits are only applied when THROTTLE_ENABLED is set.
+THROTTLE_ENABLED = not DEBUG
+THROTTLES = {
+    # The password hashing of the login, of the signup and of the password reset
+    'auth': {'views': ['accounts:login', 'accounts:signup', 'accounts:password_reset'], 'methods': ['POST'],
+             'rate': 0.2, 'burst': 10, 'route_rate': 20, 'route_burst': 50, 'concurrency': 2},
+    # The book lists that read the whole catalog. The bucket of the whole class keeps most of a small server for the
+    # other pages: the shop takes about 20ms of cpu, 20 pages per second use less than half of a core.
+    'shop': {'views': ['book:shop', 'book:search', 'book:apiShop'],
+             'rate': 2, 'burst': 10, 'route_rate': 20, 'route_burst': 40, 'concurrency': 2},
+    'purchase': {'views': ['book:buyBook', 'book:cartBook', 'book:checkout'], 'rate': 5, 'burst': 30},
+}
+
+# The header holding the address of the clients when the server is behind a proxy (e.g. 'HTTP_X_FORWARDED_FOR'), the
+# address of the connection is used when it is not set. THROTTLE_PROXY_COUNT is the number of our proxies that append
+# an address to the header.
+THROTTLE_CLIENT_HEADER = None
+THROTTLE_PROXY_COUNT = 1
+
+# The background jobs (see book/jobs.py), run by the run_jobs command: number of jobs run at the same time by a worker,
+# number of attempts of a job, seconds before the second attempt (doubled for each following attempt), seconds after
+# which a running job is considered lost, and days the finished jobs are kept.
+JOB_WORKER_THREADS = 4
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 10
+JOB_TIMEOUT = 300
+JOB_KEEP_DAYS = 7
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -132,6 +237,34 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# collectstatic copies the static files in this directory
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# The css files of each page are bundled and minified by the BundleFinder (see book/assets.py)
+STATICFILES_FINDERS = [
+    'django.contrib.staticfiles.finders.FileSystemFinder',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+    'book.assets.BundleFinder',
+]
+
+# In production, the collected files get a hash of their content in their name and precompressed variants, so they
+# can be cached forever by the browsers. The development server serves the files as they are.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': ('django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+                    else 'book.assets.CompressedManifestStaticFilesStorage'),
+    },
+}
+
+# Serve the collected static files with django (StaticFilesMiddleware), when no web server serves STATIC_ROOT
+SERVE_STATIC = not DEBUG
+
+# Number of seconds a static file without a hash in its name stays in the cache of the browsers
+STATIC_MAX_AGE = 60
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
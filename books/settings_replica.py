@@ -0,0 +1,18 @@
+# These settings try the replica routing locally, with two SQLite databases standing for the MySQL primary and its read
+# replica. Nothing replicates the primary into the replica here: copy primary.sqlite3 to replica.sqlite3 to "catch
+# up", the pages then show which database each read went to.
+# Example: python manage.py test book.tests.TestReplicaDatabases --settings=books.settings_replica
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'primary.sqlite3',
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'replica.sqlite3',
+    },
+}
+
+DATABASE_REPLICAS = ['replica']